@@ -0,0 +1,7 @@
+"""
+Micro-benchmarks for the API's hot paths.
+
+Run from ``backend/`` as modules, e.g. ``python -m benchmarks.post_counts``.
+Every benchmark builds its own throwaway test database, so the development
+database is never touched.
+"""
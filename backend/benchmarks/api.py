@@ -0,0 +1,137 @@
+"""
+End-to-end API latency and query counts on a generated dataset.
+
+Builds a dataset with ``core.datagen`` (fixed seed, so every run reads the
+same rows), then requests each read endpoint in-process through Django's
+test client, middleware included, and reports p50/p99 latency and the
+queries per request (from the ``Server-Timing`` header). The response cache
+is off unless ``--cache`` is given, so the numbers are the database path.
+
+Results can be saved as a baseline and later runs compared against it. A
+run that needs more queries than the baseline, or whose p50 is more than
+``--tolerance`` percent slower, exits non-zero.
+
+    python -m benchmarks.api [--repeat 30] [--posts 2000] [--save | --compare]
+"""
+import argparse
+import json
+import re
+import sys
+from pathlib import Path
+
+from benchmarks.harness import measure, percentile, report, test_database
+
+from django.contrib.auth.models import User
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings
+
+from core import datagen
+from core.models import Comment, Post
+
+BASELINE = Path(__file__).with_name('baselines') / 'api.json'
+DATASET = ('users', 'posts', 'post_likes', 'comment_likes', 'seed')
+
+
+def queries(response):
+    match = re.search(r'desc="(\d+) queries"', response.get('Server-Timing', ''))
+    return int(match.group(1)) if match else None
+
+
+def endpoints(viewer):
+    """``(label, client, url)`` for every endpoint benchmarked."""
+    anonymous, signed_in = Client(), Client()
+    signed_in.force_login(viewer)
+
+    deep_page = '/api/posts/'
+    for _ in range(9):
+        deep_page = anonymous.get(deep_page).json()['next']
+
+    hot_post = Post.objects.order_by('-comment_count', 'pk').first()
+    busy_comment = (
+        Comment.objects.filter(post=hot_post).annotate(children=Count('replies')).order_by('-children', 'pk').first()
+    )
+    return [
+        ('feed', anonymous, '/api/posts/'),
+        ('feed (signed in)', signed_in, '/api/posts/'),
+        ('feed page 10', anonymous, deep_page),
+        ('feed ?sort=hot', anonymous, '/api/posts/?sort=hot'),
+        ('comments (busiest post)', signed_in, f'/api/posts/{hot_post.pk}/comments/'),
+        ('replies (busiest comment)', signed_in, f'/api/comments/{busy_comment.pk}/replies/'),
+        ('leaderboard', anonymous, '/api/leaderboard/'),
+        ('me', signed_in, '/api/me/'),
+    ]
+
+
+def run(args):
+    results = {}
+    for label, client, url in endpoints(User.objects.filter(username='load0').get()):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise SystemExit(f"{label}: GET {url} returned {response.status_code}")
+        samples = measure(lambda: client.get(url), args.repeat)
+        results[label] = {
+            'p50': round(percentile(samples, 50), 3),
+            'p99': round(percentile(samples, 99), 3),
+            'queries': queries(response),
+        }
+        report(f"{label} ({results[label]['queries']} queries)", samples)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the change against ``baseline``; return the regressions."""
+    regressions = []
+    for label, now in results.items():
+        before = baseline.get(label)
+        if before is None:
+            continue
+        change = (now['p50'] - before['p50']) / before['p50'] * 100
+        print(f"{label:<40} p50 {change:+7.1f}%   queries {before['queries']} -> {now['queries']}")
+        if now['queries'] > before['queries']:
+            regressions.append(f"{label}: {now['queries']} queries, baseline {before['queries']}")
+        if change > tolerance:
+            regressions.append(f"{label}: p50 {change:+.1f}% over baseline")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--posts', type=int, default=2000)
+    parser.add_argument('--post-likes', type=int, default=20000)
+    parser.add_argument('--comment-likes', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cache', action='store_true', help="Leave the response cache on.")
+    parser.add_argument('--baseline', type=Path, default=BASELINE)
+    parser.add_argument('--save', action='store_true', help="Store this run as the baseline.")
+    parser.add_argument('--compare', action='store_true', help="Compare this run with the baseline.")
+    parser.add_argument('--tolerance', type=float, default=25, help="Allowed p50 slowdown, in percent.")
+    args = parser.parse_args()
+    dataset = {key: getattr(args, key) for key in DATASET}
+
+    with test_database(), override_settings(
+        ALLOWED_HOSTS=['testserver'], SECURE_SSL_REDIRECT=False, METRICS_ENABLED=True,
+        RESPONSE_CACHE_ENABLED=args.cache, LEADERBOARD_REVALIDATE=False, QUERY_BUDGET_STRICT=False,
+    ):
+        counts = datagen.generate(**dataset)
+        print(', '.join(f"{count} {kind}" for kind, count in counts.items()))
+        results = run(args)
+
+    if args.save:
+        args.baseline.parent.mkdir(exist_ok=True)
+        args.baseline.write_text(json.dumps({'dataset': dataset, 'results': results}, indent=2) + '\n')
+        print(f"Saved baseline to {args.baseline}")
+    if args.compare:
+        baseline = json.loads(args.baseline.read_text())
+        if baseline['dataset'] != dataset:
+            print(f"Warning: the baseline was taken on a different dataset: {baseline['dataset']}")
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print('\n'.join(['Regressions:'] + regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Throughput of the read endpoints under WSGI and ASGI, with sync and async views.
+
+Every mode runs in-process on the same generated dataset, through the real
+``WSGIHandler``/``ASGIHandler`` and the full middleware stack: the sync
+viewsets under WSGI with a pool of ``--threads`` workers (as with gunicorn's
+threaded workers), then the sync viewsets and the async views under ASGI,
+each with ``--concurrency`` requests in flight on one event loop.
+``--query-delay`` adds a sleep to every query, standing in for a slow or
+remote database: that is where a blocked worker thread costs throughput.
+
+    python -m benchmarks.asgi [--requests 600] [--threads 8] [--concurrency 64] [--query-delay 5]
+"""
+import argparse
+import asyncio
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.harness import report, test_database
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.test.utils import override_settings
+from django.urls import include, path
+
+from core import datagen
+from core import urls as core_urls
+from core.models import Comment, Post
+
+
+class AsyncURLConf:
+    # The project's API URLs with the async views mounted, as under asgi.py.
+    urlpatterns = [path('api/', include(core_urls.async_urlpatterns + core_urls.urlpatterns))]
+
+
+def slow_queries(delay):
+    def execute(execute, sql, params, many, context):
+        time.sleep(delay)
+        return execute(sql, params, many, context)
+
+    # Every thread opens its own connection, so wrap each one as it is created.
+    def wrap(sender, connection, **kwargs):
+        connection.execute_wrappers.append(execute)
+    connection_created.connect(wrap, weak=False)
+
+
+def wsgi_get(handler, url):
+    path, _, query = url.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'testserver', 'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http',
+        'wsgi.errors': io.StringIO(), 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    status = []
+    body = handler(environ, lambda line, headers: status.append(line))
+    b''.join(body)
+    body.close()
+    if not status[0].startswith('200'):
+        raise SystemExit(f"WSGI GET {url}: {status[0]}")
+
+
+async def asgi_get(handler, url):
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver')], 'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+    }
+    requests = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    status = []
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        await asyncio.Event().wait()  # the client never disconnects
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await handler(scope, receive, send)
+    if status[0] != 200:
+        raise SystemExit(f"ASGI GET {url}: {status[0]}")
+
+
+def timed(call):
+    started = time.perf_counter()
+    call()
+    return (time.perf_counter() - started) * 1000
+
+
+def run_wsgi(urls, threads):
+    handler = WSGIHandler()
+    with ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(lambda url: timed(lambda: wsgi_get(handler, url)), urls))
+
+
+async def run_asgi(urls, concurrency):
+    handler, slots = ASGIHandler(), asyncio.Semaphore(concurrency)
+
+    async def one(url):
+        async with slots:
+            started = time.perf_counter()
+            await asgi_get(handler, url)
+            return (time.perf_counter() - started) * 1000
+
+    return await asyncio.gather(*(one(url) for url in urls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=600, help="Requests per endpoint and server.")
+    parser.add_argument('--threads', type=int, default=8, help="WSGI worker threads.")
+    parser.add_argument('--concurrency', type=int, default=64, help="ASGI requests in flight.")
+    parser.add_argument('--query-delay', type=float, default=5, help="Milliseconds added to every query.")
+    parser.add_argument('--posts', type=int, default=1000)
+    args = parser.parse_args()
+
+    with test_database(), override_settings(
+        ALLOWED_HOSTS=['testserver'], SECURE_SSL_REDIRECT=False, RESPONSE_CACHE_ENABLED=False,
+        LEADERBOARD_REVALIDATE=False, QUERY_BUDGET_STRICT=False,
+    ):
+        datagen.generate(users=200, posts=args.posts, post_likes=args.posts * 5, comment_likes=args.posts * 2)
+        post = Post.objects.order_by('-comment_count', 'pk').first()
+        comment = Comment.objects.filter(post=post).annotate(n=Count('replies')).order_by('-n', 'pk').first()
+        endpoints = [
+            ('feed', '/api/posts/'),
+            ('comments', f'/api/posts/{post.pk}/comments/'),
+            ('replies', f'/api/comments/{comment.pk}/replies/'),
+            ('leaderboard', '/api/leaderboard/'),
+        ]
+        if args.query_delay:
+            slow_queries(args.query_delay / 1000)
+
+        print(f"{args.requests} requests per endpoint, WSGI {args.threads} threads, "
+              f"ASGI {args.concurrency} in flight, +{args.query_delay:g} ms per query")
+        for label, url in endpoints:
+            urls = [url] * args.requests
+            for server, conf, run in (
+                ('WSGI', 'community_feed.urls', lambda: run_wsgi(urls, args.threads)),
+                ('ASGI, sync views', 'community_feed.urls', lambda: asyncio.run(run_asgi(urls, args.concurrency))),
+                ('ASGI, async views', AsyncURLConf, lambda: asyncio.run(run_asgi(urls, args.concurrency))),
+            ):
+                with override_settings(ROOT_URLCONF=conf):
+                    started = time.perf_counter()
+                    samples = run()
+                    elapsed = time.perf_counter() - started
+                report(f"{label}, {server}: {len(urls) / elapsed:.0f} req/s", samples)
+
+
+if __name__ == '__main__':
+    main()
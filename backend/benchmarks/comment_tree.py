@@ -0,0 +1,97 @@
+"""
+Comment tree rendering: nested CommentSerializer vs. the .values() fast path.
+
+Both paths render the same thread and must produce identical JSON. The
+serializer path is the pre-fast-path one: model instances, a parent/child
+map, and a nested CommentSerializer per node.
+
+    python -m benchmarks.comment_tree [--repeat 10]
+"""
+import argparse
+
+from benchmarks.harness import measure, report, test_database
+
+from django.contrib.auth.models import User
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from core import comment_tree
+from core.models import Post, Comment
+from core.pagination import CommentPagination
+from core.serializers import CommentSerializer
+from core.views import comment_queryset
+
+
+def build_wide(author, roots=50, fanout=20, leaves=5):
+    post = Post.objects.create(author=author, content='wide')
+    level = Comment.objects.bulk_create_level(
+        [Comment(post=post, author=author, content=f'root {i}') for i in range(roots)]
+    )
+    for width in (fanout, leaves):
+        level = Comment.objects.bulk_create_level(
+            [Comment(post=post, parent=p, author=author, content='reply') for p in level for _ in range(width)]
+        )
+    return post, 3, max(fanout, leaves)
+
+
+def build_deep(author, roots=5, length=30):
+    post = Post.objects.create(author=author, content='deep')
+    level = Comment.objects.bulk_create_level(
+        [Comment(post=post, author=author, content=f'root {i}') for i in range(roots)]
+    )
+    for _ in range(length - 1):
+        level = Comment.objects.bulk_create_level(
+            [Comment(post=post, parent=p, author=author, content='reply') for p in level]
+        )
+    return post, length, 1
+
+
+def serializer_path(request, post):
+    comments = list(comment_queryset(request.user).filter(post=post).order_by('timestamp', 'id'))
+    by_id = {c.id: c for c in comments}
+    roots = []
+    for c in comments:
+        c.prefetched_replies = []
+    for c in comments:
+        if c.parent_id:
+            by_id[c.parent_id].prefetched_replies.append(c)
+        else:
+            roots.append(c)
+    return CommentSerializer(roots, many=True, context={'request': request}).data
+
+
+def fast_path(request, post):
+    comments = comment_tree.thread_queryset(comment_queryset(request.user).filter(post=post))
+    paginator = CommentPagination()
+    roots = paginator.paginate_queryset(comments.filter(parent__isnull=True), request)
+    depth, reply_cap = comment_tree.tree_limits(request)
+    return comment_tree.build_tree(roots, comments, depth, reply_cap, request, paginator)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    with test_database():
+        author = User.objects.create(username='bench')
+        for name, build in (('wide', build_wide), ('deep', build_deep)):
+            post, depth, replies = build(author)
+            request = Request(APIRequestFactory().get(
+                '/', {'page_size': 100, 'depth': depth, 'replies': replies}
+            ))
+            request.user = author
+
+            render = JSONRenderer().render
+            if render(serializer_path(request, post)) != render(fast_path(request, post)):
+                raise SystemExit(f"{name}: the two paths rendered different JSON")
+
+            nodes = Comment.objects.filter(post=post).count()
+            print(f"{name} tree: {nodes} comments, depth {depth}")
+            report("  nested CommentSerializer", measure(lambda: serializer_path(request, post), args.repeat))
+            report("  .values() fast path", measure(lambda: fast_path(request, post), args.repeat))
+
+
+if __name__ == '__main__':
+    main()
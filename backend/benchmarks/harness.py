@@ -0,0 +1,46 @@
+import os
+import statistics
+import time
+from contextlib import contextmanager
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'community_feed.settings')
+django.setup()
+
+from django.db import connection
+
+
+@contextmanager
+def test_database():
+    """Create a fresh, migrated test database for the duration of a benchmark."""
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def measure(fn, repeat=20, warmup=2):
+    """Call ``fn`` ``repeat`` times and return the wall-clock samples in milliseconds."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+def report(label, samples):
+    print(
+        f"{label:<40} p50 {percentile(samples, 50):8.2f} ms   "
+        f"p99 {percentile(samples, 99):8.2f} ms   mean {statistics.fmean(samples):8.2f} ms"
+    )
@@ -0,0 +1,58 @@
+"""
+Feed counters: COUNT(DISTINCT) double join vs. stored like/comment counts.
+
+A feed page with a few hot posts is read both ways. The annotated query
+joins likes x comments per post before de-duplicating, so its cost grows
+with the product of the two counts; the stored columns do not join at all.
+
+    python -m benchmarks.post_counts [--likes 1000] [--comments 1000] [--hot 3]
+"""
+import argparse
+
+from benchmarks.harness import measure, report, test_database
+
+from django.contrib.auth.models import User
+from django.db.models import Count
+
+from core.models import Post, Comment, Like
+
+
+def build(hot_posts, likes, comments):
+    users = User.objects.bulk_create([User(username=f'bench{i}') for i in range(max(likes, 1))])
+    author = users[0]
+    posts = Post.objects.bulk_create([Post(author=author, content=f'post {i}') for i in range(20)])
+    for post in posts[:hot_posts]:
+        Like.objects.bulk_create([Like(user=user, post=post) for user in users[:likes]], batch_size=1000)
+        Comment.objects.bulk_create(
+            [Comment(post=post, author=author, content=str(i)) for i in range(comments)], batch_size=1000
+        )
+        Post.objects.filter(pk=post.pk).update(like_count=likes, comment_count=comments)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--likes', type=int, default=1000)
+    parser.add_argument('--comments', type=int, default=1000)
+    parser.add_argument('--hot', type=int, default=3, help="How many posts on the page are hot.")
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    with test_database():
+        build(args.hot, args.likes, args.comments)
+
+        def annotated():
+            list(Post.objects.annotate(
+                n_likes=Count('likes', distinct=True),
+                n_comments=Count('comments', distinct=True),
+            ).order_by('-timestamp', '-id')[:20])
+
+        def stored():
+            list(Post.objects.order_by('-timestamp', '-id')[:20])
+
+        print(f"{args.hot} hot post(s) x {args.likes} likes x {args.comments} comments")
+        report("COUNT(DISTINCT) annotation", measure(annotated, repeat=args.repeat))
+        report("stored counters", measure(stored, repeat=args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Response size and encoding cost: DRF's JSON renderer vs. orjson, full vs. sparse fields.
+
+Serializes one feed page and one comment tree from a generated dataset,
+then renders the same data with DRF's ``JSONRenderer`` and with
+``FastJSONRenderer`` and reports bytes per response and CPU time per render.
+The last rows time the full GET for each ``?fields=`` selection, which
+also leaves out the columns, joins and liked-state query the fields need.
+
+    python -m benchmarks.render [--posts 1000] [--repeat 200]
+"""
+import argparse
+import time
+
+from benchmarks.harness import report, test_database
+
+from django.contrib.auth.models import User
+from django.db.models import Count
+from django.test.utils import override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from core import datagen, renderers
+from core.models import Post
+
+
+def cpu(fn, repeat, warmup=5):
+    """Like ``harness.measure``, but in process CPU time, so other load on the machine does not count."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        samples.append((time.process_time() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    if renderers.orjson is None:
+        print("orjson is not installed; FastJSONRenderer falls back to DRF's renderer (pip install orjson)")
+
+    with test_database(), override_settings(
+        ALLOWED_HOSTS=['testserver'], SECURE_SSL_REDIRECT=False, RESPONSE_CACHE_ENABLED=False,
+        LEADERBOARD_REVALIDATE=False, QUERY_BUDGET_STRICT=False,
+    ):
+        datagen.generate(users=200, posts=args.posts, post_likes=args.posts * 5, comment_likes=args.posts * 2)
+        post = Post.objects.annotate(n=Count('comments')).order_by('-n', 'pk').first()
+        client = APIClient()
+        client.force_authenticate(User.objects.order_by('pk').first())
+        endpoints = [
+            ('feed', '/api/posts/?page_size=50', 'content,like_count'),
+            ('comments', f'/api/posts/{post.pk}/comments/', 'content,replies'),
+        ]
+
+        for label, url, fields in endpoints:
+            separator = '&' if '?' in url else '?'
+            for selection, query in (('all fields', ''), (f'fields={fields}', f'{separator}fields={fields}')):
+                data = client.get(url + query).data
+                for name, renderer in (('DRF', JSONRenderer()), ('orjson', renderers.FastJSONRenderer())):
+                    size = len(renderer.render(data))
+                    report(f"{label}, {selection}, {name}: {size / 1024:.1f} KiB",
+                           cpu(lambda: renderer.render(data), args.repeat))
+                report(f"{label}, {selection}: GET", cpu(lambda: client.get(url + query), args.repeat // 10))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Search: the full-text index vs. an ``icontains`` scan.
+
+Fills the database with posts and comments of generated text (word
+frequencies follow a Zipf law, as in natural language), then times one page
+of results for rare, common and multi-word queries both ways: the
+``LIKE '%term%'`` scan the admin's ``search_fields`` runs, newest first,
+and ``core.search`` (the FTS5 table or the GIN index), best match first,
+including loading the matched rows.
+
+    python -m benchmarks.search [--posts 20000] [--comments 60000] [--repeat 20]
+"""
+import argparse
+import random
+from itertools import product
+
+from benchmarks.harness import measure, report, test_database
+
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.test import Client
+from django.test.utils import override_settings
+
+from core import search
+from core.models import Comment, Post
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'bar', 'dun', 'fel', 'gor', 'hin', 'pat', 'wex']
+
+
+def vocabulary(size):
+    words = [''.join(parts) for length in (2, 3) for parts in product(SYLLABLES, repeat=length)]
+    return words[:size]
+
+
+def text(rng, words, weights, low, high):
+    return ' '.join(rng.choices(words, weights, k=rng.randint(low, high)))
+
+
+def icontains(words, limit=20):
+    posts, comments = Q(), Q()
+    for word in words:
+        posts &= Q(content__icontains=word)
+        comments &= Q(content__icontains=word)
+    found = list(Post.objects.filter(posts).select_related('author').order_by('-timestamp', '-id')[:limit])
+    found += list(Comment.objects.filter(comments).select_related('author').order_by('-timestamp', '-id')[:limit])
+    return found
+
+
+def full_text(words, limit=20):
+    return search.hits(search.matches(words, None, limit + 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--comments', type=int, default=60000)
+    parser.add_argument('--vocabulary', type=int, default=4000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    words = vocabulary(args.vocabulary)
+    weights = [1 / rank ** 1.1 for rank in range(1, len(words) + 1)]
+
+    with test_database(), override_settings(
+        ALLOWED_HOSTS=['testserver'], SECURE_SSL_REDIRECT=False, QUERY_BUDGET_STRICT=False,
+    ):
+        author = User.objects.create(username='bench')
+        posts = Post.objects.bulk_create(
+            [Post(author=author, content=text(rng, words, weights, 20, 60)) for _ in range(args.posts)],
+            batch_size=2000,
+        )
+        Comment.objects.bulk_create(
+            [Comment(post=rng.choice(posts), author=author, content=text(rng, words, weights, 5, 25))
+             for _ in range(args.comments)],
+            batch_size=2000,
+        )
+        print(f"{args.posts} posts, {args.comments} comments, {len(words)} words")
+
+        client = Client()
+        for label, query in (
+            ('rare word', words[-1]),
+            ('common word', words[5]),
+            ('two words', f'{words[40]} {words[300]}'),
+        ):
+            terms = search.terms(query)
+            print(f"{label} ({query!r}): {len(search.matches(terms, None, 10 ** 9))} matches")
+            report("  icontains scan", measure(lambda: icontains(terms), args.repeat))
+            report("  full-text index", measure(lambda: full_text(terms), args.repeat))
+            report("  GET /api/search/", measure(lambda: client.get('/api/search/', {'q': query}), args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -12,5 +12,10 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'community_feed.settings')
+# Serve the hot reads from the async views. Every request runs its queries on
+# a fresh worker thread, so persistent connections would only pile up; pool
+# outside Django (e.g. PgBouncer) instead.
+os.environ.setdefault('ASYNC_VIEWS', 'True')
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
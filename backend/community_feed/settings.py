@@ -39,12 +39,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'core.metrics.MetricsMiddleware',
+    'core.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware', # WhiteNoise middleware
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.auth_cache.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -101,6 +103,16 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    # orjson when installed, DRF's stdlib JSON otherwise (see core/renderers.py).
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 ROOT_URLCONF = 'community_feed.urls'
@@ -126,14 +138,194 @@ WSGI_APPLICATION = 'community_feed.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Connections are kept open for DB_CONN_MAX_AGE seconds (0 closes them after
+# every request, None keeps them forever) and checked before reuse. Behind
+# PgBouncer in transaction mode set DB_DISABLE_SERVER_SIDE_CURSORS=True.
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=60, cast=lambda value: None if value == 'None' else int(value))
+DB_CONN_HEALTH_CHECKS = config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool)
+DB_DISABLE_SERVER_SIDE_CURSORS = config('DB_DISABLE_SERVER_SIDE_CURSORS', default=False, cast=bool)
+
+
+def _database(url):
+    return dj_database_url.parse(
+        url,
+        conn_max_age=DB_CONN_MAX_AGE,
+        conn_health_checks=DB_CONN_HEALTH_CHECKS,
+        disable_server_side_cursors=DB_DISABLE_SERVER_SIDE_CURSORS,
+    )
+
+
 DATABASES = {
     'default': config(
         'DATABASE_URL',
         default=f'sqlite:///{BASE_DIR / "db.sqlite3"}',
-        cast=dj_database_url.parse
+        cast=_database
     )
 }
 
+# Read replicas (comma-separated URLs). Read-only endpoints are served from
+# them, except for clients that wrote within the last REPLICA_STICKY_SECONDS;
+# see core/replicas.py. Tests read the replicas through the default database.
+for _index, _url in enumerate(config('DATABASE_REPLICA_URLS', default='', cast=Csv())):
+    DATABASES[f'replica{_index}'] = {**_database(_url), 'TEST': {'MIRROR': 'default'}}
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['core.replicas.ReplicaRouter'] if DATABASE_REPLICAS else []
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=5, cast=int)
+REPLICA_ENDPOINTS = [
+    'PostViewSet.list', 'PostViewSet.retrieve', 'PostViewSet.comments',
+    'CommentViewSet.list', 'CommentViewSet.retrieve', 'CommentViewSet.replies',
+    'LeaderboardViewSet.list', 'me_view', 'search_view',
+]
+
+
+# Async-native read views (core/async_views.py); asgi.py turns them on.
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
+
+
+# Cache
+# Local memory by default; set REDIS_URL to share the cache (and its
+# invalidation) across processes, which multi-worker deployments need.
+REDIS_URL = config('REDIS_URL', default='')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'community-feed',
+    }
+}
+if REDIS_URL:
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    }
+
+# Sessions and the signed-in user (see core/auth_cache.py). With Redis the
+# session is read from the cache (cached_db) instead of the database on
+# every request; the local-memory cache is not shared between workers, so
+# without Redis sessions stay in the database. SESSION_ENGINE can also be set
+# to django.contrib.sessions.backends.signed_cookies. The user row is kept
+# per process for USER_CACHE_TTL seconds (0 turns that off), and `me`'s
+# karma for KARMA_SUMMARY_TTL seconds.
+SESSION_ENGINE = config(
+    'SESSION_ENGINE',
+    default='django.contrib.sessions.backends.cached_db' if REDIS_URL else 'django.contrib.sessions.backends.db',
+)
+USER_CACHE_TTL = config('USER_CACHE_TTL', default=30, cast=float)
+KARMA_SUMMARY_TTL = config('KARMA_SUMMARY_TTL', default=30, cast=int)
+
+# Response cache for the feed, comment trees and leaderboard (see core/cache.py).
+# Entries are invalidated by version bumps on writes; TTLs (seconds) are a backstop.
+RESPONSE_CACHE_ENABLED = config('RESPONSE_CACHE_ENABLED', default=True, cast=bool)
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TTLS = {
+    'feed': config('FEED_CACHE_TTL', default=60, cast=int),
+    'comments': config('COMMENTS_CACHE_TTL', default=60, cast=int),
+}
+RESPONSE_CACHE_STATS = config('RESPONSE_CACHE_STATS', default=True, cast=bool)
+
+# Leaderboard snapshot (see core/leaderboard.py): the top LEADERBOARD_SNAPSHOT_SIZE
+# users, rebuilt every LEADERBOARD_REFRESH_INTERVAL seconds and served stale
+# while a background rebuild runs. LEADERBOARD_REFRESH_THREAD also runs a
+# refresher thread in every web process.
+LEADERBOARD_SNAPSHOT_SIZE = config('LEADERBOARD_SNAPSHOT_SIZE', default=100, cast=int)
+LEADERBOARD_REFRESH_INTERVAL = config('LEADERBOARD_REFRESH_INTERVAL', default=5, cast=float)
+LEADERBOARD_REVALIDATE = config('LEADERBOARD_REVALIDATE', default=True, cast=bool)
+LEADERBOARD_REFRESH_THREAD = config('LEADERBOARD_REFRESH_THREAD', default=False, cast=bool)
+
+# Karma ledger (see core/karma.py): hourly buckets are kept for
+# KARMA_BUCKET_RETENTION_HOURS (at least 25, to cover the 24h window) and
+# then dropped by `compact_karma --loop` every KARMA_COMPACT_INTERVAL
+# seconds; all-time totals are kept separately.
+KARMA_BUCKET_RETENTION_HOURS = config('KARMA_BUCKET_RETENTION_HOURS', default=48, cast=float)
+KARMA_COMPACT_INTERVAL = config('KARMA_COMPACT_INTERVAL', default=3600, cast=float)
+
+# Like archive (see core/like_archive.py): `roll_likes --loop` moves likes
+# older than LIKE_HOT_DAYS (at least 25 hours, to cover the karma window)
+# out of Like into ArchivedLike every
+# LIKE_ARCHIVE_INTERVAL seconds. Leave it on once anything is archived.
+LIKE_ARCHIVE_ENABLED = config('LIKE_ARCHIVE_ENABLED', default=False, cast=bool)
+LIKE_HOT_DAYS = config('LIKE_HOT_DAYS', default=30, cast=float)
+LIKE_ARCHIVE_INTERVAL = config('LIKE_ARCHIVE_INTERVAL', default=3600, cast=float)
+
+# Hot feed (?sort=hot, see core/hot.py): engagement weights, the half-life
+# of a post's score in hours, and the age after which it is no longer
+# rescored. `refresh_hot_scores --loop` re-decays every HOT_REFRESH_INTERVAL
+# seconds.
+HOT_LIKE_WEIGHT = config('HOT_LIKE_WEIGHT', default=1, cast=float)
+HOT_COMMENT_WEIGHT = config('HOT_COMMENT_WEIGHT', default=2, cast=float)
+HOT_HALF_LIFE_HOURS = config('HOT_HALF_LIFE_HOURS', default=12, cast=float)
+HOT_MAX_AGE_HOURS = config('HOT_MAX_AGE_HOURS', default=168, cast=float)
+HOT_REFRESH_INTERVAL = config('HOT_REFRESH_INTERVAL', default=300, cast=float)
+
+# Live events at /api/events/ (see core/events.py); the stream needs an ASGI server.
+# The backplane carries events between processes: in-process alone by default,
+# Redis pub/sub when REDIS_URL is set. EVENTS_QUEUE_SIZE bounds each connection's
+# backlog and EVENTS_HEARTBEAT (seconds) spaces keep-alive comments.
+EVENTS_BACKPLANE = config(
+    'EVENTS_BACKPLANE',
+    default='core.events.RedisBackplane' if REDIS_URL else 'core.events.LocalBackplane',
+)
+EVENTS_QUEUE_SIZE = config('EVENTS_QUEUE_SIZE', default=100, cast=int)
+EVENTS_HEARTBEAT = config('EVENTS_HEARTBEAT', default=15, cast=float)
+
+# Logging: key=value messages on stderr. LOG_LEVEL=DEBUG shows the per-write
+# debug lines from core.views; they cost nothing at the default level.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        'core': {'handlers': ['console'], 'level': config('LOG_LEVEL', default='INFO'), 'propagate': False},
+    },
+}
+
+# Request metrics (see core/metrics.py): Server-Timing headers and /api/metrics,
+# which only METRICS_TOKEN (sent as a bearer token), staff sessions and
+# METRICS_ALLOWED_IPS may read. QUERY_BUDGETS caps the queries one request may
+# run per endpoint; going over is logged, or raises with QUERY_BUDGET_STRICT
+# (the tests turn it on).
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='127.0.0.1,::1', cast=Csv())
+QUERY_BUDGET_STRICT = config('QUERY_BUDGET_STRICT', default=False, cast=bool)
+QUERY_BUDGETS = {
+    # Reads: session + user, then a fixed number of queries per page.
+    'PostViewSet.list': 5,
+    'PostViewSet.comments': 8,
+    'CommentViewSet.replies': 8,
+    'CommentViewSet.list': 5,
+    'CommentViewSet.retrieve': 8,
+    'LeaderboardViewSet.list': 3,
+    'me_view': 4,
+    'search_view': 5,
+    # Writes, allowing for a first anonymous write creating its guest account
+    # and a first like for an author in a new hour creating ledger rows.
+    'PostViewSet.create': 8,
+    'CommentViewSet.create': 12,
+    'PostViewSet.like': 24,
+    'CommentViewSet.like': 24,
+}
+
+# Anonymous writes (see core/identity.py): 'shared' attributes them all to one
+# guest account; 'session' gives every anonymous session its own guest account,
+# at most GUEST_CREATION_RATE of them per client address.
+GUEST_IDENTITY = config('GUEST_IDENTITY', default='shared')
+GUEST_CREATION_RATE = config('GUEST_CREATION_RATE', default='10/hour')
+
+# Write-behind likes (see core/like_buffer.py): like requests are buffered and
+# applied in bulk every LIKE_BUFFER_FLUSH_INTERVAL seconds. The Redis buffer is
+# shared by all processes and survives a crashed one.
+LIKE_BUFFER_ENABLED = config('LIKE_BUFFER_ENABLED', default=False, cast=bool)
+LIKE_BUFFER_BACKEND = config(
+    'LIKE_BUFFER_BACKEND',
+    default='core.like_buffer.RedisLikeBuffer' if REDIS_URL else 'core.like_buffer.LocalLikeBuffer',
+)
+LIKE_BUFFER_FLUSH_INTERVAL = config('LIKE_BUFFER_FLUSH_INTERVAL', default=0.25, cast=float)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
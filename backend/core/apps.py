@@ -1,6 +1,25 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_migrate
+
+
+def _install_search(sender, using, **kwargs):
+    # Put back search triggers a table rebuild may have dropped (see core/search.py).
+    from django.db import connections
+    from django.db.migrations.recorder import MigrationRecorder
+    from . import search
+    connection = connections[using]
+    applied = MigrationRecorder(connection).applied_migrations()
+    if connection.vendor in search.INSTALL and ('core', '0007_search_index') in applied:
+        search.install(connection)
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        post_migrate.connect(_install_search, sender=self)
+        if settings.LEADERBOARD_REFRESH_THREAD:
+            from . import leaderboard
+            leaderboard.start_refresher()
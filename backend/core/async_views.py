@@ -0,0 +1,134 @@
+"""
+Async-native read endpoints, served in place of the DRF viewsets under ASGI.
+
+Under ASGI (``ASYNC_VIEWS``, which ``community_feed/asgi.py`` turns on) the
+feed, comment tree, replies and leaderboard GETs are handled by the
+coroutines below, so a slow query waits on the event loop instead of tying
+up a worker thread. They use the async ORM and the async cache API and
+produce the same JSON as the viewsets. Their queries still run one after
+another: the async ORM hands each one to the same thread-sensitive worker,
+so gathering them would not overlap them. Every other method on the same
+URLs is handed to the viewset.
+"""
+import time
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, HttpResponseBase
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.request import Request
+
+from . import cache as response_cache
+from . import comment_tree, leaderboard, like_buffer
+from .models import Comment, Post
+from .pagination import CommentPagination, feed_pagination
+from .serializers import PostSerializer
+from .renderers import FastJSONRenderer
+from .views import CommentViewSet, LeaderboardViewSet, PostViewSet, thread_queryset
+
+
+def _render(request, data, status=200):
+    started = time.perf_counter()
+    content = FastJSONRenderer().render(data)
+    stats = getattr(request, '_metrics', None)
+    if stats is not None:
+        stats.serialize_time += time.perf_counter() - started
+    return HttpResponse(content, status=status, content_type='application/json')
+
+
+def read_view(sync_view):
+    """Serve GET with the decorated coroutine and hand every other method to ``sync_view``."""
+    def decorator(read):
+        # The viewset checks CSRF itself, as every DRF view does.
+        @csrf_exempt
+        async def view(request, *args, **kwargs):
+            if request.method != 'GET':
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+            try:
+                result = await read(request, *args, **kwargs)
+            except Http404 as exc:
+                return _render(request, {'detail': str(exc) or NotFound.default_detail}, 404)
+            except APIException as exc:
+                return _render(request, {'detail': exc.detail}, exc.status_code)
+            return result if isinstance(result, HttpResponseBase) else _render(request, result)
+
+        # Named after the action it stands in for, for metrics and replica routing.
+        view.cls, view.actions = sync_view.cls, sync_view.actions
+        view.__name__ = read.__name__
+        return view
+    return decorator
+
+
+async def _cached_page(request, user, namespace, scopes, build, target):
+    # views.cached_page for coroutines: a 304 for a current copy, else the page.
+    validators = await response_cache.avalidators(namespace, scopes, request, user)
+    not_modified = response_cache.not_modified(request, validators)
+    if not_modified is not None:
+        return not_modified
+    page = await response_cache.acached(namespace, scopes, request, build)
+    await response_cache.aoverlay_user_has_liked(page['results'], user, target)
+    if like_buffer.enabled():
+        await sync_to_async(like_buffer.overlay)(page['results'], user, target)
+    return response_cache.add_validators(_render(request, page), validators)
+
+
+@read_view(PostViewSet.as_view({'get': 'list', 'post': 'create'}))
+async def feed(request):
+    paginator = feed_pagination(request.GET)()
+
+    async def build():
+        api_request = Request(request)
+        posts = await paginator.apaginate_queryset(PostViewSet.feed_queryset(api_request), api_request)
+        serializer = PostSerializer(posts, many=True, context={'request': api_request})
+        return paginator.get_paginated_response(serializer.data).data
+
+    return await _cached_page(request, await request.auser(), 'feed', ['feed'], build, 'post')
+
+
+async def _tree_page(request, comments, siblings):
+    api_request = Request(request)
+    paginator = CommentPagination()
+    rows = await paginator.apaginate_queryset(siblings, api_request)
+    depth, reply_cap = comment_tree.tree_limits(api_request)
+    tree = await comment_tree.abuild_tree(rows, comments, depth, reply_cap, api_request, paginator)
+    return paginator.get_paginated_response(tree).data
+
+
+@read_view(PostViewSet.as_view({'get': 'comments'}))
+async def comments(request, pk):
+    try:
+        post_id = int(pk)
+    except ValueError:
+        raise NotFound()
+
+    async def build():
+        if not await Post.objects.filter(pk=post_id).aexists():
+            raise Http404('No Post matches the given query.')
+        thread = thread_queryset(post_id, Request(request))
+        return await _tree_page(request, thread, thread.filter(parent__isnull=True))
+
+    scopes = [response_cache.post_scope(post_id)]
+    return await _cached_page(request, await request.auser(), 'comments', scopes, build, 'comment')
+
+
+@read_view(CommentViewSet.as_view({'get': 'replies'}))
+async def replies(request, pk):
+    try:
+        comment_id = int(pk)
+    except ValueError:
+        raise NotFound()
+    post_id = await Comment.objects.filter(pk=comment_id).values_list('post_id', flat=True).afirst()
+    if post_id is None:
+        raise NotFound()
+
+    async def build():
+        thread = thread_queryset(post_id, Request(request))
+        return await _tree_page(request, thread, thread.filter(parent_id=comment_id))
+
+    scopes = [response_cache.post_scope(post_id)]
+    return await _cached_page(request, await request.auser(), 'comments', scopes, build, 'comment')
+
+
+@read_view(LeaderboardViewSet.as_view({'get': 'list'}))
+async def leaderboard_list(request):
+    return await leaderboard.atop(leaderboard.requested_limit(request.GET))
@@ -0,0 +1,125 @@
+"""
+Per-process cache of the authenticated user.
+
+Django's ``AuthenticationMiddleware`` loads the session's user with a SELECT
+on every request. ``CachedAuthenticationMiddleware`` replaces it and keeps
+each user it loads for ``USER_CACHE_TTL`` seconds, keyed by the user id,
+backend and session auth hash stored in the session. The session itself is
+still loaded and checked on every request, so logging out takes effect at
+once; with a cache-backed or signed-cookie ``SESSION_ENGINE`` neither step
+queries the database.
+
+A cached user was verified against the session hash when it was stored.
+Saving or deleting the user drops it in this process; other processes keep
+their copy, so a password change there logs out other sessions up to
+``USER_CACHE_TTL`` seconds late. ``USER_CACHE_TTL = 0`` turns the cache off.
+"""
+import copy
+import threading
+import time
+from functools import partial
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.functional import SimpleLazyObject
+
+from .middleware import HybridMiddleware
+
+MAX_ENTRIES = 10000
+SESSION_KEYS = (auth.SESSION_KEY, auth.BACKEND_SESSION_KEY, auth.HASH_SESSION_KEY)
+
+_users = {}
+_lock = threading.Lock()
+
+
+def _lookup(key):
+    entry = _users.get(key) if key else None
+    if entry is not None and entry[0] > time.monotonic():
+        # Each request gets its own instance to set attributes on.
+        return copy.copy(entry[1])
+    return None
+
+
+def _store(key, user):
+    if key and user.is_authenticated:
+        now = time.monotonic()
+        with _lock:
+            if len(_users) >= MAX_ENTRIES:
+                for stale in [k for k, (expires, _) in _users.items() if expires <= now]:
+                    del _users[stale]
+                if len(_users) >= MAX_ENTRIES:
+                    _users.clear()
+            _users[key] = (now + settings.USER_CACHE_TTL, user)
+    return user
+
+
+def _key(values):
+    # Only a complete, hashed session can be served from the cache.
+    return tuple(values) if settings.USER_CACHE_TTL and all(values) else None
+
+
+def get_user(request):
+    """``auth.get_user`` through the cache."""
+    key = _key([request.session.get(name) for name in SESSION_KEYS])
+    user = _lookup(key)
+    if user is None:
+        user = _store(key, auth.get_user(request))
+    return user
+
+
+async def aget_user(request):
+    """``get_user`` for async views."""
+    key = _key([await request.session.aget(name) for name in SESSION_KEYS])
+    user = _lookup(key)
+    if user is None:
+        user = _store(key, await auth.aget_user(request))
+    return user
+
+
+def clear():
+    with _lock:
+        _users.clear()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def _forget_user(sender, instance, **kwargs):
+    pk = str(instance.pk)
+    with _lock:
+        for key in [key for key in _users if str(key[0]) == pk]:
+            del _users[key]
+
+
+def _request_user(request):
+    if not hasattr(request, '_cached_user'):
+        request._cached_user = get_user(request)
+    return request._cached_user
+
+
+async def _request_auser(request):
+    if not hasattr(request, '_acached_user'):
+        request._acached_user = await aget_user(request)
+    return request._acached_user
+
+
+class CachedAuthenticationMiddleware(HybridMiddleware, AuthenticationMiddleware):
+    """
+    Drop-in for Django's ``AuthenticationMiddleware``, which it subclasses
+    only so the admin's check for it still passes.
+    """
+
+    def call(self, request):
+        self.process_request(request)
+        return self.get_response(request)
+
+    async def acall(self, request):
+        self.process_request(request)
+        return await self.get_response(request)
+
+    def process_request(self, request):
+        request.user = SimpleLazyObject(lambda: _request_user(request))
+        request.auser = partial(_request_auser, request)
@@ -0,0 +1,261 @@
+"""
+Response caching for the read-heavy endpoints.
+
+Only the viewer-independent part of a response is cached; each request
+overlays its own ``user_has_liked`` bits with one set-membership query.
+Entries are keyed by the current version of every scope they depend on
+('feed', 'post:<id>'), and the write paths bump those versions
+once their transaction commits, so stale entries are simply never read again
+and age out by TTL.
+
+The same versions make HTTP validators: ``validators`` derives an ``ETag``
+and ``Last-Modified`` for a response from them and the viewer, without a
+query, so a client revalidating an unchanged feed or comment tree gets a 304
+before any page is built.
+"""
+import hashlib
+import math
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from . import like_archive, replicas
+
+_stats = Counter()
+
+# Version and modified keys expire after a day without writes: any client can
+# ask for the comments of ids that never existed, and those keys must not pile
+# up. An expired version is replaced by a fresh one, which costs one miss.
+VERSION_TTL = 24 * 3600
+
+
+def _cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def post_scope(post_id):
+    """Scope of everything cached about one post's comments."""
+    return f'post:{post_id}'
+
+
+def _version_key(scope):
+    return f'rc:version:{scope}'
+
+
+def _modified_key(scope):
+    return f'rc:modified:{scope}'
+
+
+def _fresh_version():
+    # Time-based, so a version key that was evicted never restarts at a
+    # number whose entries might still be cached.
+    return time.time_ns()
+
+
+def _get_or_add(defaults):
+    # The value of every key in ``defaults``, adding the missing ones first.
+    found = _cache().get_many(list(defaults))
+    for key, default in defaults.items():
+        if key not in found:
+            _cache().add(key, default, timeout=VERSION_TTL)
+            found[key] = _cache().get(key)
+    return found
+
+
+async def _aget_or_add(defaults):
+    found = await _cache().aget_many(list(defaults))
+    for key, default in defaults.items():
+        if key not in found:
+            await _cache().aadd(key, default, timeout=VERSION_TTL)
+            found[key] = await _cache().aget(key)
+    return found
+
+
+def _version_defaults(scopes):
+    return {_version_key(scope): _fresh_version() for scope in scopes}
+
+
+def versions(scopes):
+    found = _get_or_add(_version_defaults(scopes))
+    return [found[_version_key(scope)] for scope in scopes]
+
+
+async def aversions(scopes):
+    found = await _aget_or_add(_version_defaults(scopes))
+    return [found[_version_key(scope)] for scope in scopes]
+
+
+def bump(*scopes):
+    """Invalidate every cached response depending on ``scopes`` once the current transaction commits."""
+    def _bump():
+        for scope in scopes:
+            try:
+                _cache().incr(_version_key(scope))
+            except ValueError:
+                _cache().set(_version_key(scope), _fresh_version(), timeout=VERSION_TTL)
+        _cache().set_many({_modified_key(scope): time.time() for scope in scopes}, timeout=VERSION_TTL)
+    transaction.on_commit(_bump)
+
+
+def _count(namespace, outcome):
+    if settings.RESPONSE_CACHE_STATS:
+        _stats[f'{namespace}_{outcome}'] += 1
+
+
+def stats():
+    """Hit/miss counters for this process, e.g. ``{'feed_hit': 12, 'feed_miss': 3}``."""
+    return dict(_stats)
+
+
+def cached(namespace, scopes, request, build):
+    """
+    Return ``build()``, cached per request URL under the current versions of
+    ``scopes``. ``build`` must not depend on who is asking.
+    """
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return build()
+
+    key = _entry_key(namespace, versions(scopes), request)
+    value = _cache().get(key)
+    if value is not None:
+        _count(namespace, 'hit')
+        return value
+    _count(namespace, 'miss')
+    value = build()
+    if not _may_lag(scopes, _cache().get_many([_modified_key(scope) for scope in scopes])):
+        _cache().set(key, value, settings.RESPONSE_CACHE_TTLS.get(namespace))
+    return value
+
+
+async def acached(namespace, scopes, request, build):
+    """``cached`` for async views: ``build`` is a coroutine function."""
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return await build()
+
+    key = _entry_key(namespace, await aversions(scopes), request)
+    value = await _cache().aget(key)
+    if value is not None:
+        _count(namespace, 'hit')
+        return value
+    _count(namespace, 'miss')
+    value = await build()
+    if not _may_lag(scopes, await _cache().aget_many([_modified_key(scope) for scope in scopes])):
+        await _cache().aset(key, value, settings.RESPONSE_CACHE_TTLS.get(namespace))
+    return value
+
+
+def _may_lag(scopes, modified):
+    # A page read from a replica within REPLICA_STICKY_SECONDS of a write to
+    # its scopes may predate that write. Cached under the new version, it
+    # would also be served to the writer, whose reads are pinned to the
+    # primary for exactly that long, so it is returned uncached instead.
+    if replicas.current() is None:
+        return False
+    return time.time() - max(modified.values(), default=0) < settings.REPLICA_STICKY_SECONDS
+
+
+def _entry_key(namespace, versions, request):
+    url = hashlib.sha1(request.build_absolute_uri().encode('utf-8')).hexdigest()
+    version = '.'.join(str(v) for v in versions)
+    return f'rc:{namespace}:{version}:{url}'
+
+
+def _validator_defaults(scopes):
+    # A scope that has no modification time yet is taken as modified now.
+    now = time.time()
+    return {**_version_defaults(scopes), **{_modified_key(scope): now for scope in scopes}}
+
+
+def _validators(namespace, scopes, request, user, found):
+    if settings.LIKE_BUFFER_ENABLED:
+        # Buffered likes change the response without a version bump.
+        return None, None
+    version = '.'.join(str(found[_version_key(scope)]) for scope in scopes)
+    tag = f'{namespace}:{version}:{user.pk}:{request.build_absolute_uri()}'
+    etag = f'W/"{hashlib.sha1(tag.encode("utf-8")).hexdigest()}"'
+    # HTTP dates have whole seconds: a time is only safe to send once its
+    # second is over, or a later write within it would go unnoticed.
+    modified = math.floor(max(found[_modified_key(scope)] for scope in scopes))
+    return etag, modified if modified + 1 <= time.time() else None
+
+
+def validators(namespace, scopes, request, user):
+    """
+    ``(etag, last_modified)`` for the response ``cached(namespace, scopes,
+    request, ...)`` with ``user``'s liked bits overlaid. They change with
+    every bump of ``scopes``. Either may be None.
+    """
+    return _validators(namespace, scopes, request, user, _get_or_add(_validator_defaults(scopes)))
+
+
+async def avalidators(namespace, scopes, request, user):
+    """``validators`` for async views."""
+    return _validators(namespace, scopes, request, user, await _aget_or_add(_validator_defaults(scopes)))
+
+
+def not_modified(request, validators):
+    """The 304 (or 412) response for a conditional ``request`` that ``validators`` satisfy, else None."""
+    etag, last_modified = validators
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    return response and add_validators(response, validators)
+
+
+def add_validators(response, validators):
+    etag, last_modified = validators
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    if etag or last_modified:
+        # Per viewer, and always revalidated rather than reused on a heuristic.
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def flatten(nodes):
+    """Serialized ``nodes`` and all their nested ``replies``, in no particular order."""
+    flat, stack = [], list(nodes)
+    while stack:
+        node = stack.pop()
+        flat.append(node)
+        stack.extend(node.get('replies', ()))
+    return flat
+
+
+def overlay_user_has_liked(nodes, user, target):
+    """
+    Set ``user_has_liked`` on serialized ``nodes`` (and their nested
+    ``replies``) for ``user`` with one query. ``target`` is 'post' or 'comment'.
+    Nodes without the field (left out by ``?fields=``) are skipped.
+    """
+    flat = _liked_nodes(nodes)
+    liked = set(_liked(flat, user, target) or ())
+    for node in flat:
+        node['user_has_liked'] = node['id'] in liked
+    return nodes
+
+
+async def aoverlay_user_has_liked(nodes, user, target):
+    """``overlay_user_has_liked`` through the async ORM."""
+    flat = _liked_nodes(nodes)
+    query = _liked(flat, user, target)
+    liked = {pk async for pk in query} if query is not None else set()
+    for node in flat:
+        node['user_has_liked'] = node['id'] in liked
+    return nodes
+
+
+def _liked_nodes(nodes):
+    return [node for node in flatten(nodes) if 'user_has_liked' in node]
+
+
+def _liked(flat, user, target):
+    # Ids among ``flat`` that ``user`` likes, or None when there is nothing to ask.
+    if not user.is_authenticated or not flat:
+        return None
+    return like_archive.liked_ids(user, target, [node['id'] for node in flat])
@@ -0,0 +1,203 @@
+from django.db.models import Exists, F, OuterRef, Q, Window
+from django.db.models.functions import RowNumber
+from django.urls import reverse
+from rest_framework import serializers
+from rest_framework.utils.urls import replace_query_param
+
+from .models import Comment
+from .serializers import CommentSerializer, sparse_fields
+
+DEFAULT_DEPTH = 8
+MAX_DEPTH = 32
+DEFAULT_REPLIES = 20
+MAX_REPLIES = 100
+
+
+def _bounded_param(request, name, default, maximum):
+    try:
+        value = int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+    return min(max(value, 1), maximum)
+
+
+def tree_limits(request):
+    """Read ``?depth=`` (levels returned) and ``?replies=`` (replies per node)."""
+    return (
+        _bounded_param(request, 'depth', DEFAULT_DEPTH, MAX_DEPTH),
+        _bounded_param(request, 'replies', DEFAULT_REPLIES, MAX_REPLIES),
+    )
+
+
+def replies_url(request, comment_id, depth, reply_cap, cursor=None):
+    """Continuation link for a truncated node: the next page of its replies."""
+    url = request.build_absolute_uri(reverse('comment-replies', args=[comment_id]))
+    url = replace_query_param(url, 'depth', depth)
+    url = replace_query_param(url, 'page_size', reply_cap)
+    if cursor:
+        url = replace_query_param(url, 'cursor', cursor)
+    return url
+
+
+# Columns the tree needs; rows stay plain dicts and never become model instances.
+TREE_FIELDS = (
+    'id', 'post_id', 'parent_id', 'author_id', 'author__username', 'content', 'timestamp',
+    'path', 'depth', 'like_count', 'user_has_liked', 'has_replies',
+)
+# Columns only read for one field of a node; left out when ?fields= leaves it out.
+FIELD_COLUMNS = {
+    'author': ('author__username',),
+    'content': ('content',),
+    'like_count': ('like_count',),
+    'more_replies': ('has_replies',),
+}
+
+_timestamp = serializers.DateTimeField()
+
+# How each field of a sparse node (?fields=) is read from its row.
+NODE_FIELDS = {
+    'id': lambda row: row['id'],
+    'post': lambda row: row['post_id'],
+    'parent': lambda row: row['parent_id'],
+    'author': lambda row: {'id': row['author_id'], 'username': row['author__username']},
+    'content': lambda row: row['content'],
+    'timestamp': lambda row: _timestamp.to_representation(row['timestamp']),
+    'replies': lambda row: [],
+    'more_replies': lambda row: None,
+    'like_count': lambda row: row['like_count'],
+    'user_has_liked': lambda row: row['user_has_liked'],
+}
+
+
+def tree_fields(request):
+    """The node fields named in ``?fields=``, in serializer order, or None for all of them."""
+    wanted = sparse_fields(request.query_params, CommentSerializer.Meta.fields)
+    return None if wanted is None else [name for name in CommentSerializer.Meta.fields if name in wanted]
+
+
+def tree_columns(fields):
+    if fields is None:
+        return TREE_FIELDS
+    skipped = {column for name, columns in FIELD_COLUMNS.items() if name not in fields for column in columns}
+    return tuple(column for column in TREE_FIELDS if column not in skipped)
+
+
+def thread_queryset(comments, fields=None):
+    """
+    The tree's rows as ``.values()`` dicts, with ``has_replies`` flagged so
+    nodes cut off by ``depth`` need no extra query. With ``fields`` (from
+    ``tree_fields``), only the columns those fields need are read.
+    """
+    if fields is not None and 'more_replies' not in fields:
+        return comments.values(*tree_columns(fields))
+    return comments.annotate(
+        has_replies=Exists(Comment.objects.filter(parent_id=OuterRef('pk')))
+    ).values(*tree_columns(fields))
+
+
+def build_tree(rows, comments, depth, reply_cap, request, paginator):
+    """
+    Render ``rows`` (sibling rows from ``thread_queryset``, the first of
+    ``depth`` levels) and their replies as the nested dicts
+    ``CommentSerializer`` would produce, without instantiating a model or a
+    serializer per node and without recursion.
+
+    The whole depth slice under the page is one range scan over the
+    materialized path, returned in display order, so the tree is assembled
+    in a single pass. Each node keeps at most ``reply_cap`` replies, ranked
+    per parent in SQL, and rows are streamed so memory stays bounded by the
+    limits however big the thread is. Nodes whose replies were cut off (by
+    the cap or by ``depth``) get a ``more_replies`` link to the replies
+    endpoint; every other node gets None.
+    """
+    builder = TreeBuilder(list(rows), depth, reply_cap, request, paginator)
+    descendants = builder.descendants(comments)
+    if descendants is not None:
+        for row in descendants.iterator(chunk_size=500):
+            builder.add(row)
+    return builder.tree
+
+
+async def abuild_tree(rows, comments, depth, reply_cap, request, paginator):
+    """``build_tree`` through the async ORM."""
+    builder = TreeBuilder(list(rows), depth, reply_cap, request, paginator)
+    descendants = builder.descendants(comments)
+    if descendants is not None:
+        async for row in descendants.aiterator(chunk_size=500):
+            builder.add(row)
+    return builder.tree
+
+
+class TreeBuilder:
+    """Assembles ``build_tree``'s output from the page's rows and then the descendants, in path order."""
+
+    def __init__(self, rows, depth, reply_cap, request, paginator):
+        self.rows = rows
+        self.depth = depth
+        self.reply_cap = reply_cap
+        self.request = request
+        self.paginator = paginator
+        self.fields = tree_fields(request)
+        self.max_depth = rows[0]['depth'] + depth - 1 if rows else None
+        self.included = {}
+        self.tree = [self.include(row) for row in rows]
+
+    def include(self, row):
+        if self.fields is not None:
+            return self.include_sparse(row)
+        # Same keys, in the same order, as CommentSerializer.Meta.fields.
+        node = {
+            'id': row['id'],
+            'post': row['post_id'],
+            'parent': row['parent_id'],
+            'author': {'id': row['author_id'], 'username': row['author__username']},
+            'content': row['content'],
+            'timestamp': _timestamp.to_representation(row['timestamp']),
+            'replies': [],
+            'more_replies': None,
+            'like_count': row['like_count'],
+            'user_has_liked': row['user_has_liked'],
+        }
+        if self.at_bottom(row) and row['has_replies']:
+            node['more_replies'] = replies_url(self.request, row['id'], self.depth, self.reply_cap)
+        self.included[row['id']] = (node, row)
+        return node
+
+    def include_sparse(self, row):
+        node = {name: NODE_FIELDS[name](row) for name in self.fields}
+        if 'more_replies' in node and self.at_bottom(row) and row['has_replies']:
+            node['more_replies'] = replies_url(self.request, row['id'], self.depth, self.reply_cap)
+        self.included[row['id']] = (node, row)
+        return node
+
+    def at_bottom(self, row):
+        # With one level, rows may come from any depth (a flat list of comments).
+        return self.depth == 1 or row['depth'] == self.max_depth
+
+    def descendants(self, comments):
+        """The rows below the page, or None when there are none to fetch."""
+        if not self.rows or self.depth == 1 or (self.fields is not None and 'replies' not in self.fields):
+            return None
+        ranges = Q()
+        for row in self.rows:
+            ranges |= Q(path__gt=row['path'], path__lt=Comment.path_upper(row['path']))
+        return comments.filter(ranges, depth__lte=self.max_depth).annotate(
+            reply_rank=Window(RowNumber(), partition_by=F('parent_id'), order_by=F('path').asc())
+        ).filter(reply_rank__lte=self.reply_cap + 1).order_by('path').values(*tree_columns(self.fields), 'reply_rank')
+
+    def add(self, row):
+        parent = self.included.get(row['parent_id'])
+        if parent is None:
+            # Somewhere under a reply that was cut off.
+            return
+        parent_node, _ = parent
+        if row['reply_rank'] > self.reply_cap:
+            if 'more_replies' not in parent_node:
+                return
+            _, last = self.included[parent_node['replies'][-1]['id']]
+            cursor = self.paginator.encode_cursor(self.paginator.get_position(last))
+            parent_node['more_replies'] = replies_url(
+                self.request, parent_node['id'], self.depth, self.reply_cap, cursor
+            )
+            return
+        parent_node['replies'].append(self.include(row))
@@ -0,0 +1,160 @@
+"""
+Synthetic data at scale, for load tests and benchmarks.
+
+``generate()`` writes users, posts, comment trees and likes with a handful of
+bulk INSERTs per table, then sets the post counters and hot scores, rebuilds
+the karma ledger and the leaderboard snapshot, so the result reads exactly
+like data created through the API.
+
+* Timestamps are spread over the last ``days`` days. A reply is always newer
+  than its parent and a like newer than its target, and siblings get ids in
+  timestamp order, so ``path`` order and keyset order agree.
+* Likes follow a Zipf distribution: the k-th most liked post (or comment)
+  gets a share proportional to ``1 / k ** zipf``, so a few hot posts carry
+  most of them, as in a real feed.
+* Each post gets up to ``roots`` top-level comments. Every comment above
+  ``depth`` then gets 1 to ``fanout`` replies with probability
+  ``reply_rate``.
+
+The same arguments and ``seed`` always produce the same data.
+"""
+import itertools
+import random
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import cache as response_cache
+from . import hot, karma, leaderboard
+from .models import Comment, Like, Post
+
+REPLY_WINDOW = timedelta(hours=6)
+LIKE_WINDOW = timedelta(days=2)
+
+
+@contextmanager
+def _explicit_timestamps(*models):
+    # auto_now_add would stamp every bulk-created row with the same "now".
+    fields = [model._meta.get_field('timestamp') for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _after(rng, start, now, window):
+    return start + (min(now, start + window) - start) * rng.random()
+
+
+def zipf_counts(rng, targets, total, zipf, cap):
+    """Split ``total`` over ``targets`` by a shuffled Zipf law, at most ``cap`` each."""
+    ranked = list(targets)
+    rng.shuffle(ranked)
+    weights = [1 / rank ** zipf for rank in range(1, len(ranked) + 1)]
+    scale = total / (sum(weights) or 1)
+    return {target: min(cap, round(weight * scale)) for target, weight in zip(ranked, weights)}
+
+
+def _users(count, prefix, batch_size):
+    if User.objects.filter(username__startswith=prefix).exists():
+        raise ValueError(f"Users named '{prefix}...' already exist; pick another prefix.")
+    password = make_password(None)
+    users = [User(username=f'{prefix}{i}', password=password) for i in range(count)]
+    return User.objects.bulk_create(users, batch_size=batch_size)
+
+
+def _next_ids(model):
+    last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+    return itertools.count(last + 1)
+
+
+def _comments(rng, posts, user_ids, now, roots, fanout, depth, reply_rate):
+    # Ids are assigned here rather than by the database, so every path is
+    # known before the INSERT and no level needs a second UPDATE pass.
+    ids = _next_ids(Comment)
+    level = [
+        Comment(post=post, author_id=rng.choice(user_ids), content=f'comment on {post.pk}',
+                timestamp=_after(rng, post.timestamp, now, REPLY_WINDOW))
+        for post in posts for _ in range(rng.randint(0, roots))
+    ]
+    created = []
+    for _ in range(depth):
+        if not level:
+            break
+        level.sort(key=lambda comment: comment.timestamp)
+        for comment in level:
+            parent = comment.parent
+            comment.pk = next(ids)
+            comment.path = (parent.path if parent else '') + Comment.path_segment(comment.pk)
+            comment.depth = parent.depth + 1 if parent else 0
+        created.extend(level)
+        level = [
+            Comment(post=parent.post, parent=parent, author_id=rng.choice(user_ids),
+                    content=f'reply to {parent.pk}', timestamp=_after(rng, parent.timestamp, now, REPLY_WINDOW))
+            for parent in level if rng.random() < reply_rate
+            for _ in range(rng.randint(1, fanout))
+        ]
+    return created
+
+
+def _reset_sequences(*models):
+    # Explicit ids leave PostgreSQL's sequences behind; SQLite tracks them itself.
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
+
+
+def _likes(rng, targets, field, user_ids, total, zipf, now):
+    counts = zipf_counts(rng, targets, total, zipf, cap=len(user_ids))
+    return [
+        Like(user_id=user_id, **{field: target}, timestamp=_after(rng, target.timestamp, now, LIKE_WINDOW))
+        for target, count in counts.items() if count
+        for user_id in rng.sample(user_ids, count)
+    ]
+
+
+def generate(users=1000, posts=5000, post_likes=50000, comment_likes=20000, zipf=1.1, roots=4, fanout=3,
+             depth=4, reply_rate=0.4, days=7, seed=0, prefix='load', batch_size=2000, now=None):
+    """Generate a dataset (see the module docstring). Returns the number of rows created per kind."""
+    rng = random.Random(seed)
+    now = now or timezone.now()
+    start = now - timedelta(days=days)
+
+    with transaction.atomic(), _explicit_timestamps(Post, Comment, Like):
+        user_ids = [user.pk for user in _users(users, prefix, batch_size)]
+        post_ids = _next_ids(Post)
+        post_rows = [
+            Post(pk=next(post_ids), author_id=rng.choice(user_ids), content=f'post {i}',
+                 timestamp=_after(rng, start, now, now - start))
+            for i in range(posts)
+        ]
+        comments = _comments(rng, post_rows, user_ids, now, roots, fanout, depth, reply_rate)
+        likes = (_likes(rng, post_rows, 'post', user_ids, post_likes, zipf, now)
+                 + _likes(rng, comments, 'comment', user_ids, comment_likes, zipf, now))
+
+        like_counts = Counter(like.post_id for like in likes if like.post_id)
+        comment_counts = Counter(comment.post_id for comment in comments)
+        for post in post_rows:
+            post.like_count = like_counts[post.pk]
+            post.comment_count = comment_counts[post.pk]
+
+        Post.objects.bulk_create(post_rows, batch_size=batch_size)
+        Comment.objects.bulk_create(comments, batch_size=batch_size)
+        Like.objects.bulk_create(likes, batch_size=batch_size)
+        _reset_sequences(Post, Comment)
+
+        karma.rebuild_ledger(now)
+        hot.refresh(now)
+        response_cache.bump('feed')
+    leaderboard.refresh()
+    return {'users': len(user_ids), 'posts': len(post_rows), 'comments': len(comments), 'likes': len(likes)}
@@ -0,0 +1,169 @@
+"""
+Live feed events over Server-Sent Events.
+
+The write paths publish compact delta events once their transaction commits:
+
+    {"type": "post", "id": 7, "author": {...}, "content": "...", "timestamp": "..."}
+    {"type": "comment", "id": 42, "post": 7, "parent": 40}
+    {"type": "like", "post": 7, "delta": 1}          ("comment": 42 for comment likes)
+
+Events travel through a backplane to every process's broadcaster, which fans
+them out to the connected ``/api/events/`` streams. Each stream has a bounded
+queue; a consumer that falls behind has its backlog replaced by a single
+``{"type": "resync"}`` event telling it to refetch, so one slow client can
+never hold memory for the rest.
+"""
+import asyncio
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+RESYNC = {'type': 'resync'}
+
+_timestamp = serializers.DateTimeField()
+
+
+class Subscription:
+    def __init__(self, loop, maxsize):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def put(self, event):
+        # Runs on the subscriber's event loop.
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = RESYNC
+        self.queue.put_nowait(event)
+
+
+class Broadcaster:
+    """Fans events out to this process's open streams."""
+
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        subscription = Subscription(asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def deliver(self, event):
+        """Thread-safe: called from sync views and backplane listener threads."""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # The stream's loop has already shut down.
+                self.unsubscribe(subscription)
+
+
+class LocalBackplane:
+    """Single-process delivery: publish straight to the local broadcaster."""
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+
+    def publish(self, event):
+        self.deliver(event)
+
+
+class RedisBackplane:
+    """Cross-process delivery over Redis pub/sub (needs the ``redis`` package and ``REDIS_URL``)."""
+    channel = 'community-feed:events'
+
+    def __init__(self, deliver):
+        import redis
+
+        self.deliver = deliver
+        self.client = redis.Redis.from_url(settings.REDIS_URL)
+        threading.Thread(target=self._listen, name='events-backplane', daemon=True).start()
+
+    def publish(self, event):
+        self.client.publish(self.channel, json.dumps(event))
+
+    def _listen(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        for message in pubsub.listen():
+            try:
+                self.deliver(json.loads(message['data']))
+            except Exception:
+                logger.exception("Dropped a malformed event from the backplane")
+
+
+broadcaster = Broadcaster(settings.EVENTS_QUEUE_SIZE)
+_backplane = None
+_backplane_lock = threading.Lock()
+
+
+def get_backplane():
+    global _backplane
+    with _backplane_lock:
+        if _backplane is None:
+            _backplane = import_string(settings.EVENTS_BACKPLANE)(broadcaster.deliver)
+        return _backplane
+
+
+def publish(event):
+    """Publish ``event`` once the current transaction commits."""
+    transaction.on_commit(lambda: get_backplane().publish(event))
+
+
+def post_created(post):
+    publish({
+        'type': 'post',
+        'id': post.id,
+        'author': {'id': post.author_id, 'username': post.author.username},
+        'content': post.content,
+        'timestamp': _timestamp.to_representation(post.timestamp),
+    })
+
+
+def comment_created(comment):
+    publish({'type': 'comment', 'id': comment.id, 'post': comment.post_id, 'parent': comment.parent_id})
+
+
+def like_changed(delta, post_id, comment_id=None):
+    event = {'type': 'like', 'post': post_id, 'delta': delta}
+    if comment_id is not None:
+        event['comment'] = comment_id
+    publish(event)
+
+
+def format_sse(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+
+
+async def stream(subscription, heartbeat):
+    """
+    SSE body for one connection; comment lines keep idle proxies from closing
+    it. The subscription is dropped when the client disconnects.
+    """
+    try:
+        yield "retry: 3000\n: connected\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(event)
+    finally:
+        broadcaster.unsubscribe(subscription)
@@ -0,0 +1,85 @@
+"""
+The "hot" feed order (``/api/posts/?sort=hot``).
+
+A post's hot score is its engagement, decayed by age:
+
+    hot_score = (1 + HOT_LIKE_WEIGHT * like_count + HOT_COMMENT_WEIGHT * comment_count) * hot_decay
+    hot_decay = 0.5 ** (age_hours / HOT_HALF_LIFE_HOURS)
+
+Both are stored on ``Post`` and ``(hot_score, id)`` is indexed, so the hot
+feed is a keyset range read like the chronological one.
+
+Writes keep the score current without knowing the post's age: a like or
+comment adds its weight times the stored ``hot_decay`` in the same UPDATE
+that moves the counter (``bumped``). ``hot_decay`` itself only moves when
+``refresh`` runs (``python manage.py refresh_hot_scores --loop``): it
+recomputes the decay of every post younger than ``HOT_MAX_AGE_HOURS`` and
+rescales the score from the counters, and drops older posts to 0 for good.
+Between refreshes the scores are exact as of the last one.
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Value
+from django.utils import timezone
+
+from . import cache as response_cache
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+
+def decay(timestamp, now):
+    age_hours = max((now - timestamp).total_seconds(), 0) / 3600
+    return 0.5 ** (age_hours / settings.HOT_HALF_LIFE_HOURS)
+
+
+def engagement():
+    """The undecayed score of each row, from its counters."""
+    return 1 + settings.HOT_LIKE_WEIGHT * F('like_count') + settings.HOT_COMMENT_WEIGHT * F('comment_count')
+
+
+def bumped(likes=0, comments=0):
+    """
+    ``hot_score`` after ``likes`` likes and ``comments`` comments (negative
+    to take them away), for the UPDATE that moves the counters. Either may
+    be an expression.
+    """
+    weight = likes * settings.HOT_LIKE_WEIGHT + comments * settings.HOT_COMMENT_WEIGHT
+    return F('hot_score') + weight * F('hot_decay')
+
+
+def refresh(now=None, batch_size=1000):
+    """Re-decay every post's score as of ``now``. Returns the number of posts rescored."""
+    now = now or timezone.now()
+    cutoff = now - timedelta(hours=settings.HOT_MAX_AGE_HOURS)
+    with transaction.atomic():
+        # Scored posts are the recent ones plus those that aged out since the last run.
+        Post.objects.filter(hot_score__gt=0, timestamp__lt=cutoff).update(hot_score=0, hot_decay=0)
+        posts = [
+            Post(pk=pk, hot_decay=decay(timestamp, now))
+            for pk, timestamp in Post.objects.filter(timestamp__gte=cutoff).values_list('pk', 'timestamp')
+        ]
+        for post in posts:
+            # Computed in the UPDATE, so a like landing meanwhile is not lost.
+            post.hot_score = engagement() * Value(post.hot_decay)
+        Post.objects.bulk_update(posts, ['hot_decay', 'hot_score'], batch_size=batch_size)
+        response_cache.bump('feed')
+    return len(posts)
+
+
+def run_refresher(interval, stop=None):
+    """Re-decay the scores every ``interval`` seconds until ``stop`` is set."""
+    stop = stop or threading.Event()
+    while True:
+        try:
+            refresh()
+        except Exception:
+            logger.exception("Hot score refresh failed")
+        finally:
+            connections.close_all()
+        if stop.wait(interval):
+            return
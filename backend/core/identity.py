@@ -0,0 +1,90 @@
+"""
+Who an anonymous write is attributed to.
+
+By default every anonymous post, comment and like belongs to one shared
+``guest`` account, looked up (or created) once per process and then attached
+by primary key without another query. With ``GUEST_IDENTITY = 'session'``
+each anonymous browser session gets its own guest account instead, created on
+its first write and remembered in the session, so guests no longer share (and
+contend on) a single Like row per target. Creating one takes a valid CSRF
+token, which only a client that has read a page holds, and each client
+address may create ``GUEST_CREATION_RATE`` of them, so a script cannot mint
+accounts with bare POSTs.
+"""
+import secrets
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import SimpleRateThrottle
+
+GUEST_USERNAME = 'guest'
+SESSION_KEY = '_guest_user'
+
+_guest_pk = None
+_guest_lock = threading.Lock()
+
+
+def _attached(pk, username):
+    # A stand-in for a row we know exists: enough for foreign keys and display.
+    user = User(pk=pk, username=username, is_active=True)
+    user._state.adding = False
+    return user
+
+
+def guest_user():
+    """The shared guest account, fetched or created once per process."""
+    global _guest_pk
+    if _guest_pk is None:
+        with _guest_lock:
+            if _guest_pk is None:
+                # get_or_create already retries the SELECT if another process wins the INSERT.
+                user, _ = User.objects.get_or_create(username=GUEST_USERNAME, defaults={'is_active': True})
+                _guest_pk = user.pk
+    return _attached(_guest_pk, GUEST_USERNAME)
+
+
+class GuestCreationThrottle(SimpleRateThrottle):
+    """Session guests created per client address, at most ``GUEST_CREATION_RATE``."""
+    scope = 'guest_creation'
+
+    def get_rate(self):
+        return settings.GUEST_CREATION_RATE
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+def session_guest(request):
+    """This session's own guest account, created on its first write."""
+    stored = request.session.get(SESSION_KEY)
+    if stored:
+        return _attached(*stored)
+    # DRF skips the CSRF check for anonymous requests; a new account should not.
+    SessionAuthentication().enforce_csrf(request)
+    throttle = GuestCreationThrottle()
+    if not throttle.allow_request(request, None):
+        raise Throttled(throttle.wait())
+    user = User.objects.create_user(f'{GUEST_USERNAME}-{secrets.token_hex(6)}')
+    request.session[SESSION_KEY] = (user.pk, user.username)
+    return user
+
+
+def acting_user(request):
+    """The user a write from ``request`` is attributed to."""
+    if request.user.is_authenticated:
+        return request.user
+    if settings.GUEST_IDENTITY == 'session':
+        return session_guest(request)
+    return guest_user()
+
+
+@receiver(post_delete, sender=User)
+def _forget_guest(sender, instance, **kwargs):
+    global _guest_pk
+    if instance.pk == _guest_pk:
+        _guest_pk = None
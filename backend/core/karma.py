@@ -0,0 +1,291 @@
+"""
+The karma ledger.
+
+Karma is read from two rollups of the Like table, kept in step with it in
+the same transaction as every like and unlike:
+
+* ``UserKarma``: each author's all-time total.
+* ``KarmaBucket``: points received per author per hour. The 24h window
+  sums the newest buckets through ``karma_bucket_hour_idx``.
+
+Buckets only matter while they are in the window, so they are kept for
+``KARMA_BUCKET_RETENTION_HOURS`` and then dropped by ``compact``
+(``python manage.py compact_karma --loop``). Their points are already in
+the totals, so nothing is lost, and the ledger stays the size of its
+retention window however long the Like table gets. A change to a like
+older than that only moves the total.
+
+``summary`` serves one user's pair from the cache for ``me`` and login, and
+every change to their ledger drops it.
+"""
+import logging
+import threading
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncHour
+from django.utils import timezone
+
+from .models import ArchivedLike, Like, UserKarma, KarmaBucket
+
+logger = logging.getLogger(__name__)
+
+# Karma rules: likes RECEIVED on a user's content, never likes they gave.
+POST_LIKE_KARMA = 5
+COMMENT_LIKE_KARMA = 1
+RECENT_WINDOW = timedelta(hours=24)
+
+
+def retained_since(now=None):
+    """The start of the oldest hourly bucket the ledger keeps."""
+    # Never less than the window plus the hour its oldest bucket can start in.
+    retention = max(timedelta(hours=settings.KARMA_BUCKET_RETENTION_HOURS), RECENT_WINDOW + timedelta(hours=1))
+    return (now or timezone.now()) - retention
+
+
+def _received_likes(likes=None):
+    """
+    Every non-self like, tagged with the author who receives the karma and
+    the points it is worth. A like targets a post OR a comment, so exactly one
+    side of each Coalesce is non-null.
+    """
+    likes = Like.objects.all() if likes is None else likes
+    return likes.annotate(
+        author_id=Coalesce('post__author_id', 'comment__author_id'),
+        like_points=Case(
+            When(post__isnull=False, then=Value(POST_LIKE_KARMA)),
+            default=Value(COMMENT_LIKE_KARMA),
+            output_field=IntegerField(),
+        ),
+    ).exclude(user_id=F('author_id'))
+
+
+def _ledger_rows(likes=None):
+    """Group likes into ledger rows: ``{'author_id', 'hour', 'points'}``."""
+    return (
+        _received_likes(likes)
+        .annotate(hour=TruncHour('timestamp'))
+        .values('author_id', 'hour')
+        .annotate(points=Sum('like_points'))
+        .order_by()
+    )
+
+
+def _bump(model, lookup, field, delta):
+    # UPDATE first: the row almost always exists, so that is one statement.
+    if not model.objects.filter(**lookup).update(**{field: F(field) + delta}):
+        model.objects.get_or_create(**lookup)
+        model.objects.filter(**lookup).update(**{field: F(field) + delta})
+
+
+def _summary_key(user_id):
+    return f'karma:summary:{user_id}'
+
+
+def _forget_summaries(user_ids):
+    keys = [_summary_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: caches[settings.RESPONSE_CACHE_ALIAS].delete_many(keys))
+
+
+def _apply(author_id, hour, delta):
+    _forget_summaries([author_id])
+    _bump(UserKarma, {'user_id': author_id}, 'total_karma', delta)
+    if hour >= retained_since():
+        _bump(KarmaBucket, {'user_id': author_id, 'hour': hour}, 'points', delta)
+
+
+def record_like(like, author_id, sign=1):
+    """
+    Apply a like (``sign=1``) or an unlike (``sign=-1``) to the ledger.
+
+    Call this inside the same transaction as the Like insert/delete so the
+    ledger never disagrees with the Like table.
+    """
+    if like.user_id == author_id:
+        return
+    points = POST_LIKE_KARMA if like.post_id else COMMENT_LIKE_KARMA
+    _apply(author_id, like.timestamp.replace(minute=0, second=0, microsecond=0), sign * points)
+
+
+def add_likes(likes):
+    """Put a batch of freshly inserted likes into the ledger, e.g. after a bulk insert."""
+    for row in _ledger_rows(likes):
+        _apply(row['author_id'], row['hour'], row['points'])
+
+
+def forget_likes(likes):
+    """Take a batch of likes out of the ledger, e.g. before a cascading delete."""
+    for row in _ledger_rows(likes):
+        _apply(row['author_id'], row['hour'], -row['points'])
+
+
+def ledger_from_likes(now=None):
+    """
+    Recompute the ledger from the raw Like table and the like archive.
+    Returns the retained buckets as ``{(user_id, hour): points}`` and the
+    all-time totals as ``{user_id: points}``.
+    """
+    since = retained_since(now)
+    buckets, totals = defaultdict(int), defaultdict(int)
+    # Archived likes (core/like_archive.py) still count.
+    for likes in (Like.objects.all(), ArchivedLike.objects.all()):
+        for row in _ledger_rows(likes):
+            if row['hour'] >= since:
+                buckets[row['author_id'], row['hour']] += row['points']
+            totals[row['author_id']] += row['points']
+    return buckets, totals
+
+
+def _diff(stored, expected):
+    return sorted(
+        (key, stored.get(key, 0), expected.get(key, 0))
+        for key in stored.keys() | expected.keys()
+        if stored.get(key, 0) != expected.get(key, 0)
+    )
+
+
+def ledger_drift(now=None):
+    """
+    Compare the stored ledger with the Like table. Returns two sorted lists of
+    ``(key, stored, expected)``: bucket mismatches keyed by ``(user_id, hour)``
+    and all-time total mismatches keyed by ``user_id``. Buckets older than
+    the retention window are not compared, whether or not compacted yet.
+    """
+    expected, expected_totals = ledger_from_likes(now)
+    stored = {
+        (row['user_id'], row['hour']): row['points']
+        for row in KarmaBucket.objects.filter(hour__gte=retained_since(now)).values('user_id', 'hour', 'points')
+    }
+    stored_totals = dict(UserKarma.objects.values_list('user_id', 'total_karma'))
+    return _diff(stored, expected), _diff(stored_totals, expected_totals)
+
+
+@transaction.atomic
+def rebuild_ledger(now=None):
+    """Throw the ledger away and rebuild it from the Like table. Returns the number of buckets."""
+    buckets, totals = ledger_from_likes(now)
+    _forget_summaries(set(UserKarma.objects.values_list('user_id', flat=True)) | set(totals))
+
+    KarmaBucket.objects.all().delete()
+    UserKarma.objects.all().delete()
+    KarmaBucket.objects.bulk_create(
+        [KarmaBucket(user_id=user_id, hour=hour, points=points) for (user_id, hour), points in buckets.items()],
+        batch_size=1000,
+    )
+    UserKarma.objects.bulk_create(
+        [UserKarma(user_id=user_id, total_karma=total) for user_id, total in totals.items()],
+        batch_size=1000,
+    )
+    return len(buckets)
+
+
+def compact(now=None):
+    """Drop the buckets that have left the retention window. Returns how many."""
+    deleted, _ = KarmaBucket.objects.filter(hour__lt=retained_since(now)).delete()
+    return deleted
+
+
+def run_compactor(interval, stop=None):
+    """Compact the ledger every ``interval`` seconds until ``stop`` is set."""
+    stop = stop or threading.Event()
+    while True:
+        try:
+            compact()
+        except Exception:
+            logger.exception("Karma ledger compaction failed")
+        finally:
+            connections.close_all()
+        if stop.wait(interval):
+            return
+
+
+def _window(now=None):
+    """
+    The 24h window as ``(since, first_hour)``: ``first_hour`` is the start of
+    the bucket the window begins inside.
+    """
+    since = (now or timezone.now()) - RECENT_WINDOW
+    return since, since.replace(minute=0, second=0, microsecond=0)
+
+
+def _points_before(since, first_hour):
+    """
+    A subquery of ``OuterRef('user_id')``'s points from the likes in the
+    first bucket that are older than the window, to take back off its sum.
+    """
+    return Coalesce(Subquery(
+        _received_likes(Like.objects.filter(timestamp__gte=first_hour, timestamp__lt=since))
+        .filter(author_id=OuterRef('user_id'))
+        .values('author_id')
+        .annotate(points=Sum('like_points'))
+        .values('points')
+    ), 0)
+
+
+def user_karma(user, now=None):
+    """
+    Return ``(recent_karma, total_karma)`` for one user from the ledger.
+
+    The recent window is the hourly buckets of the last 24h, read in a single
+    indexed lookup instead of a scan over Like. Only the likes of the first,
+    partly covered hour are looked up (through ``like_timestamp_idx``).
+    """
+    since, first_hour = _window(now)
+    recent = (
+        KarmaBucket.objects.filter(user_id=OuterRef('user_id'), hour__gte=first_hour)
+        .values('user_id')
+        .annotate(points=Sum('points'))
+        .values('points')
+    )
+    row = (
+        UserKarma.objects.filter(user_id=user.id)
+        .annotate(recent_karma=Coalesce(Subquery(recent), 0) - _points_before(since, first_hour))
+        .values_list('recent_karma', 'total_karma')
+        .first()
+    )
+    return row or (0, 0)
+
+
+def summary(user):
+    """
+    ``user_karma(user)`` from the cache. Cached for ``KARMA_SUMMARY_TTL``
+    seconds, which also bounds how late likes leaving the 24h window show.
+    """
+    if not settings.KARMA_SUMMARY_TTL:
+        return user_karma(user)
+    cache = caches[settings.RESPONSE_CACHE_ALIAS]
+    found = cache.get(_summary_key(user.id))
+    if found is None:
+        found = user_karma(user)
+        cache.set(_summary_key(user.id), found, settings.KARMA_SUMMARY_TTL)
+    return tuple(found)
+
+
+def leaderboard(limit=5, now=None):
+    """
+    Top ``limit`` users by recent karma, ranked by the database from the ledger.
+
+    Only users with recent activity are included; ties fall back to user id
+    so the ordering is stable between requests.
+    """
+    since, first_hour = _window(now)
+    rows = (
+        KarmaBucket.objects.filter(hour__gte=first_hour)
+        .values('user_id', 'user__username', 'user__karma__total_karma')
+        .annotate(recent_karma=Sum('points') - _points_before(since, first_hour))
+        .filter(recent_karma__gt=0)
+        .order_by('-recent_karma', 'user_id')[:limit]
+    )
+    return [
+        {
+            'id': row['user_id'],
+            'username': row['user__username'],
+            'recent_karma': row['recent_karma'],
+            'total_karma': row['user__karma__total_karma'] or 0,
+        }
+        for row in rows
+    ]
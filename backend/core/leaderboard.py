@@ -0,0 +1,118 @@
+"""
+Leaderboard snapshots.
+
+The leaderboard changes slowly but is read on every page load, so requests
+serve a precomputed top-N snapshot from the cache and never wait for it to be
+rebuilt. A snapshot older than ``LEADERBOARD_REFRESH_INTERVAL`` is still
+served while a single background thread rebuilds it (stale-while-revalidate).
+Only when there is no snapshot at all (a cold or flushed cache) does a
+request build it inline, rather than answer with an empty leaderboard.
+``python manage.py refresh_leaderboard --loop`` or the in-process refresher
+(``LEADERBOARD_REFRESH_THREAD``) keep it warm ahead of requests.
+"""
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+from . import karma
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_KEY = 'leaderboard:snapshot'
+LOCK_KEY = 'leaderboard:refreshing'
+
+
+def _cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def refresh():
+    """Rebuild the snapshot now. Returns it."""
+    snapshot = {
+        'built_at': time.time(),
+        'rows': karma.leaderboard(limit=settings.LEADERBOARD_SNAPSHOT_SIZE),
+    }
+    _cache().set(SNAPSHOT_KEY, snapshot, timeout=None)
+    return snapshot
+
+
+def _refresh_in_background():
+    try:
+        refresh()
+    except Exception:
+        logger.exception("Leaderboard refresh failed")
+    finally:
+        _cache().delete(LOCK_KEY)
+        connections.close_all()
+
+
+def revalidate():
+    """Start a background rebuild unless one is already running in any process sharing the cache."""
+    if not settings.LEADERBOARD_REVALIDATE:
+        return
+    # The lock expires on its own in case a refresher dies holding it.
+    if _cache().add(LOCK_KEY, True, timeout=max(settings.LEADERBOARD_REFRESH_INTERVAL, 1) * 6):
+        threading.Thread(target=_refresh_in_background, name='leaderboard-refresh', daemon=True).start()
+
+
+def requested_limit(params, default=5):
+    """``?limit=`` clamped to the snapshot size."""
+    try:
+        return min(max(int(params.get('limit', default)), 1), settings.LEADERBOARD_SNAPSHOT_SIZE)
+    except ValueError:
+        return default
+
+
+def top(limit):
+    """The top ``limit`` rows of the current snapshot, built inline only if there is none."""
+    snapshot = _cache().get(SNAPSHOT_KEY)
+    if snapshot is None:
+        snapshot = refresh()
+    elif _stale(snapshot):
+        revalidate()
+    return snapshot['rows'][:limit]
+
+
+async def atop(limit):
+    """``top`` for async views."""
+    snapshot = await _cache().aget(SNAPSHOT_KEY)
+    if snapshot is None:
+        snapshot = await sync_to_async(refresh)()
+    elif _stale(snapshot):
+        await sync_to_async(revalidate)()
+    return snapshot['rows'][:limit]
+
+
+def _stale(snapshot):
+    return time.time() - snapshot['built_at'] > settings.LEADERBOARD_REFRESH_INTERVAL
+
+
+def run_refresher(interval, stop=None):
+    """Rebuild the snapshot every ``interval`` seconds until ``stop`` is set."""
+    stop = stop or threading.Event()
+    while True:
+        try:
+            refresh()
+        except Exception:
+            logger.exception("Leaderboard refresh failed")
+        finally:
+            connections.close_all()
+        if stop.wait(interval):
+            return
+
+
+def start_refresher():
+    """Run the refresher in a daemon thread of this process."""
+    thread = threading.Thread(
+        target=run_refresher,
+        args=(settings.LEADERBOARD_REFRESH_INTERVAL,),
+        name='leaderboard-refresher',
+        daemon=True,
+    )
+    thread.start()
+    return thread
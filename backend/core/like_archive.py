@@ -0,0 +1,133 @@
+"""
+The like archive (``LIKE_ARCHIVE_ENABLED``).
+
+Like keeps every like ever given, but once a like is a few days old only
+the viewer's liked state and an unlike still read it. With the archive on,
+``roll`` (``python manage.py roll_likes --loop``) moves likes older than
+``LIKE_HOT_DAYS`` from Like into ArchivedLike in batches, so Like and the
+indexes behind its unique constraints stay the size of the hot window.
+No count moves: a post's ``like_count`` already includes its archived
+likes, a comment's ``archived_like_count`` rolls up the ones moved off it,
+and karma is read from the ledger (core/karma.py).
+
+Like's unique constraints still guard every insert. ``likes.set_like``
+inserts into Like first and takes the row back if the archive already
+holds that like. A roll deletes the Like row in the same transaction that
+archives it, so a concurrent like either conflicts with the row still in
+Like or sees it in the archive. Liked-state reads and unlikes look in both
+tables while the archive is on; once likes have been archived, leave it on.
+"""
+import logging
+import threading
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import BooleanField, Case, Exists, ExpressionWrapper, F, IntegerField, OuterRef, Q, Value, When
+from django.utils import timezone
+
+from . import karma
+from .models import ArchivedLike, Comment, Like
+
+logger = logging.getLogger(__name__)
+
+
+def enabled():
+    return settings.LIKE_ARCHIVE_ENABLED
+
+
+def has_liked_expression(user, target):
+    """``user_has_liked`` for rows of ``target`` ('post' or 'comment'), as an annotation."""
+    hot = Exists(Like.objects.filter(user=user, **{target: OuterRef('pk')}))
+    if not enabled():
+        return hot
+    archived = Exists(ArchivedLike.objects.filter(user=user, **{target: OuterRef('pk')}))
+    return ExpressionWrapper(Q(hot) | Q(archived), output_field=BooleanField())
+
+
+def liked_ids(user, target, ids):
+    """A ``values_list`` query of the ids among ``ids`` that ``user`` likes."""
+    field = f'{target}_id'
+    hot = Like.objects.filter(user=user, **{f'{field}__in': ids}).values_list(field, flat=True)
+    if not enabled():
+        return hot
+    return hot.union(ArchivedLike.objects.filter(user=user, **{f'{field}__in': ids}).values_list(field, flat=True))
+
+
+def has_liked(user, target, obj):
+    """Whether ``user`` likes ``obj``, in either table."""
+    if Like.objects.filter(user=user, **{target: obj}).exists():
+        return True
+    return enabled() and ArchivedLike.objects.filter(user=user, **{target: obj}).exists()
+
+
+def count_archived(comment_counts, sign=1):
+    """Move ``archived_like_count`` by ``sign`` times ``{comment_id: likes}``."""
+    comment_counts = {pk: n for pk, n in comment_counts.items() if n}
+    if not comment_counts:
+        return
+    deltas = Case(
+        *[When(id=pk, then=Value(sign * n)) for pk, n in comment_counts.items()],
+        default=Value(0), output_field=IntegerField(),
+    )
+    Comment.objects.filter(id__in=comment_counts).update(archived_like_count=F('archived_like_count') + deltas)
+
+
+def _key(like):
+    return like.user_id, like.post_id, like.comment_id
+
+
+def _already_archived(batch):
+    # The (user, post, comment) keys of ``batch`` the archive holds already.
+    users = {like.user_id for like in batch}
+    posts = {like.post_id for like in batch if like.post_id}
+    comments = {like.comment_id for like in batch if like.comment_id}
+    found = ArchivedLike.objects.filter(Q(post_id__in=posts) | Q(comment_id__in=comments), user_id__in=users)
+    return {_key(like) for like in found.only('user_id', 'post_id', 'comment_id')}
+
+
+def roll(now=None, batch_size=1000):
+    """Move the likes older than ``LIKE_HOT_DAYS`` into the archive. Returns how many."""
+    # The karma window reads the likes of its first hour from Like, so those stay.
+    hot = max(timedelta(days=settings.LIKE_HOT_DAYS), karma.RECENT_WINDOW + timedelta(hours=1))
+    cutoff = (now or timezone.now()) - hot
+    moved = 0
+    while True:
+        with transaction.atomic():
+            # Ids grow with time, so the oldest likes are the head of the primary key.
+            # Rolls running side by side take different batches.
+            batch = list(
+                Like.objects.select_for_update(skip_locked=True)
+                .filter(timestamp__lt=cutoff).order_by('id')[:batch_size]
+            )
+            if not batch:
+                return moved
+            # A like the archive already holds must not be counted twice.
+            archived = _already_archived(batch)
+            new = [like for like in batch if _key(like) not in archived]
+            ArchivedLike.objects.bulk_create(
+                [
+                    ArchivedLike(user_id=like.user_id, post_id=like.post_id, comment_id=like.comment_id,
+                                 timestamp=like.timestamp)
+                    for like in new
+                ],
+                batch_size=batch_size,
+            )
+            count_archived(Counter(like.comment_id for like in new if like.comment_id))
+            Like.objects.filter(id__in=[like.id for like in batch]).delete()
+        moved += len(batch)
+
+
+def run_roller(interval, stop=None):
+    """Roll the archive forward every ``interval`` seconds until ``stop`` is set."""
+    stop = stop or threading.Event()
+    while True:
+        try:
+            roll()
+        except Exception:
+            logger.exception("Like archive roll failed")
+        finally:
+            connections.close_all()
+        if stop.wait(interval):
+            return
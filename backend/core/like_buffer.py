@@ -0,0 +1,389 @@
+"""
+Write-behind buffering for likes (``LIKE_BUFFER_ENABLED``).
+
+When a post goes viral, every like is its own small transaction contending
+on the same rows. In buffered mode the like endpoints only record the wanted
+state per (user, target) in a buffer and answer at once; a flusher thread
+applies the coalesced batch every ``LIKE_BUFFER_FLUSH_INTERVAL`` seconds with
+one ``bulk_create(ignore_conflicts=True)`` and one bulk delete per target
+type, moving the counters and the karma ledger in the same transaction.
+
+Reads see buffered likes immediately: the views overlay each entry's pending
+``like_count`` delta and the viewer's pending liked state on top of what the
+database (or the response cache) returned.
+
+A batch stays in the buffer ("flushing") until its transaction commits, so a
+failed flush is retried as-is, and applying a batch is idempotent because it
+sets wanted states rather than replaying toggles. The Redis buffer survives a
+crashed process that way; the local buffer is flushed once more at
+interpreter exit, but a hard crash loses what it holds.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils.module_loading import import_string
+
+from . import cache as response_cache
+from . import hot, karma, like_archive
+from .models import ArchivedLike, Comment, Like, Post
+
+logger = logging.getLogger(__name__)
+
+_stats = Counter()
+
+
+def _entry_key(target, target_id, user_id):
+    return f'{target}:{target_id}:{user_id}'
+
+
+def _target_key(target, target_id):
+    return f'{target}:{target_id}'
+
+
+class LocalLikeBuffer:
+    """In-process buffer; each process flushes its own likes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending, self._deltas = {}, Counter()
+        self._flushing, self._flushing_deltas = {}, Counter()
+
+    def state(self, key):
+        with self._lock:
+            return self._pending.get(key, self._flushing.get(key))
+
+    def apply(self, key, target_key, liked, in_db):
+        """
+        Record the wanted state (``liked=None`` toggles) on top of ``in_db``.
+        Returns ``(liked, changed)``.
+        """
+        with self._lock:
+            current = self._pending.get(key, self._flushing.get(key, in_db))
+            liked = not current if liked is None else liked
+            if liked == current:
+                return liked, False
+            self._pending[key] = liked
+            self._deltas[target_key] += 1 if liked else -1
+            return liked, True
+
+    def states(self, keys):
+        with self._lock:
+            found = {key: self._pending.get(key, self._flushing.get(key)) for key in keys}
+        return {key: liked for key, liked in found.items() if liked is not None}
+
+    def deltas(self, target_keys):
+        with self._lock:
+            return {key: self._deltas[key] + self._flushing_deltas[key] for key in target_keys}
+
+    def drain(self):
+        """The batch to flush: a failed previous batch first, else everything pending."""
+        with self._lock:
+            if not self._flushing:
+                self._flushing, self._pending = self._pending, {}
+                self._flushing_deltas, self._deltas = self._deltas, Counter()
+            return dict(self._flushing)
+
+    def done(self, flushed):
+        """Drop the batch once it is committed; keep it for a retry otherwise."""
+        if flushed:
+            with self._lock:
+                self._flushing, self._flushing_deltas = {}, Counter()
+
+    def depth(self):
+        with self._lock:
+            return len(self._pending) + len(self._flushing)
+
+
+class RedisLikeBuffer:
+    """
+    Buffer shared by every process through Redis (needs the ``redis`` package
+    and ``REDIS_URL``). A lock key makes sure one process flushes at a time.
+    """
+    PENDING, DELTAS = 'likebuf:pending', 'likebuf:deltas'
+    FLUSHING, FLUSHING_DELTAS = 'likebuf:flushing', 'likebuf:flushing_deltas'
+    LOCK = 'likebuf:lock'
+
+    APPLY = """
+        local current = redis.call('HGET', KEYS[1], ARGV[1]) or redis.call('HGET', KEYS[3], ARGV[1]) or ARGV[3]
+        local liked = ARGV[4]
+        if liked == '' then
+            if current == '1' then liked = '0' else liked = '1' end
+        end
+        if liked == current then return {liked, 0} end
+        redis.call('HSET', KEYS[1], ARGV[1], liked)
+        redis.call('HINCRBY', KEYS[2], ARGV[2], liked == '1' and 1 or -1)
+        return {liked, 1}
+    """
+    DRAIN = """
+        if redis.call('EXISTS', KEYS[3]) == 0 and redis.call('EXISTS', KEYS[1]) == 1 then
+            redis.call('RENAME', KEYS[1], KEYS[3])
+            if redis.call('EXISTS', KEYS[2]) == 1 then redis.call('RENAME', KEYS[2], KEYS[4]) end
+        end
+        return redis.call('HGETALL', KEYS[3])
+    """
+
+    def __init__(self):
+        import redis
+
+        self.client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+        self._apply = self.client.register_script(self.APPLY)
+        self._drain = self.client.register_script(self.DRAIN)
+
+    def state(self, key):
+        value = self.client.hget(self.PENDING, key) or self.client.hget(self.FLUSHING, key)
+        return None if value is None else value == '1'
+
+    def apply(self, key, target_key, liked, in_db):
+        want = '' if liked is None else ('1' if liked else '0')
+        liked, changed = self._apply(
+            keys=[self.PENDING, self.DELTAS, self.FLUSHING],
+            args=[key, target_key, '1' if in_db else '0', want],
+        )
+        return liked == '1', bool(changed)
+
+    def states(self, keys):
+        if not keys:
+            return {}
+        pipe = self.client.pipeline()
+        pipe.hmget(self.PENDING, keys)
+        pipe.hmget(self.FLUSHING, keys)
+        pending, flushing = pipe.execute()
+        return {
+            key: (p or f) == '1'
+            for key, p, f in zip(keys, pending, flushing)
+            if (p or f) is not None
+        }
+
+    def deltas(self, target_keys):
+        if not target_keys:
+            return {}
+        pipe = self.client.pipeline()
+        pipe.hmget(self.DELTAS, target_keys)
+        pipe.hmget(self.FLUSHING_DELTAS, target_keys)
+        pending, flushing = pipe.execute()
+        return {key: int(p or 0) + int(f or 0) for key, p, f in zip(target_keys, pending, flushing)}
+
+    def drain(self):
+        # None while another process holds the flush lock.
+        if not self.client.set(self.LOCK, 1, nx=True, ex=60):
+            return None
+        flat = self._drain(keys=[self.PENDING, self.DELTAS, self.FLUSHING, self.FLUSHING_DELTAS])
+        return {key: value == '1' for key, value in zip(flat[::2], flat[1::2])}
+
+    def done(self, flushed):
+        if flushed:
+            self.client.delete(self.FLUSHING, self.FLUSHING_DELTAS)
+        self.client.delete(self.LOCK)
+
+    def depth(self):
+        return self.client.hlen(self.PENDING) + self.client.hlen(self.FLUSHING)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+_flush_lock = threading.Lock()
+
+
+def enabled():
+    return settings.LIKE_BUFFER_ENABLED
+
+
+def get_buffer():
+    """The configured buffer; the first call also starts this process's flusher."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = import_string(settings.LIKE_BUFFER_BACKEND)()
+            start_flusher()
+            atexit.register(_flush_at_exit)
+        return _buffer
+
+
+def change(user, target, obj, liked):
+    """
+    Buffer a like (``liked=True``), an unlike (False) or a toggle (None) of
+    ``obj`` by ``user``. Returns ``(liked, changed)`` as the client should see it.
+    """
+    buffer = get_buffer()
+    key = _entry_key(target, obj.pk, user.pk)
+    in_db = buffer.state(key)
+    if in_db is None:
+        in_db = like_archive.has_liked(user, target, obj)
+    return buffer.apply(key, _target_key(target, obj.pk), liked, in_db)
+
+
+def overlay(nodes, user, target):
+    """Apply buffered likes to serialized ``nodes`` (and their replies)."""
+    if not enabled():
+        return nodes
+    flat = response_cache.flatten(nodes)
+    if not flat:
+        return nodes
+    buffer = get_buffer()
+    deltas = buffer.deltas([_target_key(target, node['id']) for node in flat])
+    states = {}
+    if user.is_authenticated:
+        states = buffer.states([_entry_key(target, node['id'], user.pk) for node in flat])
+    for node in flat:
+        # ?fields= may have left either out.
+        if 'like_count' in node:
+            node['like_count'] += deltas.get(_target_key(target, node['id']), 0)
+        if 'user_has_liked' in node:
+            node['user_has_liked'] = states.get(_entry_key(target, node['id'], user.pk), node['user_has_liked'])
+    return nodes
+
+
+def _apply_batch(batch):
+    """Make the Like table and the like archive match ``batch`` (``{entry key: liked}``), with counters and ledger."""
+    wanted = defaultdict(dict)
+    for key, liked in batch.items():
+        target, target_id, user_id = key.split(':')
+        wanted[target][int(user_id), int(target_id)] = liked
+
+    post_deltas, comment_ids = Counter(), set()
+    with transaction.atomic():
+        for target, states in wanted.items():
+            field = f'{target}_id'
+            model = Post if target == 'post' else Comment
+            user_ids = {user_id for user_id, _ in states}
+            target_ids = {target_id for _, target_id in states}
+            scope = Like.objects.filter(user_id__in=user_ids, **{f'{field}__in': target_ids})
+            existing = {
+                (user_id, target_id): pk for pk, user_id, target_id in scope.values_list('id', 'user_id', field)
+                if (user_id, target_id) in states
+            }
+
+            archived = {}
+            if like_archive.enabled():
+                archived = {
+                    (user_id, target_id): pk for pk, user_id, target_id in
+                    ArchivedLike.objects.filter(user_id__in=user_ids, **{f'{field}__in': target_ids})
+                    .values_list('id', 'user_id', field)
+                    if (user_id, target_id) in states
+                }
+
+            # Users or targets deleted since the like was buffered are skipped.
+            live_users = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+            live_targets = set(model.objects.filter(id__in=target_ids).values_list('id', flat=True))
+            to_add = [
+                (user_id, target_id) for (user_id, target_id), liked in states.items()
+                if liked and (user_id, target_id) not in existing and (user_id, target_id) not in archived
+                and user_id in live_users and target_id in live_targets
+            ]
+            to_remove = [pk for key, pk in existing.items() if not states[key]]
+            to_unarchive = [pk for key, pk in archived.items() if not states[key]]
+
+            changed = Counter()
+            if to_unarchive:
+                removed = ArchivedLike.objects.filter(id__in=to_unarchive)
+                unarchived = list(removed.values_list(field, flat=True))
+                changed.subtract(unarchived)
+                if target == 'comment':
+                    like_archive.count_archived(Counter(unarchived), sign=-1)
+                karma.forget_likes(removed)
+                removed.delete()
+            if to_remove:
+                removed = Like.objects.filter(id__in=to_remove)
+                changed.subtract(removed.values_list(field, flat=True))
+                karma.forget_likes(removed)
+                removed.delete()
+            if to_add:
+                Like.objects.bulk_create(
+                    [Like(user_id=user_id, **{field: target_id}) for user_id, target_id in to_add],
+                    ignore_conflicts=True, batch_size=500,
+                )
+                wanted_new = set(to_add)
+                added = [
+                    (pk, target_id) for pk, user_id, target_id in scope.exclude(id__in=existing.values())
+                    .values_list('id', 'user_id', field) if (user_id, target_id) in wanted_new
+                ]
+                changed.update(target_id for _, target_id in added)
+                karma.add_likes(Like.objects.filter(id__in=[pk for pk, _ in added]))
+
+            if target == 'post':
+                post_deltas.update(changed)
+            else:
+                comment_ids.update(target_id for target_id, delta in changed.items() if delta)
+
+        post_deltas = {post_id: delta for post_id, delta in post_deltas.items() if delta}
+        if post_deltas:
+            deltas = Case(
+                *[When(id=post_id, then=Value(delta)) for post_id, delta in post_deltas.items()],
+                default=Value(0), output_field=IntegerField(),
+            )
+            Post.objects.filter(id__in=post_deltas).update(
+                like_count=F('like_count') + deltas, hot_score=hot.bumped(likes=deltas),
+            )
+            response_cache.bump('feed')
+        if comment_ids:
+            post_ids = set(Comment.objects.filter(id__in=comment_ids).values_list('post_id', flat=True))
+            response_cache.bump(*[response_cache.post_scope(post_id) for post_id in post_ids])
+
+
+def flush():
+    """Apply everything buffered so far. Returns the number of entries written."""
+    if _buffer is None:
+        return 0
+    with _flush_lock:
+        batch = _buffer.drain()
+        if batch is None:
+            return 0
+        if not batch:
+            _buffer.done(True)
+            return 0
+        started = time.perf_counter()
+        try:
+            _apply_batch(batch)
+        except Exception:
+            _stats['flush_failures'] += 1
+            _buffer.done(False)
+            raise
+        _buffer.done(True)
+        elapsed = (time.perf_counter() - started) * 1000
+        _stats['flushes'] += 1
+        _stats['flushed_entries'] += len(batch)
+        _stats['last_flush_ms'] = round(elapsed, 3)
+        _stats['max_flush_ms'] = max(_stats['max_flush_ms'], round(elapsed, 3))
+        return len(batch)
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception("Like buffer flush at exit failed")
+
+
+def stats():
+    """Buffer depth and flush counters/latency for this process."""
+    return {'depth': _buffer.depth() if _buffer is not None else 0, **_stats}
+
+
+def run_flusher(interval, stop=None):
+    """Flush every ``interval`` seconds until ``stop`` is set."""
+    stop = stop or threading.Event()
+    while not stop.wait(interval):
+        try:
+            flush()
+        except Exception:
+            logger.exception("Like buffer flush failed; the batch will be retried")
+            connections.close_all()
+
+
+def start_flusher():
+    """Run the flusher in a daemon thread of this process."""
+    thread = threading.Thread(
+        target=run_flusher,
+        args=(settings.LIKE_BUFFER_FLUSH_INTERVAL,),
+        name='like-buffer-flusher',
+        daemon=True,
+    )
+    thread.start()
+    return thread
@@ -0,0 +1,113 @@
+"""
+Idempotent like/unlike.
+
+Each change is one conditional statement on the Like table:
+``INSERT ... ON CONFLICT DO NOTHING RETURNING`` to like and
+``DELETE ... RETURNING`` to unlike. Concurrent requests for the same
+(user, target) therefore never raise on the unique constraints and never
+both succeed: exactly one statement returns the row, and only that request
+moves the post's ``like_count`` and the karma ledger, in the same
+transaction. Repeating a request is a no-op.
+
+With the like archive on (core/like_archive.py) a like may live in
+ArchivedLike instead: liking takes its fresh insert back when the archive
+already holds the like, and unliking deletes from the archive when Like
+has nothing to delete.
+"""
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import hot, karma, like_archive
+from .models import ArchivedLike, Like, Post
+
+
+def _db():
+    return router.db_for_write(Like)
+
+
+def _sql(template):
+    quote = connections[_db()].ops.quote_name
+    return template.format(
+        table=quote(Like._meta.db_table),
+        user=quote(Like._meta.get_field('user').column),
+        post=quote(Like._meta.get_field('post').column),
+        comment=quote(Like._meta.get_field('comment').column),
+        timestamp=quote(Like._meta.get_field('timestamp').column),
+    )
+
+
+def _target_ids(target, obj):
+    return (obj.pk, None) if target == 'post' else (None, obj.pk)
+
+
+def _returned(sql, params):
+    # A raw queryset runs the statement once and converts the RETURNING row
+    # (the timestamp in particular) like any other Like.
+    rows = list(Like.objects.db_manager(_db()).raw(sql, params))
+    return rows[0] if rows else None
+
+
+def _insert(user, target, obj):
+    post_id, comment_id = _target_ids(target, obj)
+    now = Like._meta.get_field('timestamp').get_db_prep_value(timezone.now(), connections[_db()])
+    return _returned(_sql(
+        'INSERT INTO {table} ({user}, {post}, {comment}, {timestamp}) VALUES (%s, %s, %s, %s) '
+        'ON CONFLICT DO NOTHING RETURNING *'
+    ), [user.pk, post_id, comment_id, now])
+
+
+def _delete(user, target, obj):
+    column = '{post}' if target == 'post' else '{comment}'
+    return _returned(_sql(
+        'DELETE FROM {table} WHERE {user} = %s AND ' + column + ' = %s RETURNING *'
+    ), [user.pk, obj.pk])
+
+
+def _archived(like):
+    """Whether the archive already holds ``like``, just inserted; if so the insert is taken back."""
+    if not like_archive.enabled():
+        return False
+    target = {'post_id': like.post_id} if like.post_id else {'comment_id': like.comment_id}
+    if not ArchivedLike.objects.filter(user_id=like.user_id, **target).exists():
+        return False
+    Like.objects.filter(pk=like.pk).delete()
+    return True
+
+
+def _unarchive(user, target, obj):
+    # The archived like that was deleted, or None; at most one request gets it.
+    if not like_archive.enabled():
+        return None
+    like = ArchivedLike.objects.filter(user=user, **{target: obj}).first()
+    if like is None or not ArchivedLike.objects.filter(pk=like.pk).delete()[0]:
+        return None
+    if target == 'comment':
+        like_archive.count_archived({obj.pk: 1}, sign=-1)
+    return like
+
+
+def _changed(like, target, obj, sign):
+    if target == 'post':
+        Post.objects.filter(pk=obj.pk).update(like_count=F('like_count') + sign, hot_score=hot.bumped(likes=sign))
+    karma.record_like(like, obj.author_id, sign)
+
+
+def set_like(user, target, obj):
+    """Make ``user`` like ``obj`` (a post or comment). Returns whether anything changed."""
+    with transaction.atomic(using=_db()):
+        like = _insert(user, target, obj)
+        if like is not None and _archived(like):
+            like = None
+        if like is not None:
+            _changed(like, target, obj, 1)
+    return like is not None
+
+
+def unset_like(user, target, obj):
+    """Remove ``user``'s like from ``obj``. Returns whether anything changed."""
+    with transaction.atomic(using=_db()):
+        like = _delete(user, target, obj) or _unarchive(user, target, obj)
+        if like is not None:
+            _changed(like, target, obj, -1)
+    return like is not None
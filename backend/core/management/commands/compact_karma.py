@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import karma
+
+
+class Command(BaseCommand):
+    help = "Drop karma buckets older than the retention window once, or keep dropping them with --loop."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep compacting until interrupted.")
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=settings.KARMA_COMPACT_INTERVAL,
+            help="Seconds between compactions with --loop.",
+        )
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            self.stdout.write(f"Compacting the karma ledger every {options['interval']}s.")
+            try:
+                karma.run_compactor(options['interval'])
+            except KeyboardInterrupt:
+                pass
+            return
+
+        deleted = karma.compact()
+        self.stdout.write(self.style.SUCCESS(f"Karma ledger compacted: {deleted} bucket(s) dropped."))
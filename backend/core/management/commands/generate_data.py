@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import datagen
+
+
+class Command(BaseCommand):
+    help = "Bulk-generate users, posts, comment trees and likes for load testing (see core/datagen.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--post-likes', type=int, default=50000, help="Total likes on posts (about).")
+        parser.add_argument('--comment-likes', type=int, default=20000, help="Total likes on comments (about).")
+        parser.add_argument('--zipf', type=float, default=1.1, help="Skew of likes over targets; 0 spreads them evenly.")
+        parser.add_argument('--roots', type=int, default=4, help="Most top-level comments per post.")
+        parser.add_argument('--fanout', type=int, default=3, help="Most replies per comment.")
+        parser.add_argument('--depth', type=int, default=4, help="Levels per comment thread.")
+        parser.add_argument('--reply-rate', type=float, default=0.4, help="Chance that a comment gets replies.")
+        parser.add_argument('--days', type=float, default=7, help="Spread timestamps over this many days.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='load', help="Username prefix of the generated users.")
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            counts = datagen.generate(**{
+                key: options[key] for key in (
+                    'users', 'posts', 'post_likes', 'comment_likes', 'zipf', 'roots', 'fanout', 'depth',
+                    'reply_rate', 'days', 'seed', 'prefix', 'batch_size',
+                )
+            })
+        except ValueError as exc:
+            raise CommandError(exc)
+        summary = ', '.join(f"{count} {kind}" for kind, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Generated {summary} in {time.perf_counter() - started:.1f}s."))
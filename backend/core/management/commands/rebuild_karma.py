@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import karma
+
+
+class Command(BaseCommand):
+    help = "Rebuild (or, with --check, reconcile) the karma ledger from the Like table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help="Report drift between the ledger and the Like table without writing anything.",
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            buckets, totals = karma.ledger_drift()
+            for (user_id, hour), stored, expected in buckets:
+                self.stdout.write(f"user {user_id} @ {hour:%Y-%m-%d %H:00}: ledger {stored}, likes {expected}")
+            for user_id, stored, expected in totals:
+                self.stdout.write(f"user {user_id} all-time: ledger {stored}, likes {expected}")
+            if buckets or totals:
+                raise CommandError(f"Karma ledger drifted: {len(buckets)} bucket(s), {len(totals)} total(s).")
+            self.stdout.write(self.style.SUCCESS("Karma ledger matches the Like table."))
+            return
+
+        count = karma.rebuild_ledger()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt karma ledger: {count} hourly bucket(s)."))
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import hot
+
+
+class Command(BaseCommand):
+    help = "Re-decay the hot feed scores once, or keep re-decaying them with --loop."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep refreshing until interrupted.")
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=settings.HOT_REFRESH_INTERVAL,
+            help="Seconds between refreshes with --loop.",
+        )
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            self.stdout.write(f"Refreshing hot scores every {options['interval']}s.")
+            try:
+                hot.run_refresher(options['interval'])
+            except KeyboardInterrupt:
+                pass
+            return
+
+        rescored = hot.refresh()
+        self.stdout.write(self.style.SUCCESS(f"Hot scores refreshed: {rescored} post(s) rescored."))
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import leaderboard
+
+
+class Command(BaseCommand):
+    help = "Rebuild the leaderboard snapshot once, or keep rebuilding it with --loop."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep refreshing until interrupted.")
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=settings.LEADERBOARD_REFRESH_INTERVAL,
+            help="Seconds between refreshes with --loop.",
+        )
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            self.stdout.write(f"Refreshing the leaderboard every {options['interval']}s.")
+            try:
+                leaderboard.run_refresher(options['interval'])
+            except KeyboardInterrupt:
+                pass
+            return
+
+        snapshot = leaderboard.refresh()
+        self.stdout.write(self.style.SUCCESS(f"Leaderboard snapshot rebuilt: {len(snapshot['rows'])} row(s)."))
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import like_archive
+
+
+class Command(BaseCommand):
+    help = "Move likes older than LIKE_HOT_DAYS into the like archive once, or keep moving them with --loop."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep rolling until interrupted.")
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=settings.LIKE_ARCHIVE_INTERVAL,
+            help="Seconds between rolls with --loop.",
+        )
+
+    def handle(self, *args, **options):
+        # Reads only look in the archive while it is enabled.
+        if not like_archive.enabled():
+            raise CommandError("The like archive is off; set LIKE_ARCHIVE_ENABLED=True first.")
+
+        if options['loop']:
+            self.stdout.write(f"Rolling likes into the archive every {options['interval']}s.")
+            try:
+                like_archive.run_roller(options['interval'])
+            except KeyboardInterrupt:
+                pass
+            return
+
+        moved = like_archive.roll()
+        self.stdout.write(self.style.SUCCESS(f"Like archive rolled: {moved} like(s) archived."))
@@ -0,0 +1,251 @@
+"""
+Per-request instrumentation.
+
+``MetricsMiddleware`` measures every request's database queries (count and
+time, through an execute wrapper on each connection, so it works with DEBUG
+off), response rendering time ("serialize") and total latency. Requests are
+tagged with their endpoint, ``<View>.<action>`` for DRF views (e.g.
+``PostViewSet.list``) or the view function's name otherwise.
+
+The numbers go out three ways:
+
+* a ``Server-Timing`` header on the response (visible in browser devtools);
+* per-endpoint aggregates for this process at ``/api/metrics``, in the
+  Prometheus text format, along with the response cache and like buffer stats.
+  Only ``METRICS_TOKEN`` (as a bearer token), staff sessions and the
+  addresses in ``METRICS_ALLOWED_IPS`` may read them;
+* ``QUERY_BUDGETS``: a request running more queries than its endpoint's
+  budget is logged, or fails with ``QueryBudgetExceeded`` when
+  ``QUERY_BUDGET_STRICT`` is on (as it is in the tests).
+"""
+import hmac
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.http import Http404, HttpResponse
+
+from .middleware import HybridMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.endpoint = None
+
+    def __call__(self, execute, sql, params, many, context):
+        # Execute wrapper: runs around every query on the request's connections.
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+
+class Registry:
+    """Per-endpoint totals for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = defaultdict(lambda: {
+            'requests': 0, 'queries': 0, 'db_seconds': 0.0, 'serialize_seconds': 0.0,
+            'seconds': 0.0, 'buckets': [0] * len(LATENCY_BUCKETS),
+        })
+
+    def record(self, endpoint, stats, elapsed):
+        with self._lock:
+            totals = self._endpoints[endpoint]
+            totals['requests'] += 1
+            totals['queries'] += stats.queries
+            totals['db_seconds'] += stats.db_time
+            totals['serialize_seconds'] += stats.serialize_time
+            totals['seconds'] += elapsed
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    totals['buckets'][i] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: {**totals, 'buckets': list(totals['buckets'])} for endpoint, totals in self._endpoints.items()}
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+registry = Registry()
+
+
+def endpoint_name(view_func, method):
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return getattr(view_func, '__name__', 'unknown')
+    actions = getattr(view_func, 'actions', None)
+    if actions:
+        return f'{view_class.__name__}.{actions.get(method.lower(), method.lower())}'
+    return view_class.__name__
+
+
+def server_timing(stats, elapsed):
+    return ', '.join([
+        f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"',
+        f'serialize;dur={stats.serialize_time * 1000:.1f}',
+        f'total;dur={elapsed * 1000:.1f}',
+    ])
+
+
+def check_budget(endpoint, queries):
+    budget = settings.QUERY_BUDGETS.get(endpoint)
+    if budget is None or queries <= budget:
+        return
+    message = f'{endpoint} ran {queries} queries (budget {budget})'
+    if settings.QUERY_BUDGET_STRICT:
+        raise QueryBudgetExceeded(message)
+    logger.warning("query budget exceeded endpoint=%s queries=%d budget=%d", endpoint, queries, budget)
+
+
+def _wrap_connections(stats):
+    # Entered on the thread that will run the request's queries; the caller closes it.
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(stats))
+    return stack
+
+
+class MetricsMiddleware(HybridMiddleware):
+    def call(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        stats = request._metrics = RequestStats()
+        started = time.perf_counter()
+        with _wrap_connections(stats):
+            response = self.get_response(request)
+        return self._finish(response, stats, started)
+
+    async def acall(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+        stats = request._metrics = RequestStats()
+        started = time.perf_counter()
+        # The async ORM runs queries on the request's thread-sensitive worker
+        # thread, so that is the thread whose connections get wrapped.
+        wrapped = await sync_to_async(_wrap_connections)(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(wrapped.close)()
+        return self._finish(response, stats, started)
+
+    def _finish(self, response, stats, started):
+        elapsed = time.perf_counter() - started
+        endpoint = stats.endpoint or 'unmatched'
+        registry.record(endpoint, stats, elapsed)
+        response['Server-Timing'] = server_timing(stats, elapsed)
+        check_budget(endpoint, stats.queries)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, '_metrics'):
+            request._metrics.endpoint = endpoint_name(view_func, request.method)
+
+    def process_template_response(self, request, response):
+        # DRF responses render after this hook; time the rendering itself.
+        stats = getattr(request, '_metrics', None)
+        if stats is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                stats.serialize_time += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+def _labels(endpoint, **extra):
+    pairs = {'endpoint': endpoint, **extra}
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs.items()) + '}'
+
+
+def render_prometheus():
+    """This process's metrics in the Prometheus text exposition format."""
+    from . import cache as response_cache
+    from . import like_buffer
+
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    endpoints = registry.snapshot()
+    family('http_requests_total', 'counter', 'Requests served, by endpoint.')
+    for endpoint, totals in endpoints.items():
+        lines.append(f'http_requests_total{_labels(endpoint)} {totals["requests"]}')
+
+    family('http_request_duration_seconds', 'histogram', 'Total request latency, by endpoint.')
+    for endpoint, totals in endpoints.items():
+        for bound, count in zip(LATENCY_BUCKETS, totals['buckets']):
+            lines.append(f'http_request_duration_seconds_bucket{_labels(endpoint, le=bound)} {count}')
+        lines.append(f'http_request_duration_seconds_bucket{_labels(endpoint, le="+Inf")} {totals["requests"]}')
+        lines.append(f'http_request_duration_seconds_sum{_labels(endpoint)} {totals["seconds"]:.6f}')
+        lines.append(f'http_request_duration_seconds_count{_labels(endpoint)} {totals["requests"]}')
+
+    for name, key, help_text in (
+        ('db_queries_total', 'queries', 'Database queries run, by endpoint.'),
+        ('db_query_seconds_total', 'db_seconds', 'Time spent in database queries, by endpoint.'),
+        ('serialize_seconds_total', 'serialize_seconds', 'Time spent rendering responses, by endpoint.'),
+    ):
+        family(name, 'counter', help_text)
+        for endpoint, totals in endpoints.items():
+            lines.append(f'{name}{_labels(endpoint)} {round(totals[key], 6)}')
+
+    family('response_cache_events_total', 'counter', 'Response cache hits and misses.')
+    for key, count in sorted(response_cache.stats().items()):
+        namespace, outcome = key.rsplit('_', 1)
+        lines.append(f'response_cache_events_total{{namespace="{namespace}",outcome="{outcome}"}} {count}')
+
+    if like_buffer.enabled():
+        buffer_stats = like_buffer.stats()
+        family('like_buffer_depth', 'gauge', 'Likes waiting to be flushed.')
+        lines.append(f'like_buffer_depth {buffer_stats["depth"]}')
+        family('like_buffer_flushes_total', 'counter', 'Like buffer flushes.')
+        lines.append(f'like_buffer_flushes_total {buffer_stats.get("flushes", 0)}')
+        family('like_buffer_last_flush_milliseconds', 'gauge', 'Duration of the latest like buffer flush.')
+        lines.append(f'like_buffer_last_flush_milliseconds {buffer_stats.get("last_flush_ms", 0)}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def _may_scrape(request):
+    token = settings.METRICS_TOKEN
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    # Behind a proxy REMOTE_ADDR is the proxy's; scrape with the token there.
+    return request.user.is_staff or request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def metrics_view(request):
+    """``GET /api/metrics``: Prometheus scrape target for this process."""
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if not _may_scrape(request):
+        raise PermissionDenied
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
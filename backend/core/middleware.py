@@ -0,0 +1,48 @@
+"""
+Middleware that runs natively under both WSGI and ASGI.
+
+Under ASGI Django runs every sync-only middleware, and each of its hooks, in
+a worker thread, so one such middleware costs every async request a thread
+hop. ``HybridMiddleware`` subclasses implement ``call`` and ``acall`` and keep
+their ``process_*`` hooks free of I/O; in async mode the hooks are exposed as
+coroutines and run directly on the event loop.
+"""
+from abc import ABC, abstractmethod
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+HOOKS = ('process_view', 'process_template_response', 'process_exception')
+
+
+def _as_coroutine(hook):
+    async def run(*args):
+        return hook(*args)
+    return run
+
+
+class HybridMiddleware(ABC):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            for name in HOOKS:
+                hook = getattr(self, name, None)
+                if hook is not None:
+                    setattr(self, name, _as_coroutine(hook))
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.acall(request)
+        return self.call(request)
+
+    @abstractmethod
+    def call(self, request):
+        """Handle ``request`` under WSGI."""
+
+    @abstractmethod
+    async def acall(self, request):
+        """Handle ``request`` under ASGI."""
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_ledger(apps, schema_editor):
+    Like = apps.get_model('core', 'Like')
+    UserKarma = apps.get_model('core', 'UserKarma')
+    KarmaBucket = apps.get_model('core', 'KarmaBucket')
+
+    buckets, totals = {}, {}
+    for like in Like.objects.select_related('post', 'comment').iterator():
+        target = like.post or like.comment
+        if target.author_id == like.user_id:
+            continue
+        points = 5 if like.post_id else 1
+        key = (target.author_id, like.timestamp.replace(minute=0, second=0, microsecond=0))
+        buckets[key] = buckets.get(key, 0) + points
+        totals[target.author_id] = totals.get(target.author_id, 0) + points
+
+    KarmaBucket.objects.bulk_create(
+        [KarmaBucket(user_id=user_id, hour=hour, points=points) for (user_id, hour), points in buckets.items()],
+        batch_size=1000,
+    )
+    UserKarma.objects.bulk_create(
+        [UserKarma(user_id=user_id, total_karma=total) for user_id, total in totals.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('core', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserKarma',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='karma', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_karma', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='KarmaBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('points', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='karma_buckets', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hour', 'user'], name='karma_bucket_hour_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'hour'), name='unique_karma_bucket')],
+            },
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_karma_ledger'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-timestamp', '-id'], name='post_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:16
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Post = apps.get_model('core', 'Post')
+    Like = apps.get_model('core', 'Like')
+    Comment = apps.get_model('core', 'Comment')
+
+    def count_of(model):
+        return Coalesce(Subquery(
+            model.objects.filter(post_id=OuterRef('pk')).values('post_id')
+            .annotate(n=Count('pk')).values('n'),
+            output_field=IntegerField(),
+        ), 0)
+
+    Post.objects.update(like_count=count_of(Like), comment_count=count_of(Comment))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_post_feed_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
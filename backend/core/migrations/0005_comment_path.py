@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_paths(apps, schema_editor):
+    Comment = apps.get_model('core', 'Comment')
+    width = 10
+
+    parents = dict(Comment.objects.values_list('id', 'parent_id'))
+    paths, depths = {}, {}
+
+    def resolve(comment_id):
+        # Walk up to the first ancestor with a known path, then fill back down.
+        chain = []
+        while comment_id is not None and comment_id not in paths:
+            chain.append(comment_id)
+            comment_id = parents[comment_id]
+        prefix = paths.get(comment_id, '')
+        depth = depths.get(comment_id, -1)
+        for node in reversed(chain):
+            depth += 1
+            prefix += str(node).zfill(width)
+            paths[node], depths[node] = prefix, depth
+
+    for comment_id in parents:
+        resolve(comment_id)
+
+    comments = [Comment(id=i, path=paths[i], depth=depths[i]) for i in parents]
+    Comment.objects.bulk_update(comments, ['path', 'depth'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_post_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='comment_thread_idx'),
+        ),
+    ]
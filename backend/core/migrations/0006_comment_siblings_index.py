@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_comment_path'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'parent', 'timestamp', 'id'], name='comment_siblings_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+def install(apps, schema_editor):
+    from core import search
+    if schema_editor.connection.vendor in search.INSTALL:
+        search.install(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    from core import search
+    if schema_editor.connection.vendor in search.UNINSTALL:
+        search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_comment_siblings_index'),
+    ]
+
+    operations = [
+        # Raw DDL per backend (a generated tsvector column with a GIN index, or
+        # FTS5 tables with triggers), which the model state does not describe.
+        migrations.RunPython(install, uninstall),
+    ]
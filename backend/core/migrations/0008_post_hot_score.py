@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:02
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, Value
+from django.utils import timezone
+
+
+def backfill_scores(apps, schema_editor):
+    # Same as core.hot.refresh(), against the historical model.
+    Post = apps.get_model('core', 'Post')
+    now = timezone.now()
+    cutoff = now - timedelta(hours=settings.HOT_MAX_AGE_HOURS)
+    Post.objects.filter(timestamp__lt=cutoff).update(hot_score=0, hot_decay=0)
+    engagement = 1 + settings.HOT_LIKE_WEIGHT * F('like_count') + settings.HOT_COMMENT_WEIGHT * F('comment_count')
+    posts = []
+    for pk, timestamp in Post.objects.filter(timestamp__gte=cutoff).values_list('pk', 'timestamp'):
+        hours = max((now - timestamp).total_seconds(), 0) / 3600
+        decay = 0.5 ** (hours / settings.HOT_HALF_LIFE_HOURS)
+        posts.append(Post(pk=pk, hot_decay=decay, hot_score=engagement * Value(decay)))
+    Post.objects.bulk_update(posts, ['hot_decay', 'hot_score'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='hot_decay',
+            field=models.FloatField(default=1.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='hot_score',
+            field=models.FloatField(default=1.0, editable=False),
+        ),
+        migrations.RunPython(backfill_scores, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-hot_score', '-id'], name='post_hot_idx'),
+        ),
+    ]
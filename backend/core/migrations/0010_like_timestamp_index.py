@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_like_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['timestamp'], name='like_timestamp_idx'),
+        ),
+    ]
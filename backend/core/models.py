@@ -6,16 +6,99 @@ class Post(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Denormalized counters, bumped with F() in the same transaction as the
+    # Like/Comment write so the feed never has to join and COUNT.
+    like_count = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
+    # Time-decayed engagement for ?sort=hot, maintained by core/hot.py.
+    hot_score = models.FloatField(default=1.0, editable=False)
+    hot_decay = models.FloatField(default=1.0, editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset for the feed: WHERE (timestamp, id) < cursor ORDER BY both DESC.
+            models.Index(fields=['-timestamp', '-id'], name='post_feed_idx'),
+            # The same for the hot feed, over (hot_score, id).
+            models.Index(fields=['-hot_score', '-id'], name='post_hot_idx'),
+        ]
 
     def __str__(self):
         return f"Post by {self.author.username} at {self.timestamp}"
 
+class CommentQuerySet(models.QuerySet):
+    def subtree(self, comment, max_depth=None, include_self=True):
+        """
+        ``comment`` and its descendants as one range scan over ``path``,
+        already in display order. ``max_depth`` is relative to ``comment``.
+        """
+        lower = 'path__gte' if include_self else 'path__gt'
+        qs = self.filter(
+            post_id=comment.post_id,
+            **{lower: comment.path},
+            path__lt=Comment.path_upper(comment.path),
+        )
+        if max_depth is not None:
+            qs = qs.filter(depth__lte=comment.depth + max_depth)
+        return qs.order_by('path')
+
+    def bulk_create_level(self, comments, batch_size=1000):
+        """
+        ``bulk_create`` one level of a thread and write its paths. Every
+        comment's parent must already be saved and set as an instance.
+        """
+        comments = self.bulk_create(comments, batch_size=batch_size)
+        for comment in comments:
+            parent = comment.parent
+            comment.path = (parent.path if parent else '') + Comment.path_segment(comment.pk)
+            comment.depth = parent.depth + 1 if parent else 0
+        self.bulk_update(comments, ['path', 'depth'], batch_size=batch_size)
+        return comments
+
 class Comment(models.Model):
+    # Materialized path: every ancestor's id, zero-padded to PATH_WIDTH digits,
+    # root first. Sorting by path yields the thread depth-first with siblings
+    # oldest first, and a subtree is the contiguous range [path, path_upper).
+    PATH_WIDTH = 10
+
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments')
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    path = models.TextField(default='', editable=False)
+    depth = models.PositiveIntegerField(default=0, editable=False)
+    # Likes moved to ArchivedLike by core/like_archive.py, which keeps this in step.
+    archived_like_count = models.IntegerField(default=0, editable=False)
+
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'path'], name='comment_thread_idx'),
+            # Keyset pages of one node's replies (or a post's roots, parent NULL),
+            # read in (timestamp, id) order without a sort.
+            models.Index(fields=['post', 'parent', 'timestamp', 'id'], name='comment_siblings_idx'),
+        ]
+
+    @classmethod
+    def path_segment(cls, pk):
+        return str(pk).zfill(cls.PATH_WIDTH)
+
+    @classmethod
+    def path_upper(cls, path):
+        """Exclusive upper bound of the subtree under ``path``: its next sibling's path."""
+        head, last = path[:-cls.PATH_WIDTH], path[-cls.PATH_WIDTH:]
+        return head + cls.path_segment(int(last) + 1)
+
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        super().save(*args, **kwargs)
+        if creating and not self.path:
+            # The path ends with our own id, so it can only be written once we have one.
+            parent_path = self.parent.path if self.parent_id else ''
+            self.path = parent_path + self.path_segment(self.pk)
+            self.depth = self.parent.depth + 1 if self.parent_id else 0
+            Comment.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
 
     def __str__(self):
         return f"Comment by {self.author.username} on {self.post.id}"
@@ -32,7 +115,53 @@ class Like(models.Model):
             models.UniqueConstraint(fields=['user', 'post'], name='unique_post_like', condition=models.Q(post__isnull=False)),
             models.UniqueConstraint(fields=['user', 'comment'], name='unique_comment_like', condition=models.Q(comment__isnull=False)),
         ]
+        indexes = [
+            # The likes of the first, partly covered hour of the 24h karma window.
+            models.Index(fields=['timestamp'], name='like_timestamp_idx'),
+        ]
 
     def __str__(self):
         target = self.post if self.post else self.comment
         return f"Like by {self.user.username} on {target}"
+
+class ArchivedLike(models.Model):
+    """A like older than ``LIKE_HOT_DAYS``, moved out of Like by core/like_archive.py."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_likes')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, blank=True, related_name='archived_likes')
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE, null=True, blank=True, related_name='archived_likes')
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_archived_post_like', condition=models.Q(post__isnull=False)),
+            models.UniqueConstraint(fields=['user', 'comment'], name='unique_archived_comment_like', condition=models.Q(comment__isnull=False)),
+        ]
+
+    def __str__(self):
+        target = self.post if self.post else self.comment
+        return f"Archived like by {self.user.username} on {target}"
+
+class UserKarma(models.Model):
+    """Denormalized all-time karma, kept in step with the Like table."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='karma')
+    total_karma = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.total_karma} karma"
+
+class KarmaBucket(models.Model):
+    """Karma received per user per hour; the 24h window sums the newest buckets."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='karma_buckets')
+    hour = models.DateTimeField()
+    points = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'hour'], name='unique_karma_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['hour', 'user'], name='karma_bucket_hour_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}: {self.points} karma at {self.hour}"
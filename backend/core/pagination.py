@@ -0,0 +1,159 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.db.models import Q
+from rest_framework import pagination, response
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Cursor pagination over a ``(field, id)`` keyset, both sorted the same way.
+
+    Each page is a ``WHERE (field, id) < (cursor)`` range read on a matching
+    composite index, so deep pages cost the same as the first one and rows
+    inserted while a client scrolls never shift the pages it has not read yet.
+    """
+    ordering = ('-timestamp', '-id')
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self._page(list(self._page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """``paginate_queryset`` through the async ORM."""
+        return self._page([row async for row in self._page_queryset(queryset, request)])
+
+    def _page_queryset(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.key_field = self.ordering[0].lstrip('-')
+        after = 'lt' if self.ordering[0].startswith('-') else 'gt'
+
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            value, pk = position
+            queryset = queryset.filter(
+                Q(**{f'{self.key_field}__{after}': value}) | Q(**{self.key_field: value, f'id__{after}': pk})
+            )
+        return queryset.order_by(*self.ordering)[:self.page_size + 1]
+
+    def _page(self, page):
+        self.has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        self.next_position = self.get_position(page[-1]) if self.has_next else None
+        return page
+
+    def get_position(self, row):
+        # Pages may hold model instances or .values() dicts.
+        if isinstance(row, dict):
+            return row[self.key_field], row['id']
+        return getattr(row, self.key_field), row.id
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw_value, raw_pk = urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8').rsplit('|', 1)
+            value = model._meta.get_field(self.key_field).to_python(raw_value)
+            return value, int(raw_pk)
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        value, pk = position
+        raw = f"{value.isoformat() if hasattr(value, 'isoformat') else value}|{pk}"
+        return urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return response.Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class FeedPagination(KeysetPagination):
+    ordering = ('-timestamp', '-id')
+
+
+class HotPagination(KeysetPagination):
+    """Hottest first (see core/hot.py)."""
+    ordering = ('-hot_score', '-id')
+
+
+FEED_SORTS = {'new': FeedPagination, 'hot': HotPagination}
+
+
+def feed_pagination(params):
+    """The pagination class for the feed's ``?sort=`` ('new', the default, or 'hot')."""
+    sort = params.get('sort', 'new')
+    if sort not in FEED_SORTS:
+        raise ParseError(f"Unknown sort {sort!r}; use one of: {', '.join(FEED_SORTS)}.")
+    return FEED_SORTS[sort]
+
+
+class CommentPagination(KeysetPagination):
+    """Oldest first, like the thread is read."""
+    ordering = ('timestamp', 'id')
+    page_size = 50
+
+
+class SearchPagination(KeysetPagination):
+    """
+    Best match first, over a ``(score, kind, id)`` keyset (see core/search.py).
+
+    ``paginate_queryset`` takes the ``matches(after, limit)`` function that
+    reads the rows rather than a queryset.
+    """
+    page_size = 20
+
+    def paginate_queryset(self, matches, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        return self._page(matches(self.decode_cursor(request), self.page_size + 1))
+
+    def get_position(self, row):
+        return tuple(row)
+
+    def decode_cursor(self, request, model=None):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            score, kind, pk = urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8').split('|')
+            return float(score), kind, int(pk)
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        score, kind, pk = position
+        # repr() round-trips the float exactly, so the next page starts right after this one.
+        return urlsafe_b64encode(f'{score!r}|{kind}|{pk}'.encode('utf-8')).decode('ascii')
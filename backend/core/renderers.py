@@ -0,0 +1,48 @@
+"""
+JSON rendering and parsing through orjson, when it is installed.
+
+orjson encodes and decodes several times faster than the standard library.
+``FastJSONRenderer`` produces the same compact UTF-8 JSON as DRF's
+``JSONRenderer``, and types orjson does not handle itself (datetimes, lazy
+strings, decimals, ...) go through DRF's encoder, so they come out in the
+same format. Without orjson, and for anything orjson rejects (an indented
+response asked for in ``Accept``, integers wider than 64 bits), both classes
+fall back to DRF's stdlib implementation.
+"""
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    # Datetimes go to DRF's encoder, which writes UTC as 'Z' like the serializers do.
+    OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            content = orjson.dumps(data, default=self.encoder_class().default, option=OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # As DRF does: JSON allows these two line terminators raw, JavaScript does not.
+        return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8')
+        if orjson is None or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
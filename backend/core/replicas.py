@@ -0,0 +1,86 @@
+"""
+Read replicas with read-your-writes.
+
+With ``DATABASE_REPLICA_URLS`` set, ``ReplicaMiddleware`` marks requests to
+the read-only endpoints in ``REPLICA_ENDPOINTS`` (named as in
+``core.metrics``, e.g. ``PostViewSet.list``) and ``ReplicaRouter`` sends
+their reads to a random replica. Everything else, writes and reads outside
+those requests (background threads, management commands), stays on the
+primary.
+
+A replica may lag behind the primary, so a client that just liked or
+commented would not see its own write. Every write request therefore sets a
+short-lived cookie, and for ``REPLICA_STICKY_SECONDS`` afterwards that
+client's reads stay on the primary too. Cached responses are shared between
+clients, so the response cache does not keep pages built on a replica in
+that window after a write to what they show (see ``core.cache.cached``).
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from .metrics import endpoint_name
+from .middleware import HybridMiddleware
+
+STICKY_COOKIE = 'use_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_replica = ContextVar('replica', default=None)
+
+
+def current():
+    """The replica this request reads from, or None for the primary."""
+    return _replica.get()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _replica.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+class ReplicaMiddleware(HybridMiddleware):
+    def call(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _replica.set(None)
+        return self._pin(request, response)
+
+    async def acall(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _replica.set(None)
+        return self._pin(request, response)
+
+    def _pin(self, request, response):
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(
+                STICKY_COOKIE, '1', max_age=settings.REPLICA_STICKY_SECONDS,
+                secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite=settings.SESSION_COOKIE_SAMESITE,
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            settings.DATABASE_REPLICAS
+            and request.method in SAFE_METHODS
+            and STICKY_COOKIE not in request.COOKIES
+            and endpoint_name(view_func, request.method) in settings.REPLICA_ENDPOINTS
+        ):
+            _replica.set(random.choice(settings.DATABASE_REPLICAS))
@@ -0,0 +1,174 @@
+"""
+Full-text search over posts and comments.
+
+The index lives in the database, next to the rows it covers, and the
+database keeps it current on every insert, update and delete (``save``,
+``bulk_create``, the admin and raw SQL alike):
+
+* PostgreSQL: a generated ``search_vector`` column
+  (``to_tsvector('english', content)``) on ``core_post`` and
+  ``core_comment``, each with a GIN index; ranked with ``ts_rank``.
+* SQLite: an FTS5 table per model (``core_post_search``,
+  ``core_comment_search``) over the model's table as external content, kept
+  in step by triggers; ranked with ``bm25``. The porter tokenizer stems
+  words as the ``english`` configuration does.
+
+``matches`` returns one page of ``(score, kind, id)`` rows, best first.
+Scores are normalised so that lower is better on both backends, and the
+page is a keyset range over ``(score, kind, id)``, so ``SearchPagination``
+can cursor through the results like it does the feed.
+"""
+import re
+
+from django.db import connections, router
+
+from .models import Comment, Post
+
+MODELS = {'post': Post, 'comment': Comment}
+MAX_TERMS = 16
+
+_WORD = re.compile(r'\w+')
+
+
+def terms(query):
+    """The words of a user's query; punctuation and search operators are dropped."""
+    return _WORD.findall(query or '')[:MAX_TERMS]
+
+
+def _tables():
+    return [(kind, model._meta.db_table) for kind, model in MODELS.items()]
+
+
+# Install / uninstall (from the migration, and after every migrate; see apps.py).
+
+def _sqlite_install(cursor):
+    for kind, table in _tables():
+        index = f'{table}_search'
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [index])
+        created = cursor.fetchone() is None
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5("
+            f"content, content='{table}', content_rowid='id', tokenize='porter unicode61')"
+        )
+        # SQLite drops a table's triggers when a migration rebuilds the table,
+        # so they are recreated here rather than only once.
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {index}(rowid, content) VALUES (new.id, new.content); END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {index}({index}, rowid, content) VALUES ('delete', old.id, old.content); END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF content ON {table} BEGIN "
+            f"INSERT INTO {index}({index}, rowid, content) VALUES ('delete', old.id, old.content); "
+            f"INSERT INTO {index}(rowid, content) VALUES (new.id, new.content); END"
+        )
+        if created:
+            cursor.execute(f"INSERT INTO {index}({index}) VALUES ('rebuild')")
+
+
+def _sqlite_uninstall(cursor):
+    for kind, table in _tables():
+        for suffix in ('insert', 'delete', 'update'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {table}_search_{suffix}')
+        cursor.execute(f'DROP TABLE IF EXISTS {table}_search')
+
+
+def _postgresql_install(cursor):
+    for kind, table in _tables():
+        cursor.execute(
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('english', content)) STORED"
+        )
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {table}_search_idx ON {table} USING gin (search_vector)')
+
+
+def _postgresql_uninstall(cursor):
+    for kind, table in _tables():
+        cursor.execute(f'DROP INDEX IF EXISTS {table}_search_idx')
+        cursor.execute(f'ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector')
+
+
+INSTALL = {'sqlite': _sqlite_install, 'postgresql': _postgresql_install}
+UNINSTALL = {'sqlite': _sqlite_uninstall, 'postgresql': _postgresql_uninstall}
+
+
+def install(connection):
+    """Create the index on ``connection`` if it is missing. Idempotent."""
+    with connection.cursor() as cursor:
+        INSTALL[connection.vendor](cursor)
+
+
+def uninstall(connection):
+    with connection.cursor() as cursor:
+        UNINSTALL[connection.vendor](cursor)
+
+
+# Queries.
+
+def _sqlite_branch(kind, table):
+    return (
+        f"SELECT bm25({table}_search) AS score, '{kind}' AS kind, rowid AS id "
+        f"FROM {table}_search WHERE {table}_search MATCH %s"
+    )
+
+
+def _sqlite_query(words):
+    # Each word quoted, so FTS5 never reads user input as query syntax.
+    return ' '.join(f'"{word}"' for word in words)
+
+
+def _postgresql_branch(kind, table):
+    return (
+        f"SELECT -ts_rank(search_vector, query) AS score, '{kind}' AS kind, id "
+        f"FROM {table}, plainto_tsquery('english', %s) query WHERE search_vector @@ query"
+    )
+
+
+def _postgresql_query(words):
+    return ' '.join(words)
+
+
+BRANCHES = {'sqlite': _sqlite_branch, 'postgresql': _postgresql_branch}
+QUERIES = {'sqlite': _sqlite_query, 'postgresql': _postgresql_query}
+
+
+def matches(words, after=None, limit=20):
+    """
+    Up to ``limit`` ``(score, kind, id)`` rows matching every one of
+    ``words``, best first, starting after the ``after`` position.
+    """
+    connection = connections[router.db_for_read(Post)]
+    vendor = connection.vendor
+    branches = [BRANCHES[vendor](kind, table) for kind, table in _tables()]
+    params = [QUERIES[vendor](words)] * len(branches)
+    where = ''
+    if after is not None:
+        where = 'WHERE (score, kind, id) > (%s, %s, %s)'
+        params += list(after)
+    sql = (
+        f"SELECT score, kind, id FROM ({' UNION ALL '.join(branches)}) matches "
+        f"{where} ORDER BY score, kind, id LIMIT %s"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [limit])
+        return cursor.fetchall()
+
+
+def hits(rows):
+    """The posts and comments behind ``rows``, in order, each tagged with ``search_kind``."""
+    ids = {kind: [pk for _, row_kind, pk in rows if row_kind == kind] for kind in MODELS}
+    found = {
+        kind: MODELS[kind].objects.select_related('author').in_bulk(ids[kind]) if ids[kind] else {}
+        for kind in MODELS
+    }
+    results = []
+    for _, kind, pk in rows:
+        # A row deleted since the match was read is skipped.
+        obj = found[kind].get(pk)
+        if obj is not None:
+            obj.search_kind = kind
+            results.append(obj)
+    return results
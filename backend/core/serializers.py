@@ -1,6 +1,40 @@
 from rest_framework import serializers
+from rest_framework.exceptions import ParseError
 from django.contrib.auth.models import User
 from .models import Post, Comment, Like
+from . import like_archive
+
+def sparse_fields(params, available):
+    """
+    The field names in ``?fields=`` (comma-separated), always with ``id``,
+    or None when the parameter is absent. Unknown names are a 400.
+    """
+    raw = params.get('fields')
+    if not raw:
+        return None
+    wanted = {name.strip() for name in raw.split(',') if name.strip()}
+    unknown = wanted - set(available)
+    if unknown:
+        raise ParseError(
+            f"Unknown field(s) in ?fields=: {', '.join(sorted(unknown))}. Available: {', '.join(available)}."
+        )
+    return wanted | {'id'}
+
+class SparseFieldsMixin:
+    """
+    On GET, serialize only the fields named in ``?fields=``. The others are
+    dropped before serializing, so their methods and nested serializers
+    never run.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        wanted = sparse_fields(getattr(request, 'query_params', request.GET), self.Meta.fields)
+        if wanted is not None:
+            for name in set(self.fields) - wanted:
+                self.fields.pop(name)
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -12,15 +46,31 @@ class LikeSerializer(serializers.ModelSerializer):
         model = Like
         fields = ['id', 'user', 'post', 'comment', 'timestamp']
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     replies = serializers.SerializerMethodField()
+    more_replies = serializers.SerializerMethodField()
     like_count = serializers.IntegerField(read_only=True)
     user_has_liked = serializers.SerializerMethodField()
 
     class Meta:
         model = Comment
-        fields = ['id', 'post', 'parent', 'author', 'content', 'timestamp', 'replies', 'like_count', 'user_has_liked']
+        fields = ['id', 'post', 'parent', 'author', 'content', 'timestamp', 'replies', 'more_replies', 'like_count', 'user_has_liked']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance is not None:
+            # A comment's place is fixed once posted: its path, its replies'
+            # paths and the posts' comment counts all depend on it.
+            for name in ('post', 'parent'):
+                if name in self.fields:
+                    self.fields[name].read_only = True
+
+    def validate(self, attrs):
+        parent = attrs.get('parent')
+        if parent is not None and 'post' in attrs and parent.post_id != attrs['post'].pk:
+            raise serializers.ValidationError({'parent': 'A reply must be on the same post as its parent.'})
+        return attrs
 
     def get_replies(self, obj):
         # This will be used for nested serializing. 
@@ -29,13 +79,21 @@ class CommentSerializer(serializers.ModelSerializer):
             return CommentSerializer(obj.prefetched_replies, many=True, context=self.context).data
         return CommentSerializer(obj.replies.all(), many=True, context=self.context).data
 
+    def get_more_replies(self, obj):
+        # Link to the rest of a truncated subtree, set by the tree builder.
+        return getattr(obj, 'more_replies', None)
+
     def get_user_has_liked(self, obj):
+        # The views annotate this in bulk; only bare instances (e.g. a freshly
+        # created comment) fall back to a query.
+        if hasattr(obj, 'user_has_liked'):
+            return obj.user_has_liked
         user = self.context.get('request').user
         if user.is_authenticated:
-            return Like.objects.filter(user=user, comment=obj).exists()
+            return like_archive.has_liked(user, 'comment', obj)
         return False
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     like_count = serializers.IntegerField(read_only=True)
     comment_count = serializers.IntegerField(read_only=True)
@@ -46,7 +104,23 @@ class PostSerializer(serializers.ModelSerializer):
         fields = ['id', 'author', 'content', 'timestamp', 'like_count', 'comment_count', 'user_has_liked']
 
     def get_user_has_liked(self, obj):
+        # The views annotate this in bulk; only bare instances (e.g. a freshly
+        # created post) fall back to a query.
+        if hasattr(obj, 'user_has_liked'):
+            return obj.user_has_liked
         user = self.context.get('request').user
         if user.is_authenticated:
-            return Like.objects.filter(user=user, post=obj).exists()
+            return like_archive.has_liked(user, 'post', obj)
         return False
+
+class SearchHitSerializer(serializers.Serializer):
+    """A post or comment in search results; ``post`` is the thread to open."""
+    type = serializers.CharField(source='search_kind')
+    id = serializers.IntegerField()
+    post = serializers.SerializerMethodField()
+    author = UserSerializer()
+    content = serializers.CharField()
+    timestamp = serializers.DateTimeField()
+
+    def get_post(self, obj):
+        return obj.post_id if obj.search_kind == 'comment' else obj.id
@@ -1,3 +1,1494 @@
-from django.test import TestCase
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, connections
+from django.http import HttpResponse
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+
+from .models import ArchivedLike, Post, Comment, KarmaBucket, Like
+from . import auth_cache, events, hot, identity, karma, leaderboard, like_archive, like_buffer, likes, metrics, renderers, replicas
+from . import cache as response_cache
+from . import urls as core_urls
+from .serializers import CommentSerializer
+from .views import PostViewSet, comment_queryset
+
+# API tests talk plain HTTP, read around the response cache, never start
+# background leaderboard rebuilds, read from the primary even when replicas
+# are configured, fail any request over its query budget and read karma
+# and the signed-in user straight from the database.
+api_test = override_settings(
+    SECURE_SSL_REDIRECT=False, RESPONSE_CACHE_ENABLED=False, LEADERBOARD_REVALIDATE=False,
+    DATABASE_REPLICAS=[], QUERY_BUDGET_STRICT=True, USER_CACHE_TTL=0, KARMA_SUMMARY_TTL=0,
+)
+
+
+@api_test
+class KarmaEngineTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.carol = User.objects.create_user('carol')
+        self.post = Post.objects.create(author=self.alice, content='hello')
+        self.comment = Comment.objects.create(post=self.post, author=self.bob, content='hi')
+
+    def test_points_and_self_likes(self):
+        Like.objects.create(user=self.bob, post=self.post)
+        Like.objects.create(user=self.carol, post=self.post)
+        Like.objects.create(user=self.alice, comment=self.comment)
+        # Self-likes never count.
+        Like.objects.create(user=self.bob, comment=self.comment)
+        karma.rebuild_ledger()
+
+        self.assertEqual(karma.user_karma(self.alice), (10, 10))
+        self.assertEqual(karma.user_karma(self.bob), (1, 1))
+        self.assertEqual(karma.user_karma(self.carol), (0, 0))
+
+    def test_recent_window(self):
+        like = Like.objects.create(user=self.bob, post=self.post)
+        Like.objects.filter(pk=like.pk).update(timestamp=timezone.now() - timedelta(hours=25))
+        Like.objects.create(user=self.alice, comment=self.comment)
+        karma.rebuild_ledger()
+
+        self.assertEqual(karma.user_karma(self.alice), (0, 5))
+        self.assertEqual(karma.leaderboard(), [
+            {'id': self.bob.id, 'username': 'bob', 'recent_karma': 1, 'total_karma': 1},
+        ])
+
+    def test_recent_window_edge(self):
+        now = timezone.now().replace(minute=30, second=0, microsecond=0)
+        inside = Like.objects.create(user=self.bob, post=self.post)
+        Like.objects.filter(pk=inside.pk).update(timestamp=now - timedelta(hours=23, minutes=55))
+        # In the same hourly bucket, but just outside the window.
+        outside = Like.objects.create(user=self.carol, post=self.post)
+        Like.objects.filter(pk=outside.pk).update(timestamp=now - timedelta(hours=24, minutes=5))
+        karma.rebuild_ledger(now)
+
+        self.assertEqual(karma.user_karma(self.alice, now), (5, 10))
+        self.assertEqual(karma.leaderboard(now=now), [
+            {'id': self.alice.id, 'username': 'alice', 'recent_karma': 5, 'total_karma': 10},
+        ])
+        # An hour later the first like has left the window too.
+        self.assertEqual(karma.user_karma(self.alice, now + timedelta(hours=1)), (0, 10))
+        self.assertEqual(karma.leaderboard(now=now + timedelta(hours=1)), [])
+
+    def test_leaderboard_is_one_query(self):
+        for i in range(10):
+            user = User.objects.create_user(f'user{i}')
+            Like.objects.create(user=user, post=self.post)
+            Like.objects.create(user=user, comment=self.comment)
+        karma.rebuild_ledger()
+
+        with self.assertNumQueries(1):
+            leaderboard.refresh()
+        with self.assertNumQueries(0):
+            data = APIClient().get('/api/leaderboard/').json()
+
+        self.assertEqual([row['username'] for row in data], ['alice', 'bob'])
+        self.assertEqual(data[0]['recent_karma'], 50)
+        self.assertEqual(data[1]['total_karma'], 10)
+
+    def test_toggles_keep_ledger_in_step(self):
+        client = APIClient()
+        client.force_login(self.bob)
+        client.post(f'/api/posts/{self.post.id}/like/')
+        client.force_login(self.alice)
+        client.post(f'/api/comments/{self.comment.id}/like/')
+        self.assertEqual(karma.user_karma(self.alice), (5, 5))
+        self.assertEqual(karma.user_karma(self.bob), (1, 1))
+
+        client.post(f'/api/comments/{self.comment.id}/like/')
+        self.assertEqual(karma.user_karma(self.bob), (0, 0))
+        self.assertEqual(karma.ledger_drift(), ([], []))
+
+    def test_destroy_forgets_cascaded_likes(self):
+        reply = Comment.objects.create(post=self.post, parent=self.comment, author=self.carol, content='yo')
+        client = APIClient()
+        client.force_login(self.alice)
+        client.post(f'/api/comments/{reply.id}/like/')
+        client.post(f'/api/comments/{self.comment.id}/like/')
+        client.force_login(self.carol)
+        client.post(f'/api/posts/{self.post.id}/like/')
+
+        client.delete(f'/api/comments/{self.comment.id}/')
+        self.assertEqual(karma.ledger_drift(), ([], []))
+        self.assertEqual(karma.user_karma(self.carol), (0, 0))
+
+        client.delete(f'/api/posts/{self.post.id}/')
+        self.assertEqual(karma.ledger_drift(), ([], []))
+        self.assertEqual(karma.user_karma(self.alice), (0, 0))
+
+    def test_rebuild_command_reconciles(self):
+        Like.objects.create(user=self.bob, post=self.post)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_karma', '--check', stdout=StringIO())
+        call_command('rebuild_karma', stdout=StringIO())
+        call_command('rebuild_karma', '--check', stdout=StringIO())
+        self.assertEqual(karma.user_karma(self.alice), (5, 5))
+
+    @override_settings(KARMA_BUCKET_RETENTION_HOURS=30)
+    def test_compaction_keeps_totals(self):
+        now = timezone.now()
+        old = Like.objects.create(user=self.bob, post=self.post)
+        Like.objects.filter(pk=old.pk).update(timestamp=now - timedelta(hours=40))
+        Like.objects.create(user=self.carol, post=self.post)
+        Like.objects.create(user=self.alice, comment=self.comment)
+        stale = Like.objects.create(user=self.carol, comment=self.comment)
+        Like.objects.filter(pk=stale.pk).update(timestamp=now - timedelta(hours=50))
+        with override_settings(KARMA_BUCKET_RETENTION_HOURS=60):
+            self.assertEqual(karma.rebuild_ledger(), 4)
+        self.assertEqual(karma.ledger_drift(), ([], []))
+
+        self.assertEqual(karma.compact(), 2)
+        self.assertEqual(karma.user_karma(self.alice), (5, 10))
+        self.assertEqual(karma.user_karma(self.bob), (1, 2))
+        self.assertFalse(KarmaBucket.objects.filter(hour__lt=now - timedelta(hours=30)).exists())
+
+        # A late unlike of a compacted like only moves the total.
+        karma.forget_likes(Like.objects.filter(pk=stale.pk))
+        Like.objects.filter(pk=stale.pk).delete()
+        self.assertEqual(karma.user_karma(self.bob), (1, 1))
+        self.assertFalse(KarmaBucket.objects.filter(hour__lt=now - timedelta(hours=30)).exists())
+        self.assertEqual(karma.ledger_drift(), ([], []))
+
+        self.assertEqual(karma.rebuild_ledger(), 2)
+        self.assertEqual(karma.ledger_drift(), ([], []))
+        out = StringIO()
+        call_command('compact_karma', stdout=out)
+        self.assertIn('0 bucket(s)', out.getvalue())
+
+
+@api_test
+@override_settings(LIKE_ARCHIVE_ENABLED=True, LIKE_HOT_DAYS=30)
+class LikeArchiveTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.post = Post.objects.create(author=self.alice, content='hi')
+        self.comment = Comment.objects.create(post=self.post, author=self.alice, content='first')
+        self.client = APIClient()
+        self.client.force_login(self.bob)
+
+    def _archive_likes(self):
+        self.client.put(f'/api/posts/{self.post.id}/like/')
+        self.client.put(f'/api/comments/{self.comment.id}/like/')
+        Like.objects.update(timestamp=timezone.now() - timedelta(days=40))
+        karma.rebuild_ledger()
+        out = StringIO()
+        call_command('roll_likes', stdout=out)
+        self.assertIn('2 like(s)', out.getvalue())
+
+    def _comment(self):
+        return self.client.get(f'/api/posts/{self.post.id}/comments/').data['results'][0]
+
+    def test_archived_likes_still_count(self):
+        self._archive_likes()
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(ArchivedLike.objects.count(), 2)
+        self.assertEqual(karma.ledger_drift(), ([], []))
+        self.assertEqual(karma.user_karma(self.alice), (0, 6))
+
+        post = self.client.get('/api/posts/').data['results'][0]
+        self.assertEqual((post['like_count'], post['user_has_liked']), (1, True))
+        comment = self._comment()
+        self.assertEqual((comment['like_count'], comment['user_has_liked']), (1, True))
+
+        # Liking again is a no-op even though Like itself has no row.
+        self.assertEqual(self.client.put(f'/api/posts/{self.post.id}/like/').status_code, 200)
+        self.assertFalse(Like.objects.exists())
+
+    def test_unlike_from_the_archive(self):
+        self._archive_likes()
+        self.client.delete(f'/api/comments/{self.comment.id}/like/')
+        self.assertEqual(ArchivedLike.objects.count(), 1)
+        comment = self._comment()
+        self.assertEqual((comment['like_count'], comment['user_has_liked']), (0, False))
+        self.assertEqual(karma.user_karma(self.alice), (0, 5))
+        self.assertEqual(karma.ledger_drift(), ([], []))
+
+        self.assertEqual(self.client.put(f'/api/comments/{self.comment.id}/like/').status_code, 201)
+        self.assertEqual(self._comment()['like_count'], 1)
+
+        self.client.delete(f'/api/posts/{self.post.id}/')
+        self.assertFalse(ArchivedLike.objects.exists())
+        self.assertEqual(karma.user_karma(self.alice), (0, 0))
+
+    def test_rolling_twice_counts_once(self):
+        self._archive_likes()
+        self.assertEqual(like_archive.roll(), 0)
+        # A copy left in the archive, e.g. by an overlapping roll, is not counted again.
+        archived = ArchivedLike.objects.get(comment=self.comment)
+        Like.objects.create(user=self.bob, comment=self.comment)
+        Like.objects.filter(comment=self.comment).update(timestamp=archived.timestamp)
+        self.assertEqual(like_archive.roll(), 1)
+        self.assertEqual(ArchivedLike.objects.count(), 2)
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(Comment.objects.get(pk=self.comment.pk).archived_like_count, 1)
+        self.assertEqual(self._comment()['like_count'], 1)
+
+    @override_settings(LIKE_ARCHIVE_ENABLED=False)
+    def test_roll_needs_the_archive_on(self):
+        with self.assertRaises(CommandError):
+            call_command('roll_likes', stdout=StringIO())
+
+
+@api_test
+class LikedStateQueryTests(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create_user('viewer')
+        self.author = User.objects.create_user('author')
+        self.client = APIClient()
+        self.client.force_login(self.viewer)
+
+    def _queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get(url).json()
+        return len(ctx), data
+
+    def test_feed_query_count_is_constant(self):
+        Post.objects.create(author=self.author, content='first')
+        small, _ = self._queries('/api/posts/')
+        posts = [Post.objects.create(author=self.author, content=str(i)) for i in range(20)]
+        Like.objects.create(user=self.viewer, post=posts[3])
+        large, data = self._queries('/api/posts/')
+
+        self.assertEqual(small, large)
+        liked = {row['id'] for row in data['results'] if row['user_has_liked']}
+        self.assertEqual(liked, {posts[3].id})
+
+    def _thread(self, width):
+        post = Post.objects.create(author=self.author, content='thread')
+        root = Comment.objects.create(post=post, author=self.author, content='root')
+        leaves = []
+        for i in range(width):
+            reply = Comment.objects.create(post=post, parent=root, author=self.author, content=str(i))
+            leaves += [
+                Comment.objects.create(post=post, parent=reply, author=self.author, content=f'{i}.{j}')
+                for j in range(width)
+            ]
+        return post, leaves
+
+    def test_comment_tree_query_count_is_constant(self):
+        post, _ = self._thread(1)
+        small, _ = self._queries(f'/api/posts/{post.id}/comments/')
+        post, leaves = self._thread(10)
+        Like.objects.create(user=self.viewer, comment=leaves[-1])
+        large, data = self._queries(f'/api/posts/{post.id}/comments/')
+
+        self.assertEqual(small, large)
+        replies = data['results'][0]['replies']
+        liked = [leaf['id'] for reply in replies for leaf in reply['replies'] if leaf['user_has_liked']]
+        self.assertEqual(liked, [leaves[-1].id])
+
+    def test_comment_list_and_detail_query_counts_are_constant(self):
+        self._thread(1)
+        small_list, _ = self._queries('/api/comments/')
+        small_root = Comment.objects.latest('id').parent.parent
+        small_detail, _ = self._queries(f'/api/comments/{small_root.id}/')
+
+        post, leaves = self._thread(10)
+        Like.objects.create(user=self.viewer, comment=leaves[-1])
+        root = leaves[-1].parent.parent
+        large_list, listed = self._queries('/api/comments/')
+        large_detail, detail = self._queries(f'/api/comments/{root.id}/')
+
+        self.assertEqual((small_list, small_detail), (large_list, large_detail))
+        self.assertEqual(len(listed), Comment.objects.count())
+        # Listed comments do not nest their replies; they link to them.
+        listed_root = next(node for node in listed if node['id'] == root.id)
+        self.assertEqual(listed_root['replies'], [])
+        self.assertIn(f'/api/comments/{root.id}/replies/', listed_root['more_replies'])
+        self.assertEqual([node['id'] for node in listed if node['user_has_liked']], [leaves[-1].id])
+
+        self.assertEqual(len(detail['replies']), 10)
+        self.assertEqual(detail['like_count'], 0)
+        liked = [leaf['id'] for reply in detail['replies'] for leaf in reply['replies'] if leaf['user_has_liked']]
+        self.assertEqual(liked, [leaves[-1].id])
+        self.assertEqual(self.client.get('/api/comments/999/').status_code, 404)
+
+
+@api_test
+class FeedPaginationTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        now = timezone.now()
+        self.posts = [Post.objects.create(author=self.author, content=str(i)) for i in range(25)]
+        # Collide timestamps in pairs so the id tie-breaker matters.
+        for i, post in enumerate(self.posts):
+            Post.objects.filter(pk=post.pk).update(timestamp=now - timedelta(minutes=i // 2))
+        self.client = APIClient()
+
+    def test_walks_feed_in_keyset_order(self):
+        url, seen = '/api/posts/?page_size=10', []
+        while url:
+            page = self.client.get(url).json()
+            seen += [row['id'] for row in page['results']]
+            url = page['next']
+            if len(seen) == 10:
+                # A post arriving mid-scroll must not shift later pages.
+                Post.objects.create(author=self.author, content='late')
+
+        expected = Post.objects.exclude(content='late').order_by('-timestamp', '-id')
+        self.assertEqual(seen, list(expected.values_list('id', flat=True)))
+
+    def test_deep_page_costs_the_same(self):
+        first = self.client.get('/api/posts/?page_size=5').json()
+        with CaptureQueriesContext(connection) as page_one:
+            self.client.get('/api/posts/?page_size=5')
+        with CaptureQueriesContext(connection) as page_two:
+            self.client.get(first['next'])
+        self.assertEqual(len(page_one), len(page_two))
+        self.assertNotIn('OFFSET', page_two.captured_queries[-1]['sql'])
+
+    def test_rejects_garbage_cursor(self):
+        self.assertEqual(self.client.get('/api/posts/?cursor=nope').status_code, 404)
+
+
+@api_test
+class PostCounterTests(TestCase):
+    def test_counters_follow_writes(self):
+        author, fan = User.objects.create_user('author'), User.objects.create_user('fan')
+        post = Post.objects.create(author=author, content='hello')
+        client = APIClient()
+        client.force_login(fan)
+
+        client.post(f'/api/posts/{post.id}/like/')
+        root = client.post('/api/comments/', {'post': post.id, 'content': 'a'}).json()
+        client.post('/api/comments/', {'post': post.id, 'parent': root['id'], 'content': 'b'})
+        post.refresh_from_db()
+        self.assertEqual((post.like_count, post.comment_count), (1, 2))
+
+        client.post(f'/api/posts/{post.id}/like/')
+        client.delete(f"/api/comments/{root['id']}/")
+        post.refresh_from_db()
+        self.assertEqual((post.like_count, post.comment_count), (0, 0))
+
+        row = client.get('/api/posts/').json()['results'][0]
+        self.assertEqual((row['like_count'], row['comment_count']), (0, 0))
+
+    def test_moving_a_comment_keeps_counters(self):
+        author = User.objects.create_user('author')
+        post, other = (Post.objects.create(author=author, content=name) for name in ('hello', 'other'))
+        client = APIClient()
+        client.force_login(author)
+        root = client.post('/api/comments/', {'post': post.id, 'content': 'a'}).json()
+        client.post('/api/comments/', {'post': post.id, 'parent': root['id'], 'content': 'b'})
+
+        client.patch(f"/api/comments/{root['id']}/", {'post': other.id})
+        for target in (post, other):
+            target.refresh_from_db()
+            self.assertEqual(target.comment_count, target.comments.count())
+        self.assertEqual((post.comment_count, other.comment_count), (2, 0))
+
+
+@api_test
+class CommentTreeLimitsTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.post = Post.objects.create(author=self.author, content='thread')
+        self.client = APIClient()
+
+    def _comment(self, parent=None, content='x'):
+        return Comment.objects.create(post=self.post, parent=parent, author=self.author, content=content)
+
+    def test_pages_roots(self):
+        roots = [self._comment(content=str(i)) for i in range(3)]
+        page = self.client.get(f'/api/posts/{self.post.id}/comments/?page_size=2').json()
+        self.assertEqual([c['id'] for c in page['results']], [roots[0].id, roots[1].id])
+        page = self.client.get(page['next']).json()
+        self.assertEqual([c['id'] for c in page['results']], [roots[2].id])
+        self.assertIsNone(page['next'])
+
+    def test_caps_replies_with_continuation(self):
+        root = self._comment()
+        replies = [self._comment(root, str(i)) for i in range(5)]
+        tree = self.client.get(f'/api/posts/{self.post.id}/comments/?replies=2').json()['results'][0]
+        self.assertEqual([c['id'] for c in tree['replies']], [r.id for r in replies[:2]])
+
+        seen, url = [], tree['more_replies']
+        while url:
+            page = self.client.get(url).json()
+            seen += [c['id'] for c in page['results']]
+            url = page['next']
+        self.assertEqual(seen, [r.id for r in replies[2:]])
+
+    def test_limits_depth_with_continuation(self):
+        chain = [self._comment()]
+        for i in range(3):
+            chain.append(self._comment(chain[-1], str(i)))
+        tree = self.client.get(f'/api/posts/{self.post.id}/comments/?depth=2').json()['results'][0]
+        child = tree['replies'][0]
+        self.assertIsNone(tree['more_replies'])
+        self.assertEqual(child['replies'], [])
+
+        subtree = self.client.get(child['more_replies']).json()['results']
+        self.assertEqual(subtree[0]['id'], chain[2].id)
+        self.assertEqual(subtree[0]['replies'][0]['id'], chain[3].id)
+
+
+    def test_fast_tree_matches_serializer_shape(self):
+        viewer = User.objects.create_user('viewer')
+        root = self._comment()
+        reply = self._comment(root)
+        Like.objects.create(user=viewer, comment=reply)
+        self.client.force_login(viewer)
+        tree = self.client.get(f'/api/posts/{self.post.id}/comments/').json()['results'][0]
+
+        request = APIRequestFactory().get('/')
+        request.user = viewer
+        for node, comment in ((tree, root), (tree['replies'][0], reply)):
+            instance = comment_queryset(viewer).get(pk=comment.pk)
+            expected = CommentSerializer(instance, context={'request': request}).data
+            expected = json.loads(JSONRenderer().render(expected))
+            self.assertEqual(list(node), list(expected))
+            self.assertEqual({**node, 'replies': []}, {**expected, 'replies': []})
+
+
+@api_test
+class CommentPathTests(TestCase):
+    def test_subtree_is_one_ordered_range(self):
+        author = User.objects.create_user('author')
+        post = Post.objects.create(author=author, content='thread')
+        make = lambda parent=None: Comment.objects.create(post=post, parent=parent, author=author, content='x')
+        a = make()
+        b = make(a)
+        c = make(b)
+        d = make(a)
+        e = make()
+
+        self.assertEqual((c.depth, c.path), (2, a.path + Comment.path_segment(b.id) + Comment.path_segment(c.id)))
+        self.assertEqual(list(Comment.objects.order_by('path')), [a, b, c, d, e])
+        with self.assertNumQueries(1):
+            self.assertEqual(list(Comment.objects.subtree(a, max_depth=1)), [a, b, d])
+        self.assertEqual(list(Comment.objects.subtree(b, include_self=False)), [c])
+
+    def test_comments_cannot_move(self):
+        author = User.objects.create_user('author')
+        post, other = (Post.objects.create(author=author, content=name) for name in ('thread', 'other'))
+        root = Comment.objects.create(post=post, author=author, content='root')
+        reply = Comment.objects.create(post=post, parent=root, author=author, content='reply')
+        stray = Comment.objects.create(post=other, author=author, content='stray')
+        client = APIClient()
+        client.force_login(author)
+
+        response = client.patch(f'/api/comments/{reply.id}/', {'post': other.id, 'parent': stray.id, 'content': 'edited'})
+        self.assertEqual(response.status_code, 200)
+        reply.refresh_from_db()
+        self.assertEqual((reply.post_id, reply.parent_id, reply.content), (post.id, root.id, 'edited'))
+        self.assertEqual(list(Comment.objects.subtree(root)), [root, reply])
+
+        response = client.post('/api/comments/', {'post': post.id, 'parent': stray.id, 'content': 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('parent', response.json())
+
+
+
+@override_settings(SECURE_SSL_REDIRECT=False, RESPONSE_CACHE_ENABLED=True, DATABASE_REPLICAS=[])
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('author')
+        self.fan = User.objects.create_user('fan')
+        self.post = Post.objects.create(author=self.author, content='hello')
+        self.client = APIClient()
+
+    def test_feed_is_served_from_cache_until_a_write(self):
+        self.client.get('/api/posts/')
+        with self.assertNumQueries(0):
+            self.client.get('/api/posts/')
+
+        self.client.force_login(self.fan)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/posts/{self.post.id}/like/')
+        row = self.client.get('/api/posts/').json()['results'][0]
+        self.assertEqual((row['like_count'], row['user_has_liked']), (1, True))
+
+        # Another viewer gets the same cached page with their own liked bits.
+        self.client.force_login(self.author)
+        row = self.client.get('/api/posts/').json()['results'][0]
+        self.assertEqual((row['like_count'], row['user_has_liked']), (1, False))
+        self.assertGreaterEqual(response_cache.stats().get('feed_hit', 0), 2)
+
+    def test_comment_tree_invalidates_on_comment(self):
+        url = f'/api/posts/{self.post.id}/comments/'
+        self.assertEqual(self.client.get(url).json()['results'], [])
+
+        self.client.force_login(self.fan)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/comments/', {'post': self.post.id, 'content': 'hi'})
+
+        self.assertEqual(len(self.client.get(url).json()['results']), 1)
+
+    def test_missing_posts_leave_no_lasting_keys(self):
+        self.assertEqual(self.client.get('/api/posts/999/comments/').status_code, 404)
+        keys = ['rc:version:post:999', 'rc:modified:post:999']
+        self.assertEqual(len(cache.get_many(keys)), 2)
+        later = time.time() + response_cache.VERSION_TTL + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            self.assertEqual(cache.get_many(keys), {})
+
+    def test_edits_invalidate(self):
+        comment = Comment.objects.create(post=self.post, author=self.author, content='first')
+        feed, tree = '/api/posts/', f'/api/posts/{self.post.id}/comments/'
+        self.client.get(feed), self.client.get(tree)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/posts/{self.post.id}/', {'content': 'edited'})
+            self.client.patch(f'/api/comments/{comment.id}/', {'content': 'changed'})
+        self.assertEqual(self.client.get(feed).json()['results'][0]['content'], 'edited')
+        self.assertEqual(self.client.get(tree).json()['results'][0]['content'], 'changed')
+
+
+@api_test
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('author')
+        self.fan = User.objects.create_user('fan')
+        self.post = Post.objects.create(author=self.author, content='hello')
+        self.client = APIClient()
+        self.client.force_login(self.fan)
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def write(self, call):
+        with self.captureOnCommitCallbacks(execute=True):
+            call()
+
+    def test_unchanged_responses_are_not_rebuilt(self):
+        for url in ('/api/posts/', f'/api/posts/{self.post.id}/comments/'):
+            first = self.client.get(url)
+            self.assertEqual(first['Cache-Control'], 'private, no-cache')
+            with CaptureQueriesContext(connection) as queries:
+                again = self.revalidate(url, first['ETag'])
+            self.assertEqual((again.status_code, again.content, again['ETag']), (304, b'', first['ETag']))
+            # Only the session and user lookups.
+            self.assertEqual(len(queries), 2, url)
+
+        # Viewers see their own liked bits, so they get their own tags.
+        other = APIClient()
+        other.force_login(self.author)
+        self.assertNotEqual(other.get('/api/posts/')['ETag'], self.client.get('/api/posts/')['ETag'])
+
+    def test_writes_change_the_validators(self):
+        feed, tree = '/api/posts/', f'/api/posts/{self.post.id}/comments/'
+        tags = {url: self.client.get(url)['ETag'] for url in (feed, tree)}
+
+        def changed(*urls):
+            for url in (feed, tree):
+                response = self.revalidate(url, tags[url])
+                self.assertEqual(response.status_code, 200 if url in urls else 304, url)
+                tags[url] = response['ETag']
+
+        self.write(lambda: self.client.put(f'/api/posts/{self.post.id}/like/'))
+        changed(feed)
+        self.write(lambda: self.client.post('/api/comments/', {'post': self.post.id, 'content': 'hi'}))
+        changed(feed, tree)
+        comment = Comment.objects.create(post=self.post, author=self.author, content='mine')
+        self.write(lambda: self.client.put(f'/api/comments/{comment.id}/like/'))
+        changed(tree)
+        self.write(lambda: self.client.post('/api/posts/', {'content': 'new'}))
+        changed(feed)
+        self.write(lambda: self.client.patch(f'/api/posts/{self.post.id}/', {'content': 'edited'}))
+        changed(feed)
+        self.write(lambda: self.client.patch(f'/api/comments/{comment.id}/', {'content': 'edited'}))
+        changed(tree)
+        changed()
+
+    def test_last_modified(self):
+        clock = time.time()
+        with mock.patch('core.cache.time.time', return_value=clock):
+            self.write(lambda: self.client.post('/api/posts/', {'content': 'new'}))
+            # Not sent while writes within the same second could still follow.
+            self.assertFalse(self.client.get('/api/posts/').has_header('Last-Modified'))
+        with mock.patch('core.cache.time.time', return_value=clock + 1):
+            last_modified = self.client.get('/api/posts/')['Last-Modified']
+            self.assertEqual(self.client.get('/api/posts/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+            self.write(lambda: self.client.put(f'/api/posts/{self.post.id}/like/'))
+            self.assertEqual(self.client.get('/api/posts/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+    @override_settings(LIKE_BUFFER_ENABLED=True)
+    def test_no_validators_with_buffered_likes(self):
+        with mock.patch.object(like_buffer, 'start_flusher'):
+            response = self.client.get('/api/posts/')
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Cache-Control'))
+
+
+@api_test
+class LeaderboardSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create_user('author')
+        post = Post.objects.create(author=author, content='hello')
+        for i in range(8):
+            fan = User.objects.create_user(f'fan{i}')
+            Like.objects.create(user=fan, post=post)
+            Like.objects.create(user=author, post=Post.objects.create(author=fan, content=str(i)))
+        karma.rebuild_ledger()
+
+    def test_serves_snapshot_with_limit(self):
+        leaderboard.refresh()
+        client = APIClient()
+        self.assertEqual(len(client.get('/api/leaderboard/').json()), 5)
+        rows = client.get('/api/leaderboard/?limit=7').json()
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[0]['username'], 'author')
+        self.assertEqual(len(client.get('/api/leaderboard/?limit=500').json()), 9)
+
+    @override_settings(LEADERBOARD_REVALIDATE=True, LEADERBOARD_REFRESH_INTERVAL=60)
+    def test_stale_snapshot_is_served_while_revalidating(self):
+        with mock.patch('core.leaderboard.threading.Thread') as thread:
+            leaderboard.refresh()
+            with mock.patch('core.leaderboard.time.time', return_value=time.time() + 120):
+                with self.assertNumQueries(0):
+                    self.assertEqual(len(APIClient().get('/api/leaderboard/').json()), 5)
+                # Already rebuilding: no second refresher.
+                APIClient().get('/api/leaderboard/')
+            self.assertEqual(thread.call_count, 1)
+
+    @override_settings(LEADERBOARD_REVALIDATE=True)
+    def test_missing_snapshot_is_built_inline(self):
+        with mock.patch('core.leaderboard.threading.Thread') as thread:
+            rows = APIClient().get('/api/leaderboard/').json()
+            self.assertEqual(len(rows), 5)
+            self.assertEqual(rows[0]['username'], 'author')
+            self.assertEqual(thread.call_count, 0)
+
+        cache.delete(leaderboard.SNAPSHOT_KEY)
+        self.assertEqual(async_to_sync(leaderboard.atop)(3), rows[:3])
+        self.assertIsNotNone(cache.get(leaderboard.SNAPSHOT_KEY))
+
+
+@api_test
+class LiveEventsTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.fan = User.objects.create_user('fan')
+        self.client = APIClient()
+        self.client.force_login(self.fan)
+
+    def test_writes_publish_deltas_after_commit(self):
+        backplane = mock.Mock()
+        with mock.patch('core.events.get_backplane', return_value=backplane):
+            with self.captureOnCommitCallbacks(execute=True):
+                post_id = self.client.post('/api/posts/', {'content': 'hello'}).json()['id']
+            post = Post.objects.create(author=self.author, content='theirs')
+            with self.captureOnCommitCallbacks(execute=True):
+                comment_id = self.client.post('/api/comments/', {'post': post.id, 'content': 'hi'}).json()['id']
+                self.client.post(f'/api/posts/{post.id}/like/')
+                self.client.post(f'/api/posts/{post.id}/like/')
+
+        published = [call.args[0] for call in backplane.publish.call_args_list]
+        self.assertEqual(published[0]['type'], 'post')
+        self.assertEqual((published[0]['id'], published[0]['author']['username']), (post_id, 'fan'))
+        self.assertEqual(published[1:], [
+            {'type': 'comment', 'id': comment_id, 'post': post.id, 'parent': None},
+            {'type': 'like', 'post': post.id, 'delta': 1},
+            {'type': 'like', 'post': post.id, 'delta': -1},
+        ])
+
+    def test_stream_requires_asgi(self):
+        self.assertEqual(self.client.get('/api/events/').status_code, 501)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class EventStreamTests(SimpleTestCase):
+    async def test_stream_delivers_events_published_from_other_threads(self):
+        response = await AsyncClient().get('/api/events/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = aiter(response.streaming_content)
+        self.assertIn(b': connected', await anext(body))
+
+        event = {'type': 'like', 'post': 1, 'delta': 1}
+        publisher = threading.Thread(target=events.broadcaster.deliver, args=[event])
+        publisher.start()
+        chunk = await asyncio.wait_for(anext(body), timeout=5)
+        publisher.join()
+        self.assertEqual(chunk, events.format_sse(event).encode())
+        await body.aclose()
+
+    async def test_slow_consumer_is_told_to_resync(self):
+        subscription = events.Subscription(asyncio.get_running_loop(), maxsize=2)
+        for delta in (1, 1, -1):
+            subscription.put({'type': 'like', 'post': 1, 'delta': delta})
+        self.assertEqual(subscription.queue.qsize(), 1)
+        self.assertEqual(await subscription.queue.get(), events.RESYNC)
+
+
+@api_test
+class IdempotentLikeTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.fan = User.objects.create_user('fan')
+        self.post = Post.objects.create(author=self.author, content='hello')
+        self.comment = Comment.objects.create(post=self.post, author=self.author, content='hi')
+        self.client = APIClient()
+        self.client.force_login(self.fan)
+
+    def test_put_and_delete_are_idempotent(self):
+        url = f'/api/posts/{self.post.id}/like/'
+        self.assertEqual(self.client.put(url).status_code, 201)
+        self.assertEqual(self.client.put(url).status_code, 200)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        self.assertEqual(karma.user_karma(self.author), (5, 5))
+
+        self.assertEqual(self.client.delete(url).json(), {'status': 'unliked'})
+        self.assertEqual(self.client.delete(url).json(), {'status': 'unliked'})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+        self.assertEqual(karma.user_karma(self.author), (0, 0))
+
+    def test_comment_like_keeps_the_ledger(self):
+        url = f'/api/comments/{self.comment.id}/like/'
+        self.client.put(url)
+        self.client.put(url)
+        self.assertEqual(Like.objects.filter(comment=self.comment).count(), 1)
+        self.assertEqual(self.client.post(url).json(), {'status': 'unliked'})
+        self.assertEqual(self.client.post(url).json(), {'status': 'liked'})
+        self.assertEqual(karma.user_karma(self.author), (1, 1))
+        self.assertEqual(karma.ledger_drift(), ([], []))
+
+
+@api_test
+class ConcurrentLikeTests(TransactionTestCase):
+    """Many threads hammering the same likes must leave consistent counts."""
+
+    def test_counts_survive_contention(self):
+        author = User.objects.create_user('author')
+        fans = [User.objects.create_user(f'fan{i}') for i in range(4)]
+        post = Post.objects.create(author=author, content='hello')
+        url = f'/api/posts/{post.id}/like/'
+        errors = []
+
+        def send(method):
+            # SQLite's shared in-memory test database reports lock conflicts
+            # instead of waiting; PUT and DELETE are safe to retry.
+            while True:
+                try:
+                    return method(url).status_code
+                except OperationalError:
+                    time.sleep(0.005)
+
+        def hammer(client, seed):
+            try:
+                for step in range(12):
+                    status_code = send(client.put if (step + seed) % 3 else client.delete)
+                    if status_code not in (200, 201):
+                        errors.append(status_code)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        # Two threads per fan race on the same (user, post) pair. The retried
+        # lock errors are expected, so keep them out of the request log.
+        threads = []
+        for fan in fans:
+            for seed in (0, 1):
+                client = APIClient()
+                client.force_login(fan)
+                threads.append(threading.Thread(target=hammer, args=(client, seed)))
+        with mock.patch('django.core.handlers.exception.log_response'):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        # Whatever order the threads finished in, the counter and the ledger
+        # match the Like rows exactly.
+        post.refresh_from_db()
+        liked = Like.objects.filter(post=post).count()
+        self.assertLessEqual(liked, len(fans))
+        self.assertEqual(post.like_count, liked)
+        self.assertEqual(karma.user_karma(author)[1], 5 * liked)
+        self.assertEqual(karma.ledger_drift(), ([], []))
+
+
+@api_test
+@override_settings(LIKE_BUFFER_ENABLED=True, LIKE_BUFFER_BACKEND='core.like_buffer.LocalLikeBuffer')
+class LikeBufferTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.fan = User.objects.create_user('fan')
+        self.post = Post.objects.create(author=self.author, content='hello')
+        self.client = APIClient()
+        self.client.force_login(self.fan)
+        # A fresh buffer per test, flushed by hand rather than by a thread.
+        patches = [
+            mock.patch.object(like_buffer, '_buffer', None),
+            mock.patch.object(like_buffer, '_stats', Counter()),
+            mock.patch.object(like_buffer, 'start_flusher'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def feed_row(self):
+        return self.client.get('/api/posts/').json()['results'][0]
+
+    def test_reads_see_buffered_likes_until_flushed(self):
+        url = f'/api/posts/{self.post.id}/like/'
+        self.client.put(url)
+        self.client.delete(url)
+        self.assertEqual(self.client.post(url).json(), {'status': 'liked'})
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(like_buffer.stats()['depth'], 1)
+        row = self.feed_row()
+        self.assertEqual((row['like_count'], row['user_has_liked']), (1, True))
+
+        self.assertEqual(like_buffer.flush(), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        self.assertEqual(self.post.hot_score, 1 + settings.HOT_LIKE_WEIGHT)
+        self.assertEqual(karma.user_karma(self.author), (5, 5))
+        self.assertEqual(karma.ledger_drift(), ([], []))
+        row = self.feed_row()
+        self.assertEqual((row['like_count'], row['user_has_liked']), (1, True))
+        stats = like_buffer.stats()
+        self.assertEqual((stats['depth'], stats['flushes']), (0, 1))
+        self.assertIn('max_flush_ms', stats)
+
+    def test_flush_unlikes_and_skips_deleted_targets(self):
+        likes.set_like(self.fan, 'post', self.post)
+        comment = Comment.objects.create(post=self.post, author=self.author, content='hi')
+        self.client.delete(f'/api/posts/{self.post.id}/like/')
+        self.client.put(f'/api/comments/{comment.id}/like/')
+        self.assertEqual(self.feed_row()['like_count'], 0)
+        tree = self.client.get(f'/api/posts/{self.post.id}/comments/').json()['results']
+        self.assertEqual((tree[0]['like_count'], tree[0]['user_has_liked']), (1, True))
+        comment.delete()
+
+        like_buffer.flush()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(karma.ledger_drift(), ([], []))
+
+    def test_failed_flush_is_retried(self):
+        self.client.put(f'/api/posts/{self.post.id}/like/')
+        with mock.patch.object(like_buffer, '_apply_batch', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                like_buffer.flush()
+        self.assertEqual(like_buffer.stats()['depth'], 1)
+        self.assertEqual(self.feed_row()['like_count'], 1)
+
+        like_buffer.flush()
+        self.assertEqual(Like.objects.filter(post=self.post).count(), 1)
+        self.assertEqual(self.feed_row()['like_count'], 1)
+
+
+@api_test
+class GuestIdentityTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.post = Post.objects.create(author=self.author, content='hello')
+        cache.clear()
+        patch = mock.patch.object(identity, '_guest_pk', None)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def user_queries(self, send):
+        with CaptureQueriesContext(connection) as queries:
+            send()
+        return [q['sql'] for q in queries.captured_queries if 'FROM "auth_user"' in q['sql'] or 'INTO "auth_user"' in q['sql']]
+
+    def test_shared_guest_is_resolved_once(self):
+        client = APIClient()
+        self.assertTrue(self.user_queries(lambda: client.post('/api/posts/', {'content': 'one'})))
+        self.assertEqual(self.user_queries(lambda: client.post('/api/posts/', {'content': 'two'})), [])
+        self.assertEqual(self.user_queries(lambda: client.put(f'/api/posts/{self.post.id}/like/')), [])
+        self.assertEqual(User.objects.filter(username='guest').count(), 1)
+        self.assertEqual(self.client.get('/api/posts/').json()['results'][0]['author']['username'], 'guest')
+
+    @override_settings(GUEST_IDENTITY='session')
+    def test_session_guests_like_separately(self):
+        first, second = APIClient(), APIClient()
+        for client in (first, second, first):
+            client.put(f'/api/posts/{self.post.id}/like/')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 2)
+        self.assertEqual(len({like.user_id for like in Like.objects.all()}), 2)
+
+        comment_id = first.post('/api/comments/', {'post': self.post.id, 'content': 'hi'}).json()['id']
+        self.assertEqual(Comment.objects.get(id=comment_id).author_id, Like.objects.earliest('id').user_id)
+
+    @override_settings(GUEST_IDENTITY='session', GUEST_CREATION_RATE='2/hour')
+    def test_session_guests_need_csrf_and_are_rate_limited(self):
+        url = f'/api/posts/{self.post.id}/like/'
+        self.assertEqual(APIClient(enforce_csrf_checks=True).put(url).status_code, 403)
+
+        def browser():
+            # Like the SPA: read /api/me/ for the CSRF cookie, then write with the token.
+            client = APIClient(enforce_csrf_checks=True)
+            client.get('/api/me/')
+            return client, {'HTTP_X_CSRFTOKEN': client.cookies['csrftoken'].value}
+
+        first, token = browser()
+        self.assertEqual(first.put(url, **token).status_code, 201)
+        second, second_token = browser()
+        self.assertEqual(second.put(url, **second_token).status_code, 201)
+        third, third_token = browser()
+        self.assertEqual(third.put(url, **third_token).status_code, 429)
+        # A session that already has its guest is not limited.
+        self.assertEqual(first.delete(url, **token).status_code, 200)
+        self.assertEqual(User.objects.filter(username__startswith='guest-').count(), 2)
+
+
+@api_test
+class QueryPlanTests(TestCase):
+    """EXPLAIN every query of the hot read paths against a seeded dataset: none may scan a whole table."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f'user{i}') for i in range(5)]
+        posts = Post.objects.bulk_create([
+            Post(author=cls.users[i % 5], content=f'post {i}') for i in range(60)
+        ])
+        cls.post = posts[0]
+        roots = [Comment.objects.create(post=cls.post, author=cls.users[i % 5], content='root') for i in range(6)]
+        for root in roots:
+            for i in range(4):
+                Comment.objects.create(post=cls.post, parent=root, author=cls.users[i], content='reply')
+        cls.root = roots[0]
+        for user in cls.users[1:]:
+            likes.set_like(user, 'post', cls.post)
+            likes.set_like(user, 'comment', cls.root)
+
+    def plans(self, run):
+        with CaptureQueriesContext(connection) as queries:
+            run()
+        selects = [q['sql'] for q in queries.captured_queries if q['sql'].lstrip().upper().startswith('SELECT')]
+        self.assertTrue(selects)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Tiny tables make a seq scan cheapest; ask whether an index path exists at all.
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                explain = 'EXPLAIN '
+            else:
+                explain = 'EXPLAIN QUERY PLAN '
+            for sql in selects:
+                cursor.execute(explain + sql)
+                yield sql, '\n'.join(str(row[-1]) for row in cursor.fetchall())
+
+    def assertNoTableScans(self, run):
+        # SQLite reports a full table scan as a bare "SCAN <table>"; scans of
+        # subquery results and index walks ("SCAN t USING INDEX") are fine.
+        tables = set(connection.introspection.table_names())
+        for sql, plan in self.plans(run):
+            with self.subTest(sql=sql):
+                self.assertNotIn('Seq Scan', plan)
+                scanned = {line.split()[1] for line in plan.splitlines() if line.startswith('SCAN ') and len(line.split()) == 2}
+                self.assertFalse(scanned & tables, plan)
+
+    def test_feed(self):
+        client = APIClient()
+        client.force_login(self.users[1])
+        next_url = client.get('/api/posts/').json()['next']
+        self.assertNoTableScans(lambda: client.get(next_url))
+
+    def test_hot_feed(self):
+        hot.refresh()
+        client = APIClient()
+        client.force_login(self.users[1])
+        next_url = client.get('/api/posts/?sort=hot').json()['next']
+        self.assertNoTableScans(lambda: client.get(next_url))
+        self.assertNoTableScans(hot.refresh)
+
+    def test_comment_tree_and_replies(self):
+        client = APIClient()
+        client.force_login(self.users[1])
+        self.assertNoTableScans(lambda: client.get(f'/api/posts/{self.post.id}/comments/?page_size=2&replies=2'))
+        self.assertNoTableScans(lambda: client.get(f'/api/comments/{self.root.id}/replies/?page_size=2'))
+
+    def test_karma_and_leaderboard(self):
+        self.assertNoTableScans(lambda: karma.user_karma(self.users[0]))
+        self.assertNoTableScans(lambda: karma.leaderboard(limit=5))
+
+    def test_search(self):
+        client = APIClient()
+        client.force_login(self.users[1])
+        next_url = client.get('/api/search/?q=post&page_size=5').json()['next']
+        self.assertNoTableScans(lambda: client.get(next_url))
+
+    def test_like(self):
+        client = APIClient()
+        client.force_login(self.users[1])
+        self.assertNoTableScans(lambda: client.put(f'/api/comments/{self.root.id}/like/'))
+
+
+@api_test
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        metrics.registry.clear()
+        self.client = APIClient()
+        self.client.force_login(User.objects.create_user('reader'))
+
+    def test_server_timing_and_prometheus_endpoint(self):
+        timing = self.client.get('/api/posts/')['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, total;dur=[\d.]+$')
+        self.client.get('/api/posts/')
+
+        body = self.client.get('/api/metrics').content.decode()
+        self.assertIn('http_requests_total{endpoint="PostViewSet.list"} 2', body)
+        self.assertIn('http_request_duration_seconds_bucket{endpoint="PostViewSet.list",le="+Inf"} 2', body)
+        self.assertIn('db_queries_total{endpoint="PostViewSet.list"}', body)
+
+    @override_settings(METRICS_TOKEN='s3cret', METRICS_ALLOWED_IPS=['10.0.0.5'])
+    def test_prometheus_endpoint_needs_access(self):
+        self.assertEqual(self.client.get('/api/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/api/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get('/api/metrics', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+        self.assertEqual(self.client.get('/api/metrics', REMOTE_ADDR='10.0.0.5').status_code, 200)
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        self.assertEqual(self.client.get('/api/metrics').status_code, 200)
+
+    @override_settings(QUERY_BUDGETS={'PostViewSet.list': 1})
+    def test_query_budgets(self):
+        with self.assertRaises(metrics.QueryBudgetExceeded):
+            self.client.get('/api/posts/')
+        with self.settings(QUERY_BUDGET_STRICT=False), self.assertLogs('core.metrics', 'WARNING'):
+            self.assertEqual(self.client.get('/api/posts/').status_code, 200)
+
+
+class DataGeneratorTests(TestCase):
+    def test_generated_data_is_consistent(self):
+        out = StringIO()
+        call_command('generate_data', users=20, posts=30, post_likes=200, comment_likes=100, depth=3, stdout=out)
+        self.assertIn('Generated 20 users, 30 posts', out.getvalue())
+
+        self.assertEqual(karma.ledger_drift(), ([], []))
+        for post in Post.objects.all():
+            self.assertEqual(post.like_count, Like.objects.filter(post=post).count())
+            self.assertEqual(post.comment_count, Comment.objects.filter(post=post).count())
+        for comment in Comment.objects.select_related('parent', 'post'):
+            parent = comment.parent or comment.post
+            self.assertGreaterEqual(comment.timestamp, parent.timestamp)
+            self.assertEqual(comment.path, (comment.parent.path if comment.parent else '') + Comment.path_segment(comment.pk))
+        self.assertLess(Comment.objects.order_by('-depth').values_list('depth', flat=True).first(), 3)
+
+        # Zipf: the most liked post gets a large share of all post likes.
+        counts = sorted(Post.objects.values_list('like_count', flat=True), reverse=True)
+        self.assertGreater(counts[0], 3 * counts[len(counts) // 2])
+
+        # The id sequences moved past the generated rows.
+        author = User.objects.get(username='load0')
+        post = Post.objects.create(author=author, content='new')
+        Comment.objects.create(post=post, author=author, content='new')
+        with self.assertRaises(CommandError):
+            call_command('generate_data', users=1, posts=1, stdout=StringIO())
+
+
+
+@api_test
+@override_settings(HOT_LIKE_WEIGHT=1, HOT_COMMENT_WEIGHT=2, HOT_HALF_LIFE_HOURS=10, HOT_MAX_AGE_HOURS=48)
+class HotFeedTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.fans = [User.objects.create_user(f'fan{i}') for i in range(3)]
+        now = timezone.now()
+        self.posts = [Post.objects.create(author=self.author, content=str(i)) for i in range(6)]
+        for i, post in enumerate(self.posts):
+            Post.objects.filter(pk=post.pk).update(timestamp=now - timedelta(hours=10 * i))
+        hot.refresh(now)
+        self.client = APIClient()
+
+    def scores(self):
+        return dict(Post.objects.values_list('pk', 'hot_score'))
+
+    def test_scores_follow_writes_and_decay(self):
+        fresh, older, expired = self.posts[0], self.posts[1], self.posts[5]
+        self.assertAlmostEqual(self.scores()[older.pk], 0.5)
+        self.assertEqual(self.scores()[expired.pk], 0)
+
+        client = APIClient()
+        client.force_login(self.fans[0])
+        client.put(f'/api/posts/{older.pk}/like/')
+        client.post('/api/comments/', {'post': older.pk, 'content': 'hi'})
+        client.put(f'/api/posts/{expired.pk}/like/')
+        scores = self.scores()
+        # (1 + 1 like + 2 for the comment) at half strength; expired posts stay at 0.
+        self.assertAlmostEqual(scores[older.pk], 2)
+        self.assertEqual(scores[expired.pk], 0)
+        client.delete(f'/api/posts/{older.pk}/like/')
+        self.assertAlmostEqual(self.scores()[older.pk], 1.5)
+
+        # Ten hours on, everything has halved; a post past the maximum age drops out.
+        later = timezone.now() + timedelta(hours=10)
+        hot.refresh(later)
+        scores = self.scores()
+        self.assertAlmostEqual(scores[fresh.pk], 0.5, places=3)
+        self.assertAlmostEqual(scores[older.pk], 0.75, places=3)
+        self.assertEqual(scores[self.posts[4].pk], 0)
+
+    def test_hot_feed_pages_by_score(self):
+        # Scores: 1.5, ~1, 0.25, 0.5 (1 + 3 likes at 1/8 strength), 0.0625, 0.
+        for fan in self.fans:
+            likes.set_like(fan, 'post', self.posts[3])
+        for fan in self.fans[:2]:
+            likes.set_like(fan, 'post', self.posts[1])
+
+        url, seen = '/api/posts/?sort=hot&page_size=2', []
+        while url:
+            page = self.client.get(url).json()
+            seen += [row['id'] for row in page['results']]
+            url = page['next']
+        expected = Post.objects.order_by('-hot_score', '-id').values_list('id', flat=True)
+        self.assertEqual(seen, list(expected))
+        self.assertEqual(seen[:4], [self.posts[1].pk, self.posts[0].pk, self.posts[3].pk, self.posts[2].pk])
+
+        self.assertEqual(self.client.get('/api/posts/?sort=top').status_code, 400)
+        out = StringIO()
+        call_command('refresh_hot_scores', stdout=out)
+        self.assertIn('5 post(s) rescored', out.getvalue())
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache', USER_CACHE_TTL=30, KARMA_SUMMARY_TTL=30)
+@api_test
+class AuthCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        auth_cache.clear()
+        self.user = User.objects.create_user('reader')
+        self.fan = User.objects.create_user('fan')
+        self.post = Post.objects.create(author=self.user, content='hello')
+        self.client = APIClient()
+        self.client.force_login(self.user)
+
+    def auth_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return [q['sql'] for q in queries.captured_queries if 'django_session' in q['sql'] or 'FROM "auth_user"' in q['sql']]
+
+    def test_authenticated_feed_needs_no_auth_queries(self):
+        self.assertEqual(len(self.auth_queries('/api/posts/')), 1)
+        self.assertEqual(self.auth_queries('/api/posts/'), [])
+
+        # Saving the user drops the cached row; logging out ends the session at once.
+        self.user.first_name = 'Reader'
+        self.user.save()
+        self.assertEqual(len(self.auth_queries('/api/me/')), 1)
+        self.client.post('/api/logout/')
+        self.assertEqual(self.client.get('/api/me/').json()['username'], 'Guest')
+
+    async def test_async_views_share_the_cache(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        queries = []
+        with self.settings(ROOT_URLCONF=AsyncURLConf):
+            for _ in range(2):
+                response = await client.get('/api/posts/')
+                queries.append(int(re.search(r'(\d+) queries', response['Server-Timing']).group(1)))
+        self.assertEqual(queries[0] - queries[1], 1)
+
+    def test_password_change_ends_other_sessions(self):
+        self.client.get('/api/me/')
+        self.user.set_password('new')
+        self.user.save()
+        self.assertEqual(self.client.get('/api/me/').json()['username'], 'Guest')
+
+    def test_me_serves_cached_karma(self):
+        self.assertEqual(self.client.get('/api/me/').json()['totalKarma'], 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/me/').json()['totalKarma'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            likes.set_like(self.fan, 'post', self.post)
+        me = self.client.get('/api/me/').json()
+        self.assertEqual((me['recentKarma'], me['totalKarma']), (5, 5))
+
+
+@api_test
+class RenderingTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.viewer = User.objects.create_user('viewer')
+        self.post = Post.objects.create(author=self.author, content='hello')
+        root = Comment.objects.create(post=self.post, author=self.author, content='root')
+        Comment.objects.create(post=self.post, parent=root, author=self.author, content='reply')
+        self.client = APIClient()
+        self.client.force_login(self.viewer)
+
+    def test_fast_renderer_matches_drf(self):
+        data = {
+            'when': timezone.now(), 'price': Decimal('1.50'), 'label': gettext_lazy('Invalid cursor'),
+            'text': 'caf\u00e9 \u2028 line', 1: [None, True, 2.5], 'page': self.client.get('/api/posts/').data,
+        }
+        expected = JSONRenderer().render(data)
+        self.assertEqual(renderers.FastJSONRenderer().render(data), expected)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(renderers.FastJSONRenderer().render(data), expected)
+        indented = renderers.FastJSONRenderer().render(data, 'application/json; indent=2')
+        self.assertEqual(indented, JSONRenderer().render(data, 'application/json; indent=2'))
+
+        parser = renderers.FastJSONParser()
+        self.assertEqual(parser.parse(BytesIO('{"content": "caf\u00e9"}'.encode())), {'content': 'caf\u00e9'})
+        with self.assertRaises(ParseError):
+            parser.parse(BytesIO(b'{nope'))
+        self.assertEqual(self.client.post('/api/posts/', '{"content": "json"}', content_type='application/json').status_code, 201)
+
+    def test_sparse_feed(self):
+        with CaptureQueriesContext(connection) as full:
+            self.client.get('/api/posts/')
+        with CaptureQueriesContext(connection) as sparse:
+            rows = self.client.get('/api/posts/?fields=content,like_count').json()['results']
+        self.assertEqual(rows, [{'id': self.post.id, 'content': 'hello', 'like_count': 0}])
+        # No liked-state query and no author join.
+        self.assertEqual(len(sparse), len(full) - 1)
+        self.assertNotIn('auth_user', sparse.captured_queries[-1]['sql'])
+
+        response = self.client.get('/api/posts/?fields=content,karma')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('karma', response.json()['detail'])
+        # Writes validate and return every field.
+        created = self.client.post('/api/posts/?fields=id', {'content': 'new'}).json()
+        self.assertEqual(created['content'], 'new')
+
+    def test_sparse_comment_tree(self):
+        url = f'/api/posts/{self.post.id}/comments/'
+        with CaptureQueriesContext(connection) as queries:
+            roots = self.client.get(url, {'fields': 'content,replies'}).json()['results']
+        self.assertEqual(roots[0]['content'], 'root')
+        self.assertEqual(roots[0]['replies'], [{'id': roots[0]['replies'][0]['id'], 'content': 'reply', 'replies': []}])
+        # Neither the like counts nor the viewer's likes are read.
+        self.assertFalse([q for q in queries.captured_queries if 'core_like' in q['sql']])
+
+        flat = self.client.get(url, {'fields': 'author,more_replies', 'depth': 1}).json()['results'][0]
+        self.assertEqual(list(flat), ['id', 'author', 'more_replies'])
+        self.assertIn('/replies/', flat['more_replies'])
+
+
+@api_test
+class SearchTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author')
+        self.client = APIClient()
+
+    def search(self, query, **params):
+        return self.client.get('/api/search/', {'q': query, **params})
+
+    def test_ranks_posts_and_comments(self):
+        weak = Post.objects.create(author=self.author, content='Gardening tips, plus one note on running shoes')
+        strong = Post.objects.create(author=self.author, content='Running, running and more running')
+        comment = Comment.objects.create(post=weak, author=self.author, content='I run every morning')
+        Post.objects.create(author=self.author, content='Nothing to see here')
+
+        results = self.search('runs').json()['results']
+        self.assertEqual([(r['type'], r['id']) for r in results][0], ('post', strong.id))
+        self.assertCountEqual(
+            [(r['type'], r['id'], r['post']) for r in results],
+            [('post', strong.id, strong.id), ('post', weak.id, weak.id), ('comment', comment.id, weak.id)],
+        )
+        self.assertEqual(results[0]['author'], {'id': self.author.id, 'username': 'author'})
+        # Every word must match.
+        self.assertEqual([r['id'] for r in self.search('running gardening').json()['results']], [weak.id])
+
+    def test_index_follows_writes(self):
+        post = Post.objects.create(author=self.author, content='draft about kittens')
+        comment = Comment.objects.create(post=post, author=self.author, content='kittens are great')
+        self.assertEqual(len(self.search('kittens').json()['results']), 2)
+
+        Post.objects.filter(pk=post.pk).update(content='final about puppies')
+        self.assertEqual([r['type'] for r in self.search('kittens').json()['results']], ['comment'])
+        self.assertEqual([r['id'] for r in self.search('puppies').json()['results']], [post.id])
+
+        self.client.delete(f'/api/posts/{post.id}/')
+        self.assertEqual(self.search('kittens').json()['results'], [])
+        self.assertFalse(Comment.objects.filter(pk=comment.pk).exists())
+
+    def test_pages_through_ranked_results(self):
+        for i in range(7):
+            post = Post.objects.create(author=self.author, content='needle ' * (i % 3 + 1) + 'hay ' * i)
+            Comment.objects.create(post=post, author=self.author, content='needle in a comment')
+        first = self.search('needle').json()
+
+        url, seen = '/api/search/?q=needle&page_size=3', []
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page['results']), 3)
+            seen += [(r['type'], r['id']) for r in page['results']]
+            url = page['next']
+        self.assertEqual(seen, [(r['type'], r['id']) for r in first['results']])
+        self.assertEqual(len(set(seen)), 14)
+
+    def test_rejects_bad_input(self):
+        Post.objects.create(author=self.author, content='quotes and stars')
+        self.assertEqual(self.search('').status_code, 400)
+        self.assertEqual(self.search('"* -:').status_code, 400)
+        self.assertEqual(len(self.search('"quotes" AND stars*').json()['results']), 1)
+        self.assertEqual(self.search('quotes', cursor='nope').status_code, 404)
+
+
+@override_settings(DATABASE_REPLICAS=['replica0'], REPLICA_ENDPOINTS=['PostViewSet.list'])
+class ReplicaRoutingTests(SimpleTestCase):
+    def read_database(self, method='get', view=PostViewSet.as_view({'get': 'list', 'post': 'create'}), cookies=None):
+        """Where a read inside the request would go, and the response."""
+        seen = []
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            seen.append(replicas.ReplicaRouter().db_for_read(Post))
+            return HttpResponse()
+
+        middleware = replicas.ReplicaMiddleware(get_response)
+        request = getattr(APIRequestFactory(), method)('/api/posts/')
+        request.COOKIES.update(cookies or {})
+        response = middleware(request)
+        self.assertIsNone(replicas.ReplicaRouter().db_for_read(Post))
+        return seen[0], response
+
+    def test_read_only_endpoints_read_from_a_replica(self):
+        self.assertEqual(self.read_database()[0], 'replica0')
+        self.assertIsNone(self.read_database(view=PostViewSet.as_view({'get': 'retrieve'}))[0])
+        self.assertEqual(replicas.ReplicaRouter().db_for_write(Post), 'default')
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        database, response = self.read_database('post')
+        self.assertIsNone(database)
+        sticky = response.cookies[replicas.STICKY_COOKIE]
+        self.assertEqual(sticky['max-age'], settings.REPLICA_STICKY_SECONDS)
+        self.assertIsNone(self.read_database(cookies={replicas.STICKY_COOKIE: '1'})[0])
+
+    async def test_async_requests(self):
+        view, seen = PostViewSet.as_view({'get': 'list'}), []
+
+        async def get_response(request):
+            await middleware.process_view(request, view, (), {})
+            # The async ORM asks the router from a worker thread.
+            seen.append(await sync_to_async(replicas.ReplicaRouter().db_for_read)(Post))
+            return HttpResponse()
+
+        middleware = replicas.ReplicaMiddleware(get_response)
+        await middleware(APIRequestFactory().get('/api/posts/'))
+        self.assertEqual(seen, ['replica0'])
+        self.assertIsNone(replicas.ReplicaRouter().db_for_read(Post))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        database, response = self.read_database('post')
+        self.assertIsNone(database)
+        self.assertNotIn(replicas.STICKY_COOKIE, response.cookies)
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True, DATABASE_REPLICAS=['replica0'], REPLICA_STICKY_SECONDS=5)
+class ReplicaCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.request = APIRequestFactory().get('/api/posts/')
+        with self.captureOnCommitCallbacks(execute=True):
+            response_cache.bump('feed')
+
+    def on_replica(self):
+        # As if the request was routed to a replica that lags the write just made.
+        return mock.patch.object(replicas, '_replica', replicas.ContextVar('replica', default='replica0'))
+
+    def cached(self, value):
+        return response_cache.cached('feed', ['feed'], self.request, lambda: value)
+
+    def test_lagging_replica_pages_are_not_cached(self):
+        with self.on_replica():
+            self.assertEqual(self.cached('stale'), 'stale')
+        # So the writer, pinned to the primary, reads its own write.
+        self.assertEqual(self.cached('fresh'), 'fresh')
+        self.assertEqual(self.cached('rebuilt'), 'fresh')
+
+    async def test_replica_pages_are_cached_once_caught_up(self):
+        async def cached(value):
+            return await response_cache.acached('feed', ['feed'], self.request, sync_to_async(lambda: value))
+
+        with self.on_replica():
+            self.assertEqual(await cached('stale'), 'stale')
+            self.assertEqual(await cached('again'), 'again')
+            with mock.patch('core.cache.time.time', return_value=time.time() + 5):
+                self.assertEqual(await cached('caught up'), 'caught up')
+        self.assertEqual(await cached('primary'), 'caught up')
+
+
+# The project URLs with the async views mounted, as under ASGI.
+class AsyncURLConf:
+    urlpatterns = [path('api/', include(core_urls.async_urlpatterns + core_urls.urlpatterns))]
+
+
+@api_test
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer')
+        author = User.objects.create_user('author')
+        posts = [Post.objects.create(author=author, content=f'post {i}') for i in range(25)]
+        cls.post = posts[0]
+        cls.root = Comment.objects.create(post=cls.post, author=author, content='root')
+        for i in range(3):
+            reply = Comment.objects.create(post=cls.post, parent=cls.root, author=author, content=f'reply {i}')
+            Comment.objects.create(post=cls.post, parent=reply, author=author, content='leaf')
+        likes.set_like(cls.viewer, 'post', posts[1])
+        likes.set_like(cls.viewer, 'comment', cls.root)
+        leaderboard.refresh()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_login(self.viewer)
+
+    async def test_reads_match_the_viewsets(self):
+        second_page = (await sync_to_async(self.client.get)('/api/posts/?page_size=5')).json()['next']
+        urls = [
+            '/api/posts/',
+            second_page,
+            f'/api/posts/{self.post.pk}/comments/?depth=2&replies=2',
+            f'/api/comments/{self.root.pk}/replies/?depth=1',
+            '/api/leaderboard/?limit=3',
+            '/api/posts/999/comments/',
+            '/api/posts/x/comments/',
+            '/api/comments/999/replies/',
+            '/api/posts/?cursor=bogus',
+            '/api/posts/?sort=hot&page_size=5',
+            '/api/posts/?sort=top',
+        ]
+        client = AsyncClient()
+        await client.aforce_login(self.viewer)
+        for url in urls:
+            expected = await sync_to_async(self.client.get)(url)
+            with self.settings(ROOT_URLCONF=AsyncURLConf):
+                actual = await client.get(url)
+            self.assertEqual((actual.status_code, actual.json()), (expected.status_code, expected.json()), url)
+            self.assertEqual(actual.get('ETag'), expected.get('ETag'), url)
+            if actual.status_code != 200:
+                continue
+            # Counted on the worker thread the async ORM ran them on. The
+            # leaderboard skips DRF's eager session lookup, so it can run fewer.
+            queries = [int(re.search(r'(\d+) queries', r['Server-Timing']).group(1)) for r in (actual, expected)]
+            self.assertLessEqual(queries[0], queries[1], url)
+            if 'leaderboard' not in url:
+                self.assertGreater(queries[0], 0, url)
+
+    async def test_other_methods_go_to_the_viewsets(self):
+        client = AsyncClient()
+        await client.aforce_login(self.viewer)
+        with self.settings(ROOT_URLCONF=AsyncURLConf):
+            response = await client.post('/api/posts/', {'content': 'async'}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(await Post.objects.filter(content='async', author=self.viewer).aexists())
+        self.assertEqual(metrics.endpoint_name(core_urls.async_views.feed, 'POST'), 'PostViewSet.create')
@@ -1,6 +1,9 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import PostViewSet, CommentViewSet, LeaderboardViewSet, login_view, logout_view, me_view
+from . import async_views
+from .metrics import metrics_view
+from .views import PostViewSet, CommentViewSet, LeaderboardViewSet, events_view, login_view, logout_view, me_view, search_view
 
 router = DefaultRouter()
 router.register(r'posts', PostViewSet)
@@ -12,4 +15,19 @@ urlpatterns = [
     path('login/', login_view, name='login'),
     path('logout/', logout_view, name='logout'),
     path('me/', me_view, name='me'),
+    path('search/', search_view, name='search'),
+    path('events/', events_view, name='events'),
+    path('metrics', metrics_view, name='metrics'),
 ]
+
+# Under ASGI the hot reads are served by async-native views at the same URLs
+# (core/async_views.py); they pass every other method on to the viewsets.
+async_urlpatterns = [
+    path('posts/', async_views.feed),
+    path('posts/<str:pk>/comments/', async_views.comments),
+    path('comments/<str:pk>/replies/', async_views.replies),
+    path('leaderboard/', async_views.leaderboard_list),
+]
+
+if settings.ASYNC_VIEWS:
+    urlpatterns = async_urlpatterns + urlpatterns
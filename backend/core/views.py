@@ -1,176 +1,344 @@
-from django.shortcuts import render
+import logging
+
 from django.contrib.auth import authenticate, login, logout
 from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
+from django.views.decorators.http import require_GET
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.middleware.csrf import get_token
+from django.db import transaction
 from rest_framework import viewsets, permissions, status, response
 from rest_framework.decorators import action, api_view, permission_classes
-from django.db.models import Count, Sum, Case, When, IntegerField, Q, Prefetch
-from django.utils import timezone
-from datetime import timedelta
-from django.contrib.auth.models import User
-from .models import Post, Comment, Like
-from .serializers import PostSerializer, CommentSerializer, UserSerializer, LikeSerializer
+from django.db.models import Count, Q, Value, F
+from django.contrib.auth.models import AnonymousUser
+from django.shortcuts import get_object_or_404
+from django.conf import settings
+from rest_framework.exceptions import NotFound, ParseError
+from .models import Post, Comment, Like, ArchivedLike
+from . import karma
+from .pagination import FeedPagination, CommentPagination, SearchPagination, feed_pagination
+from . import comment_tree
+from . import cache as response_cache
+from . import leaderboard
+from . import events
+from . import identity
+from . import likes
+from . import like_archive
+from . import like_buffer
+from . import search
+from . import hot
+from .serializers import PostSerializer, CommentSerializer, SearchHitSerializer, sparse_fields
+
+logger = logging.getLogger(__name__)
+
+def annotate_user_has_liked(queryset, user, target):
+    """
+    Annotate ``user_has_liked`` on every row with one EXISTS subquery, so the
+    serializers never query Like per object. ``target`` is 'post' or 'comment'.
+    """
+    if not user.is_authenticated:
+        return queryset.annotate(user_has_liked=Value(False))
+    return queryset.annotate(user_has_liked=like_archive.has_liked_expression(user, target))
+
+def comment_queryset(user, like_count=True):
+    comments = Comment.objects.all()
+    if like_count:
+        comments = comments.annotate(like_count=Count('likes') + F('archived_like_count'))
+    return annotate_user_has_liked(comments, user, 'comment').select_related('author')
+
+def thread_queryset(post_id, request):
+    """
+    A post's comments (every post's for ``post_id=None``) as comment_tree
+    rows, reading only what ``?fields=`` asks for.
+    """
+    fields = comment_tree.tree_fields(request)
+    comments = comment_queryset(AnonymousUser(), like_count=fields is None or 'like_count' in fields)
+    if post_id is not None:
+        comments = comments.filter(post_id=post_id)
+    return comment_tree.thread_queryset(comments, fields)
+
+def cached_page(request, namespace, scopes, build, target):
+    """
+    ``build()``'s page through the response cache, with the viewer's
+    ``user_has_liked`` bits overlaid and ETag/Last-Modified set from the
+    cache versions. A client whose copy is still current gets a 304 before
+    anything is read or built.
+    """
+    validators = response_cache.validators(namespace, scopes, request, request.user)
+    not_modified = response_cache.not_modified(request, validators)
+    if not_modified is not None:
+        return not_modified
+    page = response_cache.cached(namespace, scopes, request, build)
+    response_cache.overlay_user_has_liked(page['results'], request.user, target)
+    like_buffer.overlay(page['results'], request.user, target)
+    return response_cache.add_validators(response.Response(page), validators)
+
+def change_like(request, obj, target):
+    """
+    Like or unlike ``obj`` for the requesting user (or guest identity).
+
+    PUT and DELETE set and clear the like and may be repeated safely; POST
+    keeps the original toggle for older clients. Caches and live events only
+    hear about requests that actually changed something.
+    """
+    user = identity.acting_user(request)
+    buffered = like_buffer.enabled()
+    if buffered:
+        # Written (and the caches invalidated) by the flusher.
+        wanted = {'PUT': True, 'DELETE': False}.get(request.method)
+        liked, changed = like_buffer.change(user, target, obj, wanted)
+    elif request.method == 'PUT':
+        liked, changed = True, likes.set_like(user, target, obj)
+    elif request.method == 'DELETE':
+        liked, changed = False, likes.unset_like(user, target, obj)
+    elif likes.unset_like(user, target, obj):
+        liked, changed = False, True
+    else:
+        liked, changed = True, likes.set_like(user, target, obj)
+
+    if changed:
+        if target == 'post':
+            if not buffered:
+                response_cache.bump('feed')
+            events.like_changed(1 if liked else -1, obj.pk)
+        else:
+            if not buffered:
+                response_cache.bump(response_cache.post_scope(obj.post_id))
+            events.like_changed(1 if liked else -1, obj.post_id, obj.pk)
+    logger.debug(
+        "like target=%s id=%s user=%s liked=%s changed=%s buffered=%s",
+        target, obj.pk, user.username, liked, changed, buffered,
+    )
+    if liked:
+        return response.Response({'status': 'liked'}, status=status.HTTP_201_CREATED if changed else status.HTTP_200_OK)
+    return response.Response({'status': 'unliked'}, status=status.HTTP_200_OK)
 
 class PostViewSet(viewsets.ModelViewSet):
-    queryset = Post.objects.annotate(
-        like_count=Count('likes', distinct=True),
-        comment_count=Count('comments', distinct=True)
-    ).order_by('-timestamp')
+    # like_count/comment_count are stored columns, so the feed never joins Like or Comment.
+    queryset = Post.objects.select_related('author').order_by('-timestamp', '-id')
     serializer_class = PostSerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = FeedPagination
+
+    def get_queryset(self):
+        return annotate_user_has_liked(super().get_queryset(), self.request.user, 'post')
+
+    def list(self, request, *args, **kwargs):
+        # Pages are cached without the viewer's liked bits, which are overlaid per request.
+        # ?sort=hot pages by the stored hot score instead of time (see core/hot.py).
+        paginator = feed_pagination(request.query_params)()
+        return cached_page(request, 'feed', ['feed'], lambda: self._feed_page(paginator), 'post')
+
+    @classmethod
+    def feed_queryset(cls, request):
+        """The feed as anyone sees it (liked bits are overlaid per viewer), joining only what ``?fields=`` needs."""
+        queryset = annotate_user_has_liked(cls.queryset.all(), AnonymousUser(), 'post')
+        fields = sparse_fields(request.query_params, PostSerializer.Meta.fields)
+        if fields is not None and 'author' not in fields:
+            queryset = queryset.select_related(None)
+        return queryset
+
+    def _feed_page(self, paginator):
+        queryset = self.feed_queryset(self.request)
+        page = paginator.paginate_queryset(queryset, self.request, view=self)
+        return paginator.get_paginated_response(self.get_serializer(page, many=True).data).data
 
     def perform_create(self, serializer):
-        # Use the current user if authenticated, otherwise create anonymous posts with a default user
-        if self.request.user.is_authenticated:
-            serializer.save(author=self.request.user)
-        else:
-            # Get or create a default "Guest" user for unauthenticated posts
-            default_user, _ = User.objects.get_or_create(username='guest', defaults={'is_active': True})
-            serializer.save(author=default_user)
+        # Anonymous posts belong to a guest identity (see core/identity.py).
+        serializer.save(author=identity.acting_user(self.request))
+        response_cache.bump('feed')
+        events.post_created(serializer.instance)
 
-    @action(detail=True, methods=['post'])
+    def perform_update(self, serializer):
+        # The bump waits for the commit, like every other write's.
+        with transaction.atomic():
+            serializer.save()
+            response_cache.bump('feed')
+
+    @action(detail=True, methods=['post', 'put', 'delete'])
     def like(self, request, pk=None):
+        """PUT likes and DELETE unlikes, both idempotent; POST toggles."""
         post = self.get_object()
         if request.user.is_authenticated and post.author_id == request.user.id:
             return response.Response(
                 {'detail': 'You cannot like your own post.'},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        # Use authenticated user or create guest user for likes
-        if request.user.is_authenticated:
-            user = request.user
-        else:
-            user, _ = User.objects.get_or_create(username='guest', defaults={'is_active': True})
-        
-        like, created = Like.objects.get_or_create(user=user, post=post)
-        if not created:
-            like.delete()
-            return response.Response({'status': 'unliked'}, status=status.HTTP_200_OK)
-        return response.Response({'status': 'liked'}, status=status.HTTP_201_CREATED)
+        return change_like(request, post, 'post')
+
+    def perform_destroy(self, instance):
+        # Likes on the post and its comments cascade away with it.
+        with transaction.atomic():
+            for model in (Like, ArchivedLike):
+                karma.forget_likes(model.objects.filter(Q(post=instance) | Q(comment__post=instance)))
+            response_cache.bump('feed', response_cache.post_scope(instance.id))
+            instance.delete()
 
     @action(detail=True, methods=['get'])
     def comments(self, request, pk=None):
-        post = self.get_object()
-        # To avoid N+1, we fetch all comments for this post in one go.
-        # Then we build the tree in memory.
-        all_comments = Comment.objects.filter(post=post).annotate(
-            like_count=Count('likes')
-        ).select_related('author').order_by('timestamp')
-        
-        # Build a parent-child mapping
-        comment_map = {c.id: c for c in all_comments}
-        root_comments = []
-        for c in all_comments:
-            c.prefetched_replies = []
-            if c.parent_id:
-                parent = comment_map.get(c.parent_id)
-                if parent:
-                    if not hasattr(parent, 'prefetched_replies'):
-                        parent.prefetched_replies = []
-                    parent.prefetched_replies.append(c)
-            else:
-                root_comments.append(c)
-        
-        serializer = CommentSerializer(root_comments, many=True, context={'request': request})
-        return response.Response(serializer.data)
+        try:
+            post_id = int(pk)
+        except ValueError:
+            raise NotFound()
+        scopes = [response_cache.post_scope(post_id)]
+        return cached_page(request, 'comments', scopes, lambda: self._comment_page(post_id), 'comment')
+
+    def _comment_page(self, post_id):
+        post = get_object_or_404(Post.objects.only('id'), pk=post_id)
+        # Roots are keyset-paginated and their replies come from one range
+        # scan over the materialized path, with a per-node cap (?replies=) and
+        # a depth slice (?depth=), so a call's cost is bounded by its limits
+        # rather than by the size of the thread. Rows stay .values() dicts and
+        # are rendered without per-node serializers.
+        request = self.request
+        comments = thread_queryset(post.id, request)
+        paginator = CommentPagination()
+        roots = paginator.paginate_queryset(comments.filter(parent__isnull=True), request, view=self)
+        depth, reply_cap = comment_tree.tree_limits(request)
+        tree = comment_tree.build_tree(roots, comments, depth, reply_cap, request, paginator)
+        return paginator.get_paginated_response(tree).data
 
 class CommentViewSet(viewsets.ModelViewSet):
-    queryset = Comment.objects.annotate(like_count=Count('likes'))
+    queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [permissions.AllowAny]
 
+    def get_queryset(self):
+        return comment_queryset(self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        # Every comment is listed at its own level, so none nests its replies;
+        # those that have some link to them through ``more_replies``.
+        rows = thread_queryset(None, request).order_by('id')
+        nodes = comment_tree.build_tree(rows, rows, 1, comment_tree.DEFAULT_REPLIES, request, CommentPagination())
+        return response.Response(self._overlay(nodes))
+
+    def retrieve(self, request, *args, **kwargs):
+        """One comment and its replies, limited by ``?depth=`` and ``?replies=`` like the thread."""
+        try:
+            comment_id = int(kwargs[self.lookup_field])
+        except ValueError:
+            raise NotFound()
+        post_id = Comment.objects.filter(pk=comment_id).values_list('post_id', flat=True).first()
+        if post_id is None:
+            raise NotFound()
+        comments = thread_queryset(post_id, request)
+        depth, reply_cap = comment_tree.tree_limits(request)
+        tree = comment_tree.build_tree(
+            comments.filter(pk=comment_id), comments, depth, reply_cap, request, CommentPagination(),
+        )
+        return response.Response(self._overlay(tree)[0])
+
+    def _overlay(self, nodes):
+        # The viewer's liked bits in one query for the whole tree, as on cached pages.
+        response_cache.overlay_user_has_liked(nodes, self.request.user, 'comment')
+        return like_buffer.overlay(nodes, self.request.user, 'comment')
+
+    @action(detail=True, methods=['get'])
+    def replies(self, request, pk=None):
+        """One page of a comment's replies, each with its own depth-limited subtree."""
+        try:
+            comment_id = int(pk)
+        except ValueError:
+            raise NotFound()
+        post_id = Comment.objects.filter(pk=comment_id).values_list('post_id', flat=True).first()
+        if post_id is None:
+            raise NotFound()
+        scopes = [response_cache.post_scope(post_id)]
+        return cached_page(request, 'comments', scopes, lambda: self._replies_page(post_id, comment_id), 'comment')
+
+    def _replies_page(self, post_id, comment_id):
+        request = self.request
+        comments = thread_queryset(post_id, request)
+        paginator = CommentPagination()
+        children = paginator.paginate_queryset(comments.filter(parent_id=comment_id), request, view=self)
+        depth, reply_cap = comment_tree.tree_limits(request)
+        tree = comment_tree.build_tree(children, comments, depth, reply_cap, request, paginator)
+        return paginator.get_paginated_response(tree).data
+
     def perform_create(self, serializer):
         """
         Create a comment with the authenticated user as author.
         If not authenticated, use guest user.
         """
-        print(f"DEBUG: Creating comment. User authenticated: {self.request.user.is_authenticated}")
-        print(f"DEBUG: User: {self.request.user}")
-        
-        if self.request.user.is_authenticated:
-            print(f"DEBUG: Saving comment with author: {self.request.user.username}")
-            serializer.save(author=self.request.user)
-        else:
-            default_user, _ = User.objects.get_or_create(username='guest', defaults={'is_active': True})
-            print(f"DEBUG: Saving comment with guest author")
-            serializer.save(author=default_user)
+        with transaction.atomic():
+            author = identity.acting_user(self.request)
+            serializer.save(author=author)
+            Post.objects.filter(pk=serializer.instance.post_id).update(
+                comment_count=F('comment_count') + 1, hot_score=hot.bumped(comments=1),
+            )
+            response_cache.bump('feed', response_cache.post_scope(serializer.instance.post_id))
+            events.comment_created(serializer.instance)
+        logger.debug(
+            "comment created id=%s post=%s parent=%s author=%s authenticated=%s",
+            serializer.instance.id, serializer.instance.post_id, serializer.instance.parent_id,
+            author.username, self.request.user.is_authenticated,
+        )
 
-    @action(detail=True, methods=['post'])
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            serializer.save()
+            response_cache.bump(response_cache.post_scope(serializer.instance.post_id))
+
+    @action(detail=True, methods=['post', 'put', 'delete'])
     def like(self, request, pk=None):
+        """PUT likes and DELETE unlikes, both idempotent; POST toggles."""
         comment = self.get_object()
-        print(f"DEBUG: Like comment. Authenticated user: {request.user.is_authenticated}")
-        print(f"DEBUG: Comment author: {comment.author.username}")
-        print(f"DEBUG: Comment ID: {pk}")
         if request.user.is_authenticated and comment.author_id == request.user.id:
             return response.Response(
                 {'detail': 'You cannot like your own comment.'},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        
-        # Use authenticated user or create guest user for likes
-        if request.user.is_authenticated:
-            user = request.user
-            print(f"DEBUG: Like from user: {user.username}")
-        else:
-            user, _ = User.objects.get_or_create(username='guest', defaults={'is_active': True})
-            print(f"DEBUG: Like from guest user")
-        
-        like, created = Like.objects.get_or_create(user=user, comment=comment)
-        if not created:
-            like.delete()
-            print(f"DEBUG: Unlike - like deleted")
-            return response.Response({'status': 'unliked'}, status=status.HTTP_200_OK)
-        print(f"DEBUG: Like created. Comment author karma should increase by 1")
-        return response.Response({'status': 'liked'}, status=status.HTTP_201_CREATED)
+        return change_like(request, comment, 'comment')
+
+    def perform_destroy(self, instance):
+        # Replies cascade with their parent, so their likes leave the ledger too.
+        comment_ids = list(Comment.objects.subtree(instance).values_list('id', flat=True))
+        with transaction.atomic():
+            for model in (Like, ArchivedLike):
+                karma.forget_likes(model.objects.filter(comment_id__in=comment_ids))
+            Post.objects.filter(pk=instance.post_id).update(
+                comment_count=F('comment_count') - len(comment_ids), hot_score=hot.bumped(comments=-len(comment_ids)),
+            )
+            response_cache.bump('feed', response_cache.post_scope(instance.post_id))
+            instance.delete()
 
 class LeaderboardViewSet(viewsets.ViewSet):
     permission_classes = [permissions.AllowAny]
 
     def list(self, request):
-        now = timezone.now()
-        yesterday = now - timedelta(hours=24)
+        # Karma is based on likes RECEIVED on a user's posts/comments, NOT likes
+        # created by the user. Requests read a periodically rebuilt snapshot and
+        # never wait for the ranking to be recomputed.
+        return response.Response(leaderboard.top(leaderboard.requested_limit(request.query_params)))
 
-        # Calculate karma based on likes RECEIVED on user's posts/comments
-        # NOT likes created by the user
-        users_data = []
-        
-        for user in User.objects.all():
-            # Count likes on this user's posts in last 24h
-            post_likes = Like.objects.filter(
-                post__author=user,
-                timestamp__gte=yesterday
-            ).exclude(user=user).count()
-            recent_post_karma = post_likes * 5
-            
-            # Count likes on this user's comments in last 24h
-            comment_likes = Like.objects.filter(
-                comment__author=user,
-                timestamp__gte=yesterday
-            ).exclude(user=user).count()
-            recent_comment_karma = comment_likes * 1
-            
-            recent_karma = recent_post_karma + recent_comment_karma
-            
-            # Calculate all-time karma
-            post_likes_total = Like.objects.filter(post__author=user).exclude(user=user).count()
-            total_post_karma = post_likes_total * 5
-            
-            comment_likes_total = Like.objects.filter(comment__author=user).exclude(user=user).count()
-            total_comment_karma = comment_likes_total * 1
-            
-            total_karma = total_post_karma + total_comment_karma
-            
-            if recent_karma > 0:  # Only include users with recent activity
-                users_data.append({
-                    'id': user.id,
-                    'username': user.username,
-                    'recent_karma': recent_karma,
-                    'total_karma': total_karma,
-                })
-        
-        # Sort by recent karma and take top 5
-        users_data.sort(key=lambda x: x['recent_karma'], reverse=True)
-        return response.Response(users_data[:5])
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def search_view(request):
+    """Posts and comments matching every word of ?q=, best match first (see core/search.py)."""
+    words = search.terms(request.query_params.get('q'))
+    if not words:
+        raise ParseError('Search with ?q=<words>.')
+    paginator = SearchPagination()
+    rows = paginator.paginate_queryset(lambda after, limit: search.matches(words, after, limit), request)
+    return paginator.get_paginated_response(SearchHitSerializer(search.hits(rows), many=True).data)
+
+
+@require_GET
+async def events_view(request):
+    """Server-Sent Events stream of feed changes (see core/events.py)."""
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI an endless stream would pin a worker for good.
+        return JsonResponse({'detail': 'Live events are only served under ASGI.'}, status=501)
+    subscription = events.broadcaster.subscribe()
+    stream = StreamingHttpResponse(
+        events.stream(subscription, settings.EVENTS_HEARTBEAT), content_type='text/event-stream'
+    )
+    stream['Cache-Control'] = 'no-cache'
+    stream['X-Accel-Buffering'] = 'no'
+    return stream
 
 
 # Auth endpoints
@@ -191,17 +359,7 @@ def login_view(request):
     
     login(request, user)
     
-    # Calculate karma for this user
-    now = timezone.now()
-    yesterday = now - timedelta(hours=24)
-    
-    post_likes = Like.objects.filter(post__author=user, timestamp__gte=yesterday).exclude(user=user).count() * 5
-    comment_likes = Like.objects.filter(comment__author=user, timestamp__gte=yesterday).exclude(user=user).count() * 1
-    recent_karma = post_likes + comment_likes
-    
-    post_likes_total = Like.objects.filter(post__author=user).exclude(user=user).count() * 5
-    comment_likes_total = Like.objects.filter(comment__author=user).exclude(user=user).count() * 1
-    total_karma = post_likes_total + comment_likes_total
+    recent_karma, total_karma = karma.summary(user)
     
     # Return user info
     return response.Response({
@@ -229,30 +387,8 @@ def logout_view(request):
 def me_view(request):
     """Get current authenticated user"""
     if request.user.is_authenticated:
-        # Calculate karma for this user based on likes RECEIVED
-        now = timezone.now()
-        yesterday = now - timedelta(hours=24)
-        
-        # Likes on this user's POSTS in last 24h
-        post_likes_recent = Like.objects.filter(
-            post__author=request.user, 
-            timestamp__gte=yesterday
-        ).exclude(user=request.user)
-        post_likes_count = post_likes_recent.count()
-        
-        # Likes on this user's COMMENTS in last 24h
-        comment_likes_recent = Like.objects.filter(
-            comment__author=request.user, 
-            timestamp__gte=yesterday
-        ).exclude(user=request.user)
-        comment_likes_count = comment_likes_recent.count()
-        
-        recent_karma = (post_likes_count * 5) + (comment_likes_count * 1)
-        
-        # All-time karma
-        post_likes_total = Like.objects.filter(post__author=request.user).exclude(user=request.user).count()
-        comment_likes_total = Like.objects.filter(comment__author=request.user).exclude(user=request.user).count()
-        total_karma = (post_likes_total * 5) + (comment_likes_total * 1)
+        # Karma is based on likes RECEIVED
+        recent_karma, total_karma = karma.summary(request.user)
         
         return response.Response({
             'id': request.user.id,
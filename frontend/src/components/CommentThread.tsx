@@ -1,5 +1,5 @@
 
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { Avatar, AvatarFallback, AvatarImage } from '../components/ui/avatar';
 import { Button } from '../components/ui/button';
 import { Input } from '../components/ui/input';
@@ -21,10 +21,34 @@ export const CommentThread: React.FC<CommentThreadProps> = ({
 }) => {
   const [isReplying, setIsReplying] = useState(false);
   const [replyText, setReplyText] = useState('');
+  // Replies shown so far, and the link to the ones the thread left out
+  const [replies, setReplies] = useState<Comment[]>(comment.replies || []);
+  const [moreReplies, setMoreReplies] = useState<string | null>(comment.moreReplies || null);
+  const [loadingReplies, setLoadingReplies] = useState(false);
+
+  useEffect(() => {
+    setReplies(comment.replies || []);
+    setMoreReplies(comment.moreReplies || null);
+  }, [comment]);
+
+  const handleShowMoreReplies = async () => {
+    if (!moreReplies || loadingReplies) return;
+    setLoadingReplies(true);
+    try {
+      // The link pages through all of the replies, including those already shown.
+      const page = await apiService.getReplies(moreReplies);
+      setReplies(prev => [...prev, ...page.items.filter(r => !prev.some(existing => existing.id === r.id))]);
+      setMoreReplies(page.next);
+    } catch (error) {
+      console.error('Failed to fetch replies:', error);
+    } finally {
+      setLoadingReplies(false);
+    }
+  };
 
   const handleLike = async () => {
     try {
-      await apiService.likeComment(comment.id);
+      await apiService.likeComment(comment.id, comment.isLiked);
       onUpdate();
     } catch (error) {
       console.error('Failed to like comment:', error);
@@ -121,9 +145,9 @@ export const CommentThread: React.FC<CommentThreadProps> = ({
           )}
 
           {/* Recursive Replies Container */}
-          {comment.replies && comment.replies.length > 0 && (
+          {(replies.length > 0 || moreReplies) && (
             <div className="ml-6 border-l-2 border-slate-50 pl-6">
-              {comment.replies.map((reply) => (
+              {replies.map((reply) => (
                 <CommentThread 
                   key={reply.id} 
                   comment={reply} 
@@ -132,6 +156,17 @@ export const CommentThread: React.FC<CommentThreadProps> = ({
                   depth={depth + 1}
                 />
               ))}
+              {moreReplies && (
+                <Button
+                  variant="ghost"
+                  size="sm"
+                  onClick={handleShowMoreReplies}
+                  disabled={loadingReplies}
+                  className="mt-3 text-[11px] font-extrabold text-slate-400 hover:text-indigo-600"
+                >
+                  {loadingReplies ? 'Loading...' : 'Show more replies'}
+                </Button>
+              )}
             </div>
           )}
         </div>
@@ -1,5 +1,5 @@
 
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { Avatar, AvatarFallback, AvatarImage } from '../components/ui/avatar';
 import { Button } from '../components/ui/button';
 import { Card, CardContent } from '../components/ui/card';
@@ -17,12 +17,17 @@ export const Feed: React.FC<FeedProps> = ({ currentUser, onKarmaUpdate }) => {
   const [newPostContent, setNewPostContent] = useState('');
   const [loading, setLoading] = useState(true);
   const [isSubmitting, setIsSubmitting] = useState(false);
+  // Cursor of the next feed page; null once the end of the feed is reached
+  const [nextPage, setNextPage] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const sentinel = useRef<HTMLDivElement>(null);
 
   const fetchPosts = async () => {
     setLoading(true);
     try {
-      const data = await apiService.getPosts();
-      setPosts(data);
+      const page = await apiService.getPosts();
+      setPosts(page.items);
+      setNextPage(page.next);
     } catch (error) {
       console.error('Failed to fetch posts:', error);
     } finally {
@@ -30,10 +35,36 @@ export const Feed: React.FC<FeedProps> = ({ currentUser, onKarmaUpdate }) => {
     }
   };
 
+  const loadMore = async () => {
+    if (!nextPage || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const page = await apiService.getPosts(nextPage);
+      // A post can shift onto the next page while scrolling; keep the first copy.
+      setPosts(prev => [...prev, ...page.items.filter(p => !prev.some(existing => existing.id === p.id))]);
+      setNextPage(page.next);
+    } catch (error) {
+      console.error('Failed to fetch more posts:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   useEffect(() => {
     fetchPosts();
   }, []);
 
+  // Infinite scroll: load the next page when the end of the list comes into view.
+  useEffect(() => {
+    const node = sentinel.current;
+    if (!node || !nextPage) return;
+    const observer = new IntersectionObserver(entries => {
+      if (entries[0].isIntersecting) loadMore();
+    }, { rootMargin: '400px' });
+    observer.observe(node);
+    return () => observer.disconnect();
+  }, [nextPage, loadingMore, loading]);
+
   const handleCreatePost = async () => {
     if (!newPostContent.trim()) return;
     setIsSubmitting(true);
@@ -51,7 +82,8 @@ export const Feed: React.FC<FeedProps> = ({ currentUser, onKarmaUpdate }) => {
 
   const handleLike = async (postId: string) => {
     try {
-      await apiService.likePost(postId);
+      const post = posts.find(p => p.id === postId);
+      await apiService.likePost(postId, post?.isLiked ?? false);
       setPosts(prev => prev.map(p => {
         if (p.id === postId) {
           const isCurrentlyLiked = p.isLiked;
@@ -131,6 +163,18 @@ export const Feed: React.FC<FeedProps> = ({ currentUser, onKarmaUpdate }) => {
             />
           ))
         )}
+        {!loading && nextPage && (
+          <div ref={sentinel} className="flex justify-center">
+            <Button
+              variant="ghost"
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="text-sm font-bold text-slate-500 hover:text-indigo-600"
+            >
+              {loadingMore ? 'Loading...' : 'Load more posts'}
+            </Button>
+          </div>
+        )}
       </div>
     </div>
   );
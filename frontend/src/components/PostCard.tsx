@@ -19,13 +19,35 @@ export const PostCard: React.FC<PostCardProps> = ({ post, onLike, onCommentUpdat
   const [comments, setComments] = useState<Comment[]>([]);
   const [newComment, setNewComment] = useState('');
   const [isTreeLoading, setIsTreeLoading] = useState(false);
+  // Cursor of the next page of top-level comments, if there is one
+  const [nextComments, setNextComments] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+
+  const refreshComments = async () => {
+    const page = await apiService.getComments(post.id);
+    setComments(page.items);
+    setNextComments(page.next);
+  };
+
+  const loadMoreComments = async () => {
+    if (!nextComments || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const page = await apiService.getComments(post.id, nextComments);
+      setComments(prev => [...prev, ...page.items.filter(c => !prev.some(existing => existing.id === c.id))]);
+      setNextComments(page.next);
+    } catch (error) {
+      console.error('Failed to fetch more comments:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
   const toggleComments = async () => {
     if (!showComments) {
       setIsTreeLoading(true);
       try {
-        const tree = await apiService.getComments(post.id);
-        setComments(tree);
+        await refreshComments();
       } catch (error) {
         console.error('Failed to fetch comments:', error);
       } finally {
@@ -40,8 +62,7 @@ export const PostCard: React.FC<PostCardProps> = ({ post, onLike, onCommentUpdat
     try {
       await apiService.createComment(post.id, null, newComment);
       setNewComment('');
-      const updatedComments = await apiService.getComments(post.id);
-      setComments(updatedComments);
+      await refreshComments();
       onCommentUpdate();
     } catch (error) {
       console.error('Failed to create comment:', error);
@@ -139,12 +160,24 @@ export const PostCard: React.FC<PostCardProps> = ({ post, onLike, onCommentUpdat
                     comment={comment} 
                     postId={post.id}
                     onUpdate={async () => {
-                      const updatedComments = await apiService.getComments(post.id);
-                      setComments(updatedComments);
+                      await refreshComments();
                       onCommentUpdate();
                     }}
                   />
                 ))}
+                {nextComments && (
+                  <div className="flex justify-center">
+                    <Button
+                      variant="ghost"
+                      size="sm"
+                      onClick={loadMoreComments}
+                      disabled={loadingMore}
+                      className="text-xs font-extrabold text-slate-400 hover:text-indigo-600"
+                    >
+                      {loadingMore ? 'Loading...' : 'Load more comments'}
+                    </Button>
+                  </div>
+                )}
                 {comments.length === 0 && (
                   <div className="text-center py-6">
                     <p className="text-sm font-bold text-slate-300">No responses yet</p>
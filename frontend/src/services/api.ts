@@ -1,3 +1,5 @@
+import { Comment, Post } from '../types';
+
 const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://localhost:8000/api';
 
 // In-memory CSRF token storage for cross-domain requests
@@ -32,9 +34,10 @@ async function ensureCSRFToken() {
   }
 }
 
-// Helper for API calls with error handling
+// Helper for API calls with error handling. `endpoint` is a path under the API,
+// or a full URL from a response (a `next` cursor or a `more_replies` link).
 async function apiCall(endpoint: string, options: RequestInit = {}) {
-  const url = `${API_BASE_URL}${endpoint}`;
+  const url = /^https?:\/\//.test(endpoint) ? endpoint : `${API_BASE_URL}${endpoint}`;
 
   const method = (options.method || 'GET').toString().toUpperCase();
 
@@ -84,24 +87,34 @@ async function apiCall(endpoint: string, options: RequestInit = {}) {
   }
 }
 
+export interface Page<T> {
+  items: T[];
+  next: string | null;
+}
+
+function transformPost(post: any): Post {
+  return {
+    id: String(post.id),
+    content: post.content,
+    author: {
+      id: String(post.author.id),
+      username: post.author.username,
+      avatar: getAvatar(post.author.username),
+      totalKarma: 0,
+    },
+    createdAt: new Date(post.timestamp),
+    isLiked: post.user_has_liked,
+    likesCount: post.like_count || 0,
+    commentsCount: post.comment_count || 0,
+  };
+}
+
 export const apiService = {
   // Posts
-  async getPosts() {
-    const data = await apiCall('/posts/');
-    return data.map((post: any) => ({
-      id: String(post.id),
-      content: post.content,
-      author: {
-        id: String(post.author.id),
-        username: post.author.username,
-        avatar: getAvatar(post.author.username),
-        totalKarma: 0,
-      },
-      createdAt: new Date(post.timestamp),
-      isLiked: post.user_has_liked,
-      likesCount: post.like_count || 0,
-      commentsCount: post.comment_count || 0,
-    }));
+  async getPosts(next: string | null = null): Promise<Page<Post>> {
+    // The feed is cursor-paginated: { next, results }; pass `next` back for the following page
+    const data = await apiCall(next || '/posts/');
+    return { items: data.results.map(transformPost), next: data.next };
   },
 
   async createPost(content: string) {
@@ -111,19 +124,27 @@ export const apiService = {
     });
   },
 
-  async likePost(postId: string) {
+  // PUT likes and DELETE unlikes; both are safe to repeat (e.g. on a double click)
+  async likePost(postId: string, isLiked: boolean) {
     return await apiCall(`/posts/${postId}/like/`, {
-      method: 'POST',
+      method: isLiked ? 'DELETE' : 'PUT',
     });
   },
 
   // Comments
-  async getComments(postId: string) {
-    const data = await apiCall(`/posts/${postId}/comments/`);
-    return this.transformComments(data);
+  async getComments(postId: string, next: string | null = null): Promise<Page<Comment>> {
+    // Root comments are cursor-paginated: { next, results }
+    const data = await apiCall(next || `/posts/${postId}/comments/`);
+    return { items: this.transformComments(data.results), next: data.next };
   },
 
-  transformComments(comments: any[]): any[] {
+  // A comment's replies, from its `moreReplies` link or a previous page's `next`
+  async getReplies(url: string): Promise<Page<Comment>> {
+    const data = await apiCall(url);
+    return { items: this.transformComments(data.results), next: data.next };
+  },
+
+  transformComments(comments: any[]): Comment[] {
     return comments.map(comment => ({
       id: String(comment.id),
       content: comment.content,
@@ -138,6 +159,7 @@ export const apiService = {
       likesCount: comment.like_count || 0,
       parentId: comment.parent ? String(comment.parent) : null,
       replies: comment.replies ? this.transformComments(comment.replies) : [],
+      moreReplies: comment.more_replies || null,
     }));
   },
 
@@ -152,9 +174,9 @@ export const apiService = {
     });
   },
 
-  async likeComment(commentId: string) {
+  async likeComment(commentId: string, isLiked: boolean) {
     return await apiCall(`/comments/${commentId}/like/`, {
-      method: 'POST',
+      method: isLiked ? 'DELETE' : 'PUT',
     });
   },
 
@@ -15,6 +15,8 @@ export interface Comment {
   likesCount: number;
   replies?: Comment[];
   parentId?: string | null;
+  // Link to the replies the thread left out (past the reply cap or depth), if any
+  moreReplies?: string | null;
 }
 
 export interface Post {